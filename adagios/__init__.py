@@ -15,61 +15,113 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import importlib
 import os.path
+import pkgutil
+import threading
+
+from adagios.notification_store import NotificationStore
 
 __version__ = '2.0.1'
 
-notifications = {}
+# Shared by every worker process, see adagios.notification_store
+notifications = NotificationStore()
 active_plugins = {}
+failed_plugins = {}
 tasks = []
 misc_menubar_items = []
 menubar_items = []
 
+# Importing adagios must stay cheap, it happens in every worker after every
+# restart. Plugins in settings.plugins are registered when the URLconf is
+# loaded or a page is rendered, see activate_plugins(), and a plugin module
+# itself is only imported when one of its urls is visited.
+_plugins_lock = threading.Lock()
+
+
 def add_plugin(name="myplugin", modulepath=None):
     """ Adds a new django application dynamically to adagios.
 
+    The plugin is not imported here. Its urls are included lazily, and its
+    menubar templates are found without importing it.
     """
     if name in active_plugins:
         return None
     if not modulepath:
         modulepath=name
 
-    plugin_module = __import__(modulepath, fromlist=modulepath.split()).__file__
-    template_dir = os.path.dirname(plugin_module) + "/templates/"
+    with _plugins_lock:
+        if name in active_plugins:
+            return None
+        template_dir = _get_module_directory(modulepath) + "/templates/"
+
+        # Add plugin to urls. Unlike include(), _PluginUrls imports the plugin
+        # urls the first time a request needs them.
+        # adagios.urls calls activate_plugins() while it is being imported,
+        # import_module() returns it as it is.
+        urls = importlib.import_module('adagios.urls')
+        from django.core.urlresolvers import RegexURLResolver
+        urls.urlpatterns.append(RegexURLResolver(r'^%s' % name, _PluginUrls(name, modulepath)))
+        # if plugin has menubar items, find them and list them
+        if os.path.isfile(template_dir + "%s_menubar_misc.html" %name):
+            misc_menubar_items.append( "%s_menubar_misc.html" % name)
+        if os.path.isfile(template_dir + "%s_menubar.html" %name):
+            menubar_items.append( "%s_menubar.html" % name)
+        active_plugins[name] = modulepath
+
 
+def _disable_plugin(name, modulepath):
+    """ Moves a plugin that turned out to be broken from active_plugins to failed_plugins """
+    with _plugins_lock:
+        active_plugins.pop(name, None)
+        failed_plugins[name] = modulepath
+        for items, template in ((misc_menubar_items, "%s_menubar_misc.html" % name), (menubar_items, "%s_menubar.html" % name)):
+            if template in items:
+                items.remove(template)
+
+
+class _PluginUrls(object):
+    """ urlpatterns of a plugin, imported the first time they are needed
+
+    Django reverses urls by going through every pattern, so a plugin whose
+    urls can not be imported gets no patterns and is disabled, instead of
+    breaking every page.
+    """
 
-    active_plugins[name] = modulepath
+    def __init__(self, name, modulepath):
+        self.name = name
+        self.modulepath = modulepath
+        self._urlpatterns = None
 
-    # Add plugin to INSTALLED_APPLICATIONS
-    #import adagios.settings
-    #adagios.settings.INSTALLED_APPS.append(modulepath)
-    # Add plugin to urls
-    import adagios.urls
-    from django.conf.urls import patterns, include
-    new_pattern = patterns('',
-        (r'^%s'%name, include("%s.urls" % modulepath) ),
-    )
-    adagios.urls.urlpatterns += new_pattern
-    # if plugin has menubar items, find them and list them
-    if os.path.isfile(template_dir + "%s_menubar_misc.html" %name):
-        misc_menubar_items.append( "%s_menubar_misc.html" % name)
-    if os.path.isfile(template_dir + "%s_menubar.html" %name):
-        menubar_items.append( "%s_menubar.html" % name)
+    @property
+    def urlpatterns(self):
+        if self._urlpatterns is None:
+            try:
+                self._urlpatterns = list(importlib.import_module("%s.urls" % self.modulepath).urlpatterns)
+            except Exception:
+                self._urlpatterns = []
+                _disable_plugin(self.name, self.modulepath)
+        return self._urlpatterns
 
+    def __repr__(self):
+        return "%s.urls" % self.modulepath
 
 
-# Any plugins og third party extensions to adagios are loaded here.
-# We will silently ignore any errors and make sure that the webserver
-# will successfully start up if any of the plugins have errors
-try:
+def activate_plugins():
+    """ Adds every plugin in settings.plugins. Plugins that fail are not tried again. """
     from adagios import settings
-    for k,v in list(settings.plugins.items()):
+    for name, modulepath in list(settings.plugins.items()):
+        if name in active_plugins or failed_plugins.get(name) == modulepath:
+            continue
         try:
-            add_plugin(k,v)
+            add_plugin(name, modulepath)
         except Exception:
-            pass
-except Exception:
-    pass
+            failed_plugins[name] = modulepath
 
-import adagios.profiling
 
+def _get_module_directory(modulepath):
+    """ Returns the directory of modulepath, without importing it """
+    loader = pkgutil.get_loader(modulepath)
+    if loader is None:
+        raise ImportError("No module named %s" % modulepath)
+    return os.path.dirname(loader.get_filename(modulepath))
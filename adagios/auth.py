@@ -21,6 +21,9 @@
 
 from builtins import str
 from builtins import object
+import threading
+import time
+
 import adagios.status.utils
 import adagios.views
 
@@ -82,16 +85,15 @@ def check_access_to_path(request, path):
 
     path in this case is a full path to a python module name for example: "adagios.objectbrowser.views.index"
     """
-    for search_path, role in access_list:
-        if path.startswith(search_path):
-            if has_role(request, role):
-                return None
-            else:
-                user = request.META.get('REMOTE_USER', 'anonymous')
-                message = "You do not have permission to access %s" % (path, )
-                raise adagios.exceptions.AccessDenied(user, access_required=role, message=message, path=path)
-    else:
+    rule = _match_path(path)
+    if rule is None:
+        return None
+    search_path, role = rule
+    if has_role(request, role):
         return None
+    user = request.META.get('REMOTE_USER', 'anonymous')
+    message = "You do not have permission to access %s" % (path, )
+    raise adagios.exceptions.AccessDenied(user, access_required=role, message=message, path=path)
 
 
 def has_access_to_path(request, path):
@@ -100,11 +102,93 @@ def has_access_to_path(request, path):
      Arguments:
         path  -- string describing a path to a method or module, example: "adagios.objectbrowser.views.index"
     """
-    for search_path, role in access_list:
-        if path.startswith(search_path):
-            return has_role(request, role)
-    else:
+    rule = _match_path(path)
+    if rule is None:
         return False
+    search_path, role = rule
+    return has_role(request, role)
+
+
+# Which rule in access_list applies to a path. A view is checked on every
+# request, so the answer is remembered until access_list changes.
+_path_rules = {'access_list': None, 'matches': {}}
+_path_rules_lock = threading.Lock()
+
+
+def _match_path(path):
+    """ Returns the first (search_path, role) in access_list that path starts with, or None """
+    with _path_rules_lock:
+        if _path_rules['access_list'] != access_list:
+            _path_rules['access_list'] = list(access_list)
+            _path_rules['matches'] = {}
+        matches = _path_rules['matches']
+        if path not in matches:
+            matches[path] = None
+            for search_path, role in _path_rules['access_list']:
+                if path.startswith(search_path):
+                    matches[path] = (search_path, role)
+                    break
+        return matches[path]
+
+
+class RoleCache(object):
+    """ Which contactgroups every contact is a member of, fetched with one livestatus query
+
+    has_role() looks up memberships here instead of asking livestatus on every
+    authorization check. The snapshot is refreshed every role_cache_ttl seconds
+    and whenever nagios has been restarted or reloaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timestamp = 0
+        self._program_start = None
+        self._contacts = set()
+        # contact name -> set of contactgroup names
+        self._memberships = {}
+
+    def is_contact(self, user):
+        self._refresh_if_needed()
+        return user in self._contacts
+
+    def get_contactgroups(self, user):
+        """ Returns a set with the name of every contactgroup user is a member of """
+        self._refresh_if_needed()
+        return self._memberships.get(user, set())
+
+    def clear(self):
+        with self._lock:
+            self._timestamp = 0
+
+    def refresh(self):
+        """ Fetch every contact and contactgroup membership from livestatus """
+        contacts = adagios.status.utils.get_contacts(None, 'Columns: name')
+        contactgroups = adagios.status.utils.get_contactgroups(None, 'Columns: name members')
+        memberships = {}
+        for contactgroup in contactgroups:
+            for member in contactgroup.get('members') or []:
+                memberships.setdefault(member, set()).add(contactgroup['name'])
+        with self._lock:
+            self._contacts = set(x['name'] for x in contacts)
+            self._memberships = memberships
+            self._timestamp = time.time()
+            self._program_start = self._get_program_start()
+
+    def _get_program_start(self):
+        # Only what the probe already knows, asking nagios here would defeat the cache
+        import adagios.daemon
+        status = adagios.daemon.status_probe.get_cached()
+        return status and status.get('program_start')
+
+    def _refresh_if_needed(self):
+        ttl = float(adagios.settings.role_cache_ttl or 0)
+        if ttl and time.time() - self._timestamp < ttl and self._program_start == self._get_program_start():
+            return
+        self.refresh()
+
+
+# One snapshot of contactgroup memberships per worker process
+role_cache = RoleCache()
 
 
 def has_role(request, role):
@@ -120,7 +204,7 @@ def has_role(request, role):
         return False
 
     # Allow if role is "contacts" and user is in fact a valid contact
-    if role == 'contacts' and adagios.status.utils.get_contacts(None, name=user):
+    if role == 'contacts' and role_cache.is_contact(user):
         return True
 
     # Allow if role is "users" and we are in fact logged in
@@ -147,12 +231,9 @@ def has_role(request, role):
     if "everyone" in users_and_groups:
         return True
 
-    # Check if user belongs to any contactgroup that has access
-    contactgroups = adagios.status.utils.get_contactgroups(None, 'Columns: name', 'Filter: members >= %s' % user)
-
-    # Allow if we find user belongs to one contactgroup that has this role
-    for contactgroup in contactgroups:
-        if contactgroup['name'] in users_and_groups:
+    # Allow if user belongs to one contactgroup that has this role
+    for contactgroup in role_cache.get_contactgroups(user):
+        if contactgroup in users_and_groups:
             return True
 
     # If we get here, the user clearly did not have access
@@ -566,7 +566,8 @@ class Hostgroup(BusinessProcess):
          OK if there are no service or host problems
         """
         try:
-            hostgroup = self._livestatus.get_hostgroup(self.name)
+            # load() has usually fetched our hostgroup already
+            hostgroup = getattr(self, '_hostgroup', None) or self._livestatus.get_hostgroup(self.name)
             host_status = hostgroup.get('worst_host_state')
             if host_status > 0:
                 return 2
@@ -20,75 +20,111 @@ import pynag.Model
 import os
 import getpass
 
-from adagios import notifications, settings, add_plugin
+from adagios import notifications, settings
 from adagios.misc.rest import add_notification, clear_notification
-from adagios.daemon import Daemon
+import adagios.daemon
 
 import pynag.Model.EventHandlers
 import pynag.Parsers
-from pynag.Parsers import Livestatus
 import adagios
+import adagios.maincfg
 import adagios.status.utils
+import adagios.status.health
+import adagios.status.counters
 from pynag import Model
 import time
 import datetime
+import logging
+from collections import defaultdict
 from adagios import __version__
 from adagios import userdata
 
 from django.utils.translation import ugettext as _
 
+logger = logging.getLogger(__name__)
+
 def on_page_load(request):
-    """ Collection of actions that take place every page load """
-    results = {}
+    """ Collection of actions that take place every page load
+
+    Reloading the config file and activating the language of the user happen
+    right away. Every other value is wrapped in a LazyContext, and the
+    processor that provides it runs the first time a template reads one of its keys.
+    """
     update_global_variables()
+    _timed(request, reload_configfile)
+    _timed(request, trigger_user_hooks)
 
-    for k, v in list(reload_configfile(request).items()):
-        results[k] = v
-    for k, v in list(get_httpuser(request).items()):
-        results[k] = v
-    for k, v in list(get_tagged_comments(request).items()):
-        results[k] = v
-    for k, v in list(check_nagios_running(request).items()):
-        results[k] = v
-    for k, v in list(get_notifications(request).items()):
-        results[k] = v
-    for k, v in list(get_unhandled_problems(request).items()):
-        results[k] = v
-    for k, v in list(resolve_urlname(request).items()):
-        results[k] = v
-    for k, v in list(check_selinux(request).items()):
-        results[k] = v
-    for k, v in list(activate_plugins(request).items()):
-        results[k] = v
-    for k, v in list(check_destination_directory(request).items()):
-        results[k] = v
-    for k, v in list(check_nagios_cfg(request).items()):
-        results[k] = v
-    for k, v in list(get_current_time(request).items()):
-        results[k] = v
-    for k, v in list(get_okconfig(request).items()):
-        results[k] = v
-    for k, v in list(get_nagios_url(request).items()):
-        results[k] = v
-    for k, v in list(get_local_user(request).items()):
-        results[k] = v
-    for k, v in list(get_current_settings(request).items()):
-        results[k] = v
-    for k, v in list(get_plugins(request).items()):
-        results[k] = v
-    for k, v in list(get_current_version(request).items()):
-        results[k] = v
-    for k, v in list(get_serverside_includes(request).items()):
-        results[k] = v
-    for k, v in list(get_user_preferences(request).items()):
-        results[k] = v
-    for k, v in list(get_all_backends(request).items()):
-        results[k] = v
-    for k, v in list(get_all_nonworking_backends(request).items()):
-        results[k] = v
+    context = LazyContext(request)
+    results = {}
+    for processor, keys in _LAZY_PROCESSORS:
+        for key in keys:
+            results[key] = context.lazy(key)
     return results
 
 
+class LazyContext(object):
+    """ Runs context processors for one request on demand, and remembers their results """
+
+    def __init__(self, request):
+        self.request = request
+        self._results = {}
+        self._finished = set()
+
+    def lazy(self, key):
+        """ Returns a callable that a template can call to get the value of key """
+        def get_value():
+            return self.get(key)
+        return get_value
+
+    def get(self, key):
+        """ Returns the value of key, runs the context processor that provides it if needed. """
+        processor = _PROCESSOR_BY_KEY[key]
+        for dependency in _DEPENDENCIES.get(processor, []):
+            self.run(dependency)
+        self.run(processor)
+        return self._results.get(key, '')
+
+    def run(self, processor):
+        if processor in self._finished:
+            return
+        self._finished.add(processor)
+        result = _timed(self.request, processor)
+        self._results.update(result or {})
+
+
+# Time spent in each context processor since this process started
+processor_statistics = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'max': 0.0})
+
+# Name of the request attribute where we keep timings of the current request
+_TIMINGS_ATTRIBUTE = '_adagios_context_processor_timings'
+
+
+def _timed(request, processor):
+    """ Run processor(request) and record how long it took """
+    start_time = time.time()
+    try:
+        return processor(request)
+    finally:
+        seconds = time.time() - start_time
+        name = processor.__name__
+        statistics = processor_statistics[name]
+        statistics['calls'] += 1
+        statistics['seconds'] += seconds
+        statistics['max'] = max(statistics['max'], seconds)
+        if request is not None:
+            timings = getattr(request, _TIMINGS_ATTRIBUTE, None)
+            if timings is None:
+                timings = []
+                setattr(request, _TIMINGS_ATTRIBUTE, timings)
+            timings.append((name, seconds))
+        logger.debug("Context processor %s took %.4f seconds", name, seconds)
+
+
+def get_timings(request):
+    """ Returns a list of (processor_name, seconds) for every context processor that ran during request """
+    return getattr(request, _TIMINGS_ATTRIBUTE, [])
+
+
 def update_global_variables():
     """Updates all required global variables."""
     pynag.Model.cfg_file = adagios.settings.nagios_config
@@ -139,8 +175,7 @@ def get_serverside_includes(request):
 
 def activate_plugins(request):
     """ Activates any plugins specified in settings.plugins """
-    for k, v in list(settings.plugins.items()):
-        add_plugin(name=k, modulepath=v)
+    adagios.activate_plugins()
     return {'misc_menubar_items': adagios.misc_menubar_items, 'menubar_items': adagios.menubar_items}
 
 
@@ -190,10 +225,8 @@ def get_nagios_url(request):
 def get_tagged_comments(request):
     """ (for status view) returns number of comments that mention the remote_user"""
     try:
-        remote_user = request.META.get('REMOTE_USER', 'anonymous')
-        livestatus = adagios.status.utils.livestatus(request)
-        tagged_comments = livestatus.query(
-            'GET comments', 'Stats: comment ~ %s' % remote_user, columns=False)[0]
+        statistics = _get_counters(request)
+        tagged_comments = statistics['tagged_comments']
         if tagged_comments > 0:
             return {'tagged_comments': tagged_comments}
         else:
@@ -203,62 +236,27 @@ def get_tagged_comments(request):
 
 
 def get_unhandled_problems(request):
-    """ Get number of any unhandled problems via livestatus """
+    """ Get number of any unhandled problems via livestatus
+
+    Counters are shared by every page load of the same user for
+    navbar_push_interval seconds, see adagios.status.counters
+    """
     results = {}
     try:
-        livestatus = adagios.status.utils.livestatus(request)
-        num_problems = livestatus.query('GET services',
-                                        'Filter: state != 0',
-                                        'Filter: acknowledged = 0',
-                                        'Filter: host_acknowledged = 0',
-                                        'Filter: scheduled_downtime_depth = 0',
-                                        'Filter: host_scheduled_downtime_depth = 0',
-                                        'Stats: state != 0',
-                                        'Stats: host_state != 0',
-                                        columns=False)
-        results['num_problems'] = num_problems[0] + num_problems[1]
-        results['num_unhandled_problems'] = num_problems[0] + num_problems[1]
-
-        result = livestatus.query('GET services',
-                                        'Stats: state != 0',
-                                        'Stats: state != 0',
-                                        'Stats: acknowledged = 0',
-                                        'Stats: scheduled_downtime_depth = 0',
-                                        'Stats: host_state = 0',
-                                        'StatsAnd: 4',
-                                        columns=False
-                                        )
-        num_service_problems_all = result[0]
-        num_service_problems_unhandled = result[1]
-
-
-        result = livestatus.query('GET hosts',
-                                        'Stats: state != 0',
-                                        'Stats: state != 0',
-                                        'Stats: acknowledged = 0',
-                                        'Stats: scheduled_downtime_depth = 0',
-                                        'Stats: host_state = 1',
-                                        'StatsAnd: 4',
-                                        columns=False
-                                        )
-        num_host_problems_all = result[0]
-        num_host_problems_unhandled = result[1]
-
-        num_problems_all = num_service_problems_all + num_host_problems_all
-        num_problems_unhandled = num_service_problems_unhandled + num_host_problems_unhandled
-
-        num_problems = num_problems_unhandled
-
-        results = locals()
-        del results['livestatus']
-        del results['result']
-        del results['request']
-
+        statistics = _get_counters(request)
+        for key in adagios.status.counters.COUNTER_KEYS:
+            if key != 'tagged_comments':
+                results[key] = statistics[key]
     except Exception:
         pass
     return results
 
 
+def _get_counters(request):
+    remote_user = request.META.get('REMOTE_USER')
+    return adagios.status.counters.poller.get_counters(remote_user)
+
+
 def check_nagios_cfg(request):
     """ Check availability of nagios.cfg """
     return {'nagios_cfg': pynag.Model.config.cfg_file}
@@ -272,12 +270,10 @@ def check_destination_directory(request):
     # If there are problems with finding nagios.cfg, we don't
     # need to display any errors here regarding destination_directories
     try:
-        Model.config.parse_maincfg()
+        cfg_dirs = adagios.maincfg.get_facts()['cfg_dirs']
     except Exception:
         return {}
-    for k, v in Model.config.maincfg_values:
-        if k != 'cfg_dir':
-            continue
+    for v in cfg_dirs:
         if os.path.normpath(v) == os.path.normpath(dest):
             dest_dir_was_found = True
     if not dest_dir_was_found:
@@ -294,8 +290,7 @@ def check_destination_directory(request):
 def check_nagios_running(request):
     """ Notify user if nagios is not running """
     try:
-        d = Daemon()
-        return {"nagios_running": (d.running())}
+        return {"nagios_running": adagios.daemon.status_probe.get()['running']}
     except Exception:
         return {}
 
@@ -351,6 +346,23 @@ def reload_configfile(request):
     return {}
 
 
+# Name of the request attribute where trigger_user_hooks() keeps the user
+_USER_ATTRIBUTE = '_adagios_user'
+
+
+def trigger_user_hooks(request):
+    """ Applies preferences of the logged-in user that matter for the whole page, like the language.
+
+    Templates translate text before they read user_data, so this can not wait for get_user_preferences().
+    """
+    try:
+        user = userdata.User(request)
+        user.trigger_hooks()
+    except Exception:
+        return
+    setattr(request, _USER_ATTRIBUTE, user)
+
+
 def get_user_preferences(request):
     """ Loads the preferences for the logged-in user. """
     def theme_to_themepath(theme):
@@ -358,8 +370,10 @@ def get_user_preferences(request):
                             theme,
                             settings.THEME_ENTRY_POINT)
     try:
-        user = userdata.User(request)
-        user.trigger_hooks()
+        user = getattr(request, _USER_ATTRIBUTE, None)
+        if user is None:
+            user = userdata.User(request)
+            user.trigger_hooks()
         results = user.to_dict()
     except Exception:
         results = adagios.settings.PREFS_DEFAULT
@@ -373,10 +387,45 @@ def get_all_backends(request):
     return {'backends': backends}
 
 def get_all_nonworking_backends(request):
-    """ Returns the backends which don't answer at the time. """
-    b = [x for x in get_all_backends(request)['backends']
-         if not Livestatus(x).test(raise_error=False)]
+    """ Returns the backends which don't answer at the time.
+
+    Backends are tested in the background, see adagios.status.health
+    """
+    b = adagios.status.health.monitor.get_nonworking_backends()
     return {'nonworking_backends': b}
 
+# Every lazy context processor, and the keys it provides to templates
+_LAZY_PROCESSORS = [
+    (get_httpuser, ['remote_user']),
+    (get_tagged_comments, ['tagged_comments']),
+    (check_nagios_running, ['nagios_running']),
+    (get_notifications, ['notifications']),
+    (get_unhandled_problems, [
+        'num_problems', 'num_unhandled_problems', 'num_service_problems_all', 'num_service_problems_unhandled',
+        'num_host_problems_all', 'num_host_problems_unhandled', 'num_problems_all', 'num_problems_unhandled',
+    ]),
+    (resolve_urlname, ['urlname']),
+    (activate_plugins, ['misc_menubar_items', 'menubar_items']),
+    (check_nagios_cfg, ['nagios_cfg']),
+    (get_current_time, ['current_time', 'current_timestamp']),
+    (get_okconfig, ['okconfig']),
+    (get_nagios_url, ['nagios_url']),
+    (get_local_user, ['local_user']),
+    (get_current_settings, ['settings']),
+    (get_plugins, ['plugins']),
+    (get_current_version, ['adagios_version']),
+    (get_serverside_includes, ['ssi_headers', 'ssi_footers']),
+    (get_user_preferences, ['user_data']),
+    (get_all_backends, ['backends']),
+    (get_all_nonworking_backends, ['nonworking_backends']),
+]
+
+_PROCESSOR_BY_KEY = dict((key, processor) for processor, keys in _LAZY_PROCESSORS for key in keys)
+
+# Processors that only add notifications run before notifications are read
+_DEPENDENCIES = {
+    get_notifications: [check_selinux, check_destination_directory],
+}
+
 if __name__ == '__main__':
     on_page_load(request=None)
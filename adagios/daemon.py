@@ -17,8 +17,13 @@
 
 """Methods for controlling and getting status of the Nagios daemon"""
 
+import os
+import threading
+import time
+
 from pynag.Control import daemon
 from adagios import settings
+import adagios.maincfg
 
 class Daemon(daemon):
     def __init__(self):
@@ -34,4 +39,125 @@ class Daemon(daemon):
         if settings.nagios_service:
             self.service_name = settings.nagios_service
 
+    def running(self):
+        """ Same as pynag's daemon.running() except lock_file is read from adagios.maincfg """
+        if self.method not in (daemon.SYSV_INIT_SCRIPT, daemon.SYSV_INIT_SERVICE):
+            return super(Daemon, self).running()
+        try:
+            lock_file = adagios.maincfg.get_facts(settings.nagios_config or None)['lock_file']
+            with open(lock_file) as f:
+                return bool(f.readline().strip())
+        except Exception:
+            return False
+
+
+class DaemonStatusProbe(object):
+    """ Knows if Nagios is running, without checking the process on every page load.
+
+    A background thread in every worker process refreshes the status every
+    daemon_status_interval seconds, and refresh_after_reload() refreshes it
+    right after adagios reloads or restarts nagios.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = None
+        self._last_reload = None
+        self._thread = None
+        self._pid = None
+
+    def get(self):
+        """ Returns a dict with the last known status of the nagios daemon
+
+        Keys are:
+          running       -- True if nagios is running
+          pid           -- Process id of nagios, or None
+          program_start -- When nagios was last (re)started according to livestatus, or None
+          last_reload   -- When adagios last reloaded or restarted nagios, or None
+          checked_at    -- When this status was collected
+          error         -- Error message if livestatus could not be asked, otherwise None
+        """
+        self.start()
+        status = self._status
+        interval = float(settings.daemon_status_interval or 0)
+        if status is None or not interval:
+            status = self.refresh()
+        return dict(status)
+
+    def get_cached(self):
+        """ Like get(), but never checks nagios. Returns None if nagios has not been checked yet. """
+        self.start()
+        status = self._status
+        if status is None:
+            return None
+        return dict(status)
+
+    def refresh(self):
+        """ Check the status of nagios now, and remember the result """
+        status = {
+            'running': False,
+            'pid': None,
+            'program_start': None,
+            'last_reload': self._last_reload,
+            'checked_at': time.time(),
+            'error': None,
+        }
+        try:
+            status['running'] = Daemon().running()
+        except Exception as e:
+            status['error'] = str(e)
+        try:
+            status['pid'] = self._get_pid()
+        except Exception:
+            pass
+        try:
+            import adagios.status.utils
+            livestatus = adagios.status.utils.livestatus(None)
+            result = livestatus.query('GET status', 'Columns: program_start nagios_pid')
+            if result:
+                status['program_start'] = result[0].get('program_start')
+                status['pid'] = result[0].get('nagios_pid') or status['pid']
+        except Exception as e:
+            status['error'] = str(e)
+        with self._lock:
+            self._status = status
+        return status
+
+    def refresh_after_reload(self):
+        """ Call this after nagios has been reloaded or restarted """
+        self._last_reload = time.time()
+        return self.refresh()
+
+    def _get_pid(self):
+        lock_file = adagios.maincfg.get_facts(settings.nagios_config or None)['lock_file']
+        with open(lock_file) as f:
+            pid = f.readline().strip()
+        return int(pid) if pid else None
+
+    def start(self):
+        """ Start the background refresh thread, unless it is already running in this process """
+        if not settings.daemon_status_interval:
+            return
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='adagios-daemon-status')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                pass
+            time.sleep(float(settings.daemon_status_interval))
+
+
+# One probe per worker process
+status_probe = DaemonStatusProbe()
+
 # vim: sts=4 expandtab autoindent
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Facts about nagios.cfg that many pages need, parsed only when nagios.cfg changes
+
+Example:
+    >>> facts = get_facts() # doctest: +SKIP
+    >>> facts['command_file'] # doctest: +SKIP
+    '/var/spool/nagios/cmd/nagios.cmd'
+"""
+
+import os
+import threading
+
+import pynag.Model
+import pynag.Parsers
+
+# cfg_file -> (stat of cfg_file, facts)
+_cache = {}
+_lock = threading.Lock()
+
+# Settings in nagios.cfg that get a key of their own in get_facts(). The first value found is used.
+_SINGLE_VALUES = [
+    'log_file', 'log_archive_path', 'command_file', 'lock_file', 'status_file',
+    'object_cache_file', 'check_result_path',
+]
+
+
+def _stat(filename):
+    """ Returns something that changes whenever filename is modified or replaced """
+    st = os.stat(filename)
+    return st.st_ino, st.st_mtime, st.st_size
+
+
+def get_facts(cfg_file=None):
+    """ Returns a dict of facts about nagios.cfg
+
+    Arguments:
+        cfg_file -- Path to nagios.cfg. Defaults to the one pynag.Model uses.
+
+    Returns:
+        Dict with the following keys:
+          cfg_file  -- Full path to nagios.cfg
+          values    -- List of (key, value) tuples, every line in nagios.cfg
+          cfg_dirs  -- List of every cfg_dir in nagios.cfg
+          cfg_files -- List of every cfg_file in nagios.cfg
+          log_file, log_archive_path, command_file, lock_file, status_file,
+          object_cache_file, check_result_path -- None if not defined in nagios.cfg
+
+        The same dict is shared by every caller, do not modify it.
+
+    Raises:
+        pynag.Parsers.ParserError if nagios.cfg is not found
+    """
+    if cfg_file is None:
+        cfg_file = pynag.Model.config.cfg_file
+    if not cfg_file:
+        raise pynag.Parsers.ParserError('Could not find nagios.cfg')
+    try:
+        stat = _stat(cfg_file)
+    except OSError:
+        raise pynag.Parsers.ParserError('Could not find nagios.cfg at %s' % cfg_file)
+
+    cached = _cache.get(cfg_file)
+    if cached and cached[0] == stat:
+        return cached[1]
+    with _lock:
+        cached = _cache.get(cfg_file)
+        if cached and cached[0] == stat:
+            return cached[1]
+        facts = _parse(cfg_file)
+        _cache[cfg_file] = (stat, facts)
+    return facts
+
+
+def get_cfg_value(key, cfg_file=None):
+    """ Returns the first value of key in nagios.cfg, or None if it is not there """
+    for k, v in get_facts(cfg_file)['values']:
+        if k == key:
+            return v
+    return None
+
+
+def clear_cache():
+    """ Forget everything we know about every nagios.cfg """
+    with _lock:
+        _cache.clear()
+
+
+def _parse(cfg_file):
+    config = pynag.Parsers.config(cfg_file=cfg_file)
+    config.parse_maincfg()
+    values = list(config.maincfg_values)
+    facts = {
+        'cfg_file': cfg_file,
+        'values': values,
+        'cfg_dirs': [v for k, v in values if k == 'cfg_dir'],
+        'cfg_files': [v for k, v in values if k == 'cfg_file'],
+    }
+    for key in _SINGLE_VALUES:
+        facts[key] = None
+    for k, v in reversed(values):
+        if k in _SINGLE_VALUES:
+            facts[k] = v
+    return facts
@@ -58,6 +58,9 @@ $(document).ready(function() {
     // Handle user contributed ssi overwrites
     adagios.misc.ssi_overwrites();
 
+    // Keep counters in the navigation bar up to date without reloading the page
+    adagios.misc.subscribe_to_navbar_counters();
+
     // Handle user contributed ssi overwrites
     adagios.misc.modal_resize();
 
@@ -968,6 +971,26 @@ adagios.status.delete_downtime = function(object_type, downtime_id) {
 };
 
 
+// Listen for navbar counters pushed from the server (see adagios.status.counters)
+// and update every element marked with class navbar_counter and data-counter.
+adagios.misc.subscribe_to_navbar_counters = function() {
+    if (typeof NAVBAR_PUSH_ENABLED === 'undefined' || !NAVBAR_PUSH_ENABLED || !window.EventSource) {
+        return;
+    }
+    var source = new EventSource(BASE_URL + "status/counters");
+    source.onmessage = function(event) {
+        var counters = JSON.parse(event.data);
+        $(".navbar_counter").each(function() {
+            var value = counters[$(this).data('counter')];
+            if (value === undefined) {
+                return;
+            }
+            $(this).find(".navbar_counter_value").text(value);
+            $(this).toggleClass("hide", !value);
+        });
+    };
+};
+
 // Reload current page in X seconds. (1000 = 1 second). Will not reload if user is
 // Interacting with the page. Any value < 0.01 will be ignored.
 adagios.misc.timed_reload = function(seconds) {
@@ -29,6 +29,7 @@ from django.utils.translation import ugettext as _
 import os.path
 from adagios import settings
 import adagios.utils
+import adagios.maincfg
 from pynag import Model
 from django.core.mail import EmailMultiAlternatives
 import pynag.Parsers
@@ -190,6 +191,7 @@ class AdagiosSettingsForm(forms.Form):
                 attribute=k, new_value=v, filename=settings.adagios_configfile)
             self.adagios_configfile = settings.adagios_configfile
             #settings.__dict__[k] = v
+        settings.bump_config_generation()
 
     def __init__(self, *args, **kwargs):
         # Since this form is always bound, lets fetch current configfiles and
@@ -420,10 +422,9 @@ class PNPBrokerModuleForm(forms.Form):
         if not initial:
             initial = {}
         my_initial = {}
-        Model.config.parse()
-        maincfg_values = Model.config.maincfg_values
+        maincfg_values = adagios.maincfg.get_facts()['values']
         self.nagios_configline = None
-        for k, v in Model.config.maincfg_values:
+        for k, v in maincfg_values:
             if k == 'broker_module' and v.find('npcdmod.o') > 0:
                 self.nagios_configline = v
                 v = v.split()
@@ -531,6 +532,10 @@ class NagiosServiceForm(forms.Form):
         self.stdout = daemon.stdout or ""
         self.stderr = daemon.stderr or ""
         self.exit_code = code
+        if self.command in ("reload", "restart", "start"):
+            adagios.daemon.status_probe.refresh_after_reload()
+        elif self.command == "stop":
+            adagios.daemon.status_probe.refresh()
 
     def verify(self):
         """ Run "nagios -v nagios.cfg" and returns errors/warning
@@ -33,6 +33,7 @@ from pynag import Utils
 from pynag import __version__
 from socket import gethostbyname_ex
 import adagios.settings
+import adagios.daemon
 from adagios.daemon import Daemon
 from django.utils.translation import ugettext as _
 
@@ -249,6 +250,7 @@ def reload_nagios():
     else:
         result['status'] = _("error")
         result['message'] = _("Failed to reload nagios (config error?)")
+    adagios.daemon.status_probe.refresh_after_reload()
     return result
 
 
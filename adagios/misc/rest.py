@@ -24,9 +24,12 @@ This is a rest interface used by the "/rest/" module that affects adagios direct
 """
 
 from builtins import str
+import hashlib
+
 from adagios import __version__, notifications, tasks
 from adagios.settings import plugins
 from adagios import userdata
+import adagios.daemon
 from django.utils.translation import ugettext as _
 
 version = __version__
@@ -51,7 +54,9 @@ def add_notification(level="info", message="message", notification_id=None, noti
     >>> add_notification(level="warning", message="Nagios needs to reload")
     """
     if not notification_id:
-        notification_id = str(message.__hash__())
+        # Notifications are shared by every process and kept on disk, so the
+        # same message must get the same id everywhere, which hash() does not give
+        notification_id = hashlib.sha1(str(message).encode('utf-8')).hexdigest()
     if not notification_type:
         notification_type = "generic"
     notification = locals()
@@ -60,24 +65,27 @@ def add_notification(level="info", message="message", notification_id=None, noti
 
 def clear_notification(notification_id):
     """ Clear one notification from adagios notification panel """
-    if notification_id in notifications:
-        del notifications[notification_id]
+    if notifications.pop(notification_id, None) is not None:
         return "success"
     return "not found"
 
 
 def get_notifications(request):
     """ Shows all current notifications """
-    result = []
-    for k in list(notifications.keys()):
-        i = notifications[k]
-        if i.get('user') and i.get('user') != request.META.get('remote_user'):
-            continue # Skipt this message if it is meant for someone else
-        elif i.get('notification_type') == 'show_once':
-            del notifications[k]
-            pass
-        result.append(i)
-    return result
+    return get_notifications_since(request)['notifications']
+
+
+def get_notifications_since(request, version=0):
+    """ Shows notifications that changed after version
+
+    Arguments:
+      version -- The version returned by your previous call, 0 to get every notification
+
+    Returns:
+      Dict with the new version, notifications added since version and the
+      notification_id of every notification that was cleared since version.
+    """
+    return notifications.get_since(version, user=request.META.get('REMOTE_USER'))
 
 
 def clear_all_notifications():
@@ -163,3 +171,23 @@ def delete_saved_search(request, name):
     user.set_pref(userdata.User.SAVED_SEARCHES, saved_searches)
     user.save()
 
+
+
+def get_context_processor_statistics(request):
+    """ Returns how long each context processor has taken, since this process started. """
+    import adagios.context_processors
+    result = {}
+    for name, statistics in adagios.context_processors.processor_statistics.items():
+        result[name] = dict(statistics)
+    return result
+
+
+def get_daemon_status(request):
+    """ Returns the last known status of the nagios daemon: running, pid, program_start and last_reload """
+    return adagios.daemon.status_probe.get()
+
+
+def get_warmup_timings(request):
+    """ Returns how long each warm-up step took when this worker process started, see wsgi_warmup in adagios.conf """
+    import adagios.warmup
+    return [{'step': step, 'seconds': seconds, 'error': error} for step, seconds, error in adagios.warmup.timings]
@@ -23,10 +23,21 @@ from django.test import TestCase
 from django.test.client import Client
 from django.test.client import RequestFactory
 import django.utils.six
+import adagios
 import adagios.utils
 import adagios.misc.rest
+import adagios.auth
+import adagios.context_processors
+import adagios.daemon
+import adagios.maincfg
+import adagios.notification_store
+import adagios.settings
 import adagios.userdata
 import os
+import pynag.Parsers
+import shutil
+import tempfile
+from mock import patch
 
 
 class FakeAdagiosEnvironment(TestCase):
@@ -163,3 +174,427 @@ class RestTest(TestCase):
 
         adagios.misc.rest.delete_saved_search(self.request, 'test')
         self.assertFalse(adagios.misc.rest.get_saved_searches(self.request))
+
+
+class ContextProcessorTest(TestCase):
+    """Tests for adagios.context_processors"""
+
+    def test_on_page_load_is_lazy(self):
+        request = RequestFactory().get('/status/')
+        context = adagios.context_processors.on_page_load(request)
+        self.assertEqual(['reload_configfile', 'trigger_user_hooks'], [x[0] for x in adagios.context_processors.get_timings(request)])
+
+        self.assertEqual(adagios.__version__, context['adagios_version']())
+        self.assertEqual(adagios.__version__, context['adagios_version']())
+        names = [x[0] for x in adagios.context_processors.get_timings(request)]
+        self.assertEqual(['reload_configfile', 'trigger_user_hooks', 'get_current_version'], names)
+        self.assertTrue(adagios.context_processors.processor_statistics['get_current_version']['calls'] >= 1)
+
+    def test_user_language_is_activated_right_away(self):
+        request = RequestFactory().get('/status/')
+        with patch.object(adagios.userdata.User, 'trigger_hooks') as trigger_hooks:
+            context = adagios.context_processors.on_page_load(request)
+            self.assertEqual(1, trigger_hooks.call_count)
+            context['user_data']()
+        self.assertEqual(1, trigger_hooks.call_count)
+
+    def test_missing_keys_are_empty(self):
+        request = RequestFactory().get('/status/')
+        context = adagios.context_processors.on_page_load(request)
+        with patch.dict(adagios.settings.plugins, {}, clear=True):
+            self.assertEqual('', context['okconfig']())
+
+    def test_templates_read_lazy_values(self):
+        from django.template import Template, RequestContext
+        request = RequestFactory().get('/status/')
+        template = Template("{{ adagios_version }}/{{ remote_user }}/{% for i in ssi_headers %}{{ i }}{% endfor %}")
+        result = template.render(RequestContext(request))
+        self.assertEqual('%s/anonymous/' % adagios.__version__, result)
+
+
+class ReloadConfigfileTest(TestCase):
+    """Tests for adagios.settings.reload_configfile"""
+
+    def setUp(self):
+        self._settings_copy = adagios.settings.__dict__.copy()
+        self.tempdir = tempfile.mkdtemp()
+        self.configfile = os.path.join(self.tempdir, 'adagios.conf')
+        with open(self.configfile, 'w') as f:
+            f.write("reload_test_value = 1\n")
+        adagios.settings._config_generation_file = os.path.join(self.tempdir, 'generation')
+
+    def tearDown(self):
+        adagios.settings.__dict__.clear()
+        adagios.settings.__dict__.update(self._settings_copy)
+        shutil.rmtree(self.tempdir)
+
+    def test_reload_only_when_changed(self):
+        with patch('adagios.settings.execfile', wraps=adagios.settings.execfile) as execfile:
+            adagios.settings.reload_configfile(self.configfile)
+            adagios.settings.reload_configfile(self.configfile)
+            self.assertEqual(1, execfile.call_count)
+            self.assertEqual(1, adagios.settings.reload_test_value)
+
+            with open(self.configfile, 'w') as f:
+                f.write("reload_test_value = 22\n")
+            adagios.settings.reload_configfile(self.configfile)
+            self.assertEqual(2, execfile.call_count)
+            self.assertEqual(22, adagios.settings.reload_test_value)
+
+    def test_reload_after_generation_bump(self):
+        with patch('adagios.settings.execfile', wraps=adagios.settings.execfile) as execfile:
+            adagios.settings.reload_configfile(self.configfile)
+            adagios.settings.bump_config_generation()
+            adagios.settings.reload_configfile(self.configfile)
+            self.assertEqual(2, execfile.call_count)
+
+    def test_generation_file_is_in_a_private_directory(self):
+        adagios.settings._config_generation_file = None
+        with patch('tempfile.tempdir', self.tempdir):
+            adagios.settings.bump_config_generation()
+            generation_file = adagios.settings._get_config_generation_file()
+        self.assertEqual(os.path.join(self.tempdir, 'adagios-config-%s' % os.getuid(), 'generation'), generation_file)
+        self.assertEqual(0o700, os.stat(os.path.dirname(generation_file)).st_mode & 0o777)
+        with open(generation_file) as f:
+            self.assertEqual('1', f.read())
+
+    def test_reload_when_include_is_added(self):
+        include_dir = os.path.join(self.tempdir, 'conf.d')
+        os.mkdir(include_dir)
+        with open(self.configfile, 'w') as f:
+            f.write("include = '%s/*.conf'\n" % include_dir)
+        adagios.settings.reload_configfile(self.configfile)
+        with open(os.path.join(include_dir, 'extra.conf'), 'w') as f:
+            f.write("reload_test_value = 3\n")
+        adagios.settings.reload_configfile(self.configfile)
+        self.assertEqual(3, adagios.settings.reload_test_value)
+
+
+class MainCfgTest(TestCase):
+    """Tests for adagios.maincfg"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cfg_file = os.path.join(self.tempdir, 'nagios.cfg')
+        with open(self.cfg_file, 'w') as f:
+            f.write("cfg_dir=/etc/nagios/conf.d\ncfg_dir=/etc/nagios/adagios\ncommand_file=/tmp/nagios.cmd\n")
+
+    def tearDown(self):
+        adagios.maincfg.clear_cache()
+        shutil.rmtree(self.tempdir)
+
+    def test_get_facts(self):
+        facts = adagios.maincfg.get_facts(self.cfg_file)
+        self.assertEqual(['/etc/nagios/conf.d', '/etc/nagios/adagios'], facts['cfg_dirs'])
+        self.assertEqual('/tmp/nagios.cmd', facts['command_file'])
+        self.assertEqual(None, facts['log_file'])
+        self.assertEqual('/tmp/nagios.cmd', adagios.maincfg.get_cfg_value('command_file', self.cfg_file))
+
+    def test_parse_only_when_changed(self):
+        with patch('adagios.maincfg._parse', wraps=adagios.maincfg._parse) as parse:
+            adagios.maincfg.get_facts(self.cfg_file)
+            adagios.maincfg.get_facts(self.cfg_file)
+            self.assertEqual(1, parse.call_count)
+            with open(self.cfg_file, 'a') as f:
+                f.write("log_file=/tmp/nagios.log\n")
+            facts = adagios.maincfg.get_facts(self.cfg_file)
+            self.assertEqual(2, parse.call_count)
+        self.assertEqual('/tmp/nagios.log', facts['log_file'])
+
+    def test_missing_cfg_file(self):
+        self.assertRaises(pynag.Parsers.ParserError, adagios.maincfg.get_facts, '/nonexistent/nagios.cfg')
+
+
+class DaemonStatusProbeTest(TestCase):
+    """Tests for adagios.daemon.DaemonStatusProbe"""
+
+    def setUp(self):
+        self.probe = adagios.daemon.DaemonStatusProbe()
+
+    def test_status_is_read_from_memory(self):
+        with patch('adagios.settings.daemon_status_interval', 0.001), \
+                patch.object(self.probe, 'start'), \
+                patch('adagios.daemon.Daemon') as daemon, \
+                patch('adagios.status.utils.livestatus') as livestatus:
+            daemon.return_value.running.return_value = True
+            livestatus.return_value.query.return_value = [{'program_start': 1000, 'nagios_pid': 42}]
+            status = self.probe.get()
+            self.probe.get()
+        self.assertEqual(1, daemon.return_value.running.call_count)
+        self.assertTrue(status['running'])
+        self.assertEqual(42, status['pid'])
+        self.assertEqual(1000, status['program_start'])
+        self.assertEqual(None, status['last_reload'])
+
+    def test_refresh_after_reload(self):
+        with patch('adagios.daemon.Daemon') as daemon, \
+                patch('adagios.status.utils.livestatus') as livestatus:
+            daemon.return_value.running.return_value = False
+            livestatus.return_value.query.side_effect = Exception('livestatus is down')
+            status = self.probe.refresh_after_reload()
+        self.assertFalse(status['running'])
+        self.assertTrue(status['last_reload'])
+        self.assertEqual('livestatus is down', status['error'])
+
+    def test_lock_file_comes_from_configured_nagios_cfg(self):
+        with patch('adagios.settings.nagios_config', '/etc/custom/nagios.cfg'), \
+                patch('adagios.maincfg.get_facts', side_effect=Exception('no nagios.cfg')) as get_facts, \
+                patch('pynag.Control.daemon._guess_method', return_value=adagios.daemon.daemon.SYSV_INIT_SERVICE):
+            self.assertRaises(Exception, self.probe._get_pid)
+            daemon = adagios.daemon.Daemon()
+            self.assertFalse(daemon.running())
+        self.assertEqual(['/etc/custom/nagios.cfg'] * 2, [x[0][0] for x in get_facts.call_args_list])
+
+    def test_nagios_cfg_is_guessed_when_not_configured(self):
+        with patch('adagios.settings.nagios_config', None), \
+                patch('adagios.maincfg.get_facts', side_effect=Exception('no nagios.cfg')) as get_facts, \
+                patch('pynag.Control.daemon._guess_method', return_value=adagios.daemon.daemon.SYSV_INIT_SERVICE):
+            daemon = adagios.daemon.Daemon()
+            self.assertFalse(daemon.running())
+        # None makes adagios.maincfg look for nagios.cfg, instead of pynag's hardcoded default
+        self.assertEqual([None], [x[0][0] for x in get_facts.call_args_list])
+
+
+class UserdataTest(TestCase):
+    """Tests for adagios.userdata.User"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefs_path = patch('adagios.settings.USER_PREFS_PATH', self.tempdir)
+        self.prefs_path.start()
+        self.request = RequestFactory().get('/', REMOTE_USER='prefs_test')
+
+    def tearDown(self):
+        self.prefs_path.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_preferences_are_parsed_once(self):
+        user = adagios.userdata.User(self.request)
+        user.theme = 'spacelab'
+        user.save()
+        with patch('adagios.userdata.json.loads') as loads:
+            self.assertEqual('spacelab', adagios.userdata.User(self.request).theme)
+            self.assertEqual('spacelab', adagios.userdata.User(self.request).theme)
+        self.assertEqual(0, loads.call_count)
+
+    def test_changes_on_disk_are_noticed(self):
+        adagios.userdata.User(self.request).save()
+        with open(os.path.join(self.tempdir, 'prefs_test.json'), 'w') as f:
+            f.write('{"theme": "cyborg", "refresh_rate": 10}')
+        self.assertEqual('cyborg', adagios.userdata.User(self.request).theme)
+
+    def test_cached_preferences_are_not_shared(self):
+        user = adagios.userdata.User(self.request)
+        user.saved_searches = {'a': '/status'}
+        user.save()
+        adagios.userdata.User(self.request).saved_searches['b'] = '/status/hosts'
+        self.assertEqual({'a': '/status'}, adagios.userdata.User(self.request).saved_searches)
+
+    def test_autosave_is_coalesced(self):
+        user = adagios.userdata.User(self.request, autosave=True)
+        with patch.object(adagios.userdata.User, 'trigger_hooks') as trigger_hooks:
+            user.theme = 'cyborg'
+            user.refresh_rate = 60
+            user.flush()
+            user.flush()
+        self.assertEqual(1, trigger_hooks.call_count)
+        self.assertEqual(60, adagios.userdata.User(self.request).refresh_rate)
+        self.assertEqual(['prefs_test.json'], os.listdir(self.tempdir))
+
+
+class RoleCacheTest(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.META['REMOTE_USER'] = 'alice'
+        self.role_cache = adagios.auth.RoleCache()
+        role_cache_patch = patch.object(adagios.auth, 'role_cache', self.role_cache)
+        role_cache_patch.start()
+        self.addCleanup(role_cache_patch.stop)
+        get_contacts = patch('adagios.status.utils.get_contacts', return_value=[{'name': 'alice'}])
+        get_contactgroups = patch('adagios.status.utils.get_contactgroups', return_value=[{'name': 'admins', 'members': ['alice']}])
+        program_start = patch.object(adagios.auth.RoleCache, '_get_program_start', return_value=1)
+        self.get_contacts = get_contacts.start()
+        self.get_contactgroups = get_contactgroups.start()
+        self.program_start = program_start.start()
+        self.program_start_patch = program_start
+        for p in (get_contacts, get_contactgroups, program_start):
+            self.addCleanup(p.stop)
+
+    def test_memberships_are_fetched_once(self):
+        with patch.object(adagios.settings, 'administrators', 'admins', create=True):
+            self.assertTrue(adagios.auth.has_role(self.request, 'administrators'))
+            self.assertTrue(adagios.auth.has_role(self.request, 'contacts'))
+            self.assertTrue(adagios.auth.has_role(self.request, 'administrators'))
+        self.assertEqual(1, self.get_contacts.call_count)
+        self.assertEqual(1, self.get_contactgroups.call_count)
+
+    def test_memberships_are_fetched_after_nagios_reload(self):
+        self.role_cache.is_contact('alice')
+        self.program_start.return_value = 2
+        self.role_cache.is_contact('alice')
+        self.assertEqual(2, self.get_contactgroups.call_count)
+
+    def test_checking_a_role_never_checks_nagios(self):
+        self.program_start_patch.stop()
+        self.addCleanup(self.program_start_patch.start)
+        probe = adagios.daemon.DaemonStatusProbe()
+        with patch.object(adagios.daemon, 'status_probe', probe), \
+                patch('adagios.settings.daemon_status_interval', 0), \
+                patch.object(probe, 'refresh') as refresh:
+            self.role_cache.is_contact('alice')
+            self.role_cache.is_contact('alice')
+            probe._status = {'program_start': 2}
+            self.role_cache.is_contact('alice')
+        self.assertEqual(0, refresh.call_count)
+        self.assertEqual(2, self.get_contactgroups.call_count)
+
+    def test_path_rules_follow_access_list(self):
+        self.assertEqual(('adagios.objectbrowser', 'administrators'), adagios.auth._match_path('adagios.objectbrowser.views.index'))
+        with patch.object(adagios.auth, 'access_list', [('adagios.objectbrowser', 'everyone')]):
+            self.assertEqual(('adagios.objectbrowser', 'everyone'), adagios.auth._match_path('adagios.objectbrowser.views.index'))
+            self.assertEqual(None, adagios.auth._match_path('adagios.status.views.index'))
+
+
+class NotificationStoreTest(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        path = os.path.join(self.tempdir, 'notifications.sqlite')
+        # Two stores on the same database behave like two worker processes
+        self.first = adagios.notification_store.NotificationStore(path)
+        self.second = adagios.notification_store.NotificationStore(path)
+
+    def test_notifications_are_shared(self):
+        self.first['reload'] = {'message': 'Nagios needs to reload'}
+        self.assertEqual({'message': 'Nagios needs to reload'}, self.second['reload'])
+        del self.second['reload']
+        self.assertNotIn('reload', self.first)
+
+    def test_get_since_returns_only_changes(self):
+        self.first['a'] = {'message': 'a'}
+        version = self.second.get_since(0)['version']
+        self.first['b'] = {'message': 'b'}
+        self.first.pop('a')
+        changes = self.second.get_since(version)
+        self.assertEqual([{'message': 'b'}], changes['notifications'])
+        self.assertEqual(['a'], changes['cleared'])
+        self.assertEqual(changes, dict(self.second.get_since(version), version=changes['version']))
+        self.assertEqual([], self.second.get_since(changes['version'])['notifications'])
+
+    def test_adding_the_same_notification_is_not_a_change(self):
+        self.first['a'] = {'message': 'a'}
+        version = self.first.get_version()
+        self.second['a'] = {'message': 'a'}
+        self.assertEqual(version, self.first.get_version())
+
+    def test_default_id_is_the_same_in_every_process(self):
+        # hash() of a string changes from one process to the next
+        with patch.object(adagios.misc.rest, 'notifications', self.first):
+            adagios.misc.rest.add_notification(message='Nagios needs to reload')
+            adagios.misc.rest.add_notification(message='Nagios needs to reload')
+        self.assertEqual(['2a5b18b5af90d314b208ac6bdef3f9292397c989'], list(self.first.keys()))
+
+    def test_unchanged_notification_takes_no_write_lock(self):
+        self.first['a'] = {'message': 'a'}
+        with patch.object(self.second, '_write') as write:
+            self.second['a'] = {'message': 'a'}
+        self.assertEqual(0, write.call_count)
+
+    def test_default_database_is_in_a_private_directory(self):
+        with patch('tempfile.tempdir', self.tempdir):
+            path = adagios.notification_store.get_default_path()
+            self.assertEqual(0o700, os.stat(os.path.dirname(path)).st_mode & 0o777)
+            os.chmod(os.path.dirname(path), 0o777)
+            store = adagios.notification_store.NotificationStore()
+            with patch.object(adagios.settings, 'notification_db', None, create=True):
+                store['a'] = {'message': 'a'}
+                self.assertEqual(':memory:', store._connection_key[1])
+
+    def test_show_once_is_shown_once(self):
+        self.first['saved'] = {'message': 'Saved', 'notification_type': 'show_once'}
+        self.assertEqual(1, len(self.second.get_since(0)['notifications']))
+        self.assertEqual([], self.first.get_since(0)['notifications'])
+
+    def test_notifications_for_other_users_are_hidden(self):
+        self.first['a'] = {'message': 'a', 'user': 'alice'}
+        self.assertEqual([], self.second.get_since(0, user='bob')['notifications'])
+        self.assertEqual(1, len(self.second.get_since(0, user='alice')['notifications']))
+
+
+class PluginTest(TestCase):
+
+    def setUp(self):
+        import adagios.urls
+        for name, value in (('active_plugins', {}), ('failed_plugins', {}), ('menubar_items', []), ('misc_menubar_items', [])):
+            p = patch.object(adagios, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        p = patch.object(adagios.urls, 'urlpatterns', list(adagios.urls.urlpatterns))
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_plugins_are_not_imported_until_visited(self):
+        import sys
+        sys.modules.pop('adagios.myapp.urls', None)
+        with patch.object(adagios.settings, 'plugins', {'myapp': 'adagios.myapp'}):
+            adagios.activate_plugins()
+        self.assertEqual({'myapp': 'adagios.myapp'}, adagios.active_plugins)
+        self.assertNotIn('adagios.myapp.urls', sys.modules)
+        self.assertEqual('^myapp', adagios.urls.urlpatterns[-1].regex.pattern)
+
+    def test_broken_plugins_are_tried_once(self):
+        with patch.object(adagios.settings, 'plugins', {'broken': 'adagios.does_not_exist'}):
+            with patch('adagios.add_plugin', side_effect=ImportError) as add_plugin:
+                adagios.activate_plugins()
+                adagios.activate_plugins()
+        self.assertEqual(1, add_plugin.call_count)
+        self.assertEqual({}, adagios.active_plugins)
+
+    def test_plugin_with_broken_urls_does_not_break_reverse(self):
+        import sys
+        from django.core.urlresolvers import RegexURLResolver
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        plugin_dir = os.path.join(tempdir, 'brokenplugin')
+        os.makedirs(os.path.join(plugin_dir, 'templates'))
+        for filename, content in (('__init__.py', ''), ('urls.py', 'import does_not_exist\n'),
+                                  ('templates/broken_menubar.html', '')):
+            with open(os.path.join(plugin_dir, filename), 'w') as f:
+                f.write(content)
+        sys.path.insert(0, tempdir)
+        self.addCleanup(sys.path.remove, tempdir)
+        self.addCleanup(sys.modules.pop, 'brokenplugin', None)
+
+        with patch.object(adagios.settings, 'plugins', {'broken': 'brokenplugin'}):
+            adagios.activate_plugins()
+        self.assertEqual(['broken_menubar.html'], adagios.menubar_items)
+
+        resolver = RegexURLResolver(r'^/', adagios.urls)
+        self.assertEqual('', resolver.reverse('home'))
+        self.assertEqual({}, adagios.active_plugins)
+        self.assertEqual({'broken': 'brokenplugin'}, adagios.failed_plugins)
+        self.assertEqual([], adagios.menubar_items)
+
+
+
+class WarmupTest(TestCase):
+
+    def test_failing_steps_do_not_stop_the_others(self):
+        import adagios.warmup
+        calls = []
+
+        def broken():
+            raise IOError('no such file')
+        steps = [('broken', broken), ('working', lambda: calls.append('working'))]
+        timings = adagios.warmup.warm_up(steps)
+        self.assertEqual(['working'], calls)
+        self.assertEqual(['broken', 'working'], [x[0] for x in timings])
+        self.assertEqual('OSError: no such file', timings[0][2].replace('IOError', 'OSError'))
+        self.assertEqual(None, timings[1][2])
+        self.assertEqual(timings, adagios.warmup.timings)
+
+    def test_templates_compile(self):
+        import adagios.warmup
+        adagios.warmup.compile_templates()
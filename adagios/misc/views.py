@@ -200,7 +200,8 @@ def nagios_service(request):
     c['form'] = form
     daemon = adagios.daemon.Daemon()
     c['nagios_bin'] = daemon.nagios_bin
-    if daemon.running():
+    c['daemon_status'] = adagios.daemon.status_probe.get()
+    if c['daemon_status']['running']:
         c['status'] = 0
         c['friendly_status'] = "running"
     else:
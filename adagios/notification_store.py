@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Notifications in the adagios notification panel, shared by every worker process
+
+Notifications live in a small sqlite database (setting notification_db), so a
+notification added by one process is seen by all of them. Every change bumps
+a version number, and clients that remember the last version they saw can ask
+for what changed since then with get_since().
+
+NotificationStore behaves like the dict adagios.notifications used to be:
+
+    >>> store = NotificationStore(':memory:')
+    >>> store['reload'] = {'message': 'Nagios needs to reload', 'level': 'warning'}
+    >>> store['reload']['message']
+    'Nagios needs to reload'
+"""
+
+from __future__ import unicode_literals
+from builtins import object
+import os
+import sqlite3
+import threading
+import time
+
+import simplejson as json
+
+from adagios.private_files import get_private_dir, InsecureDirectory
+
+# Cleared notifications are remembered this many seconds, so clients that
+# fetch changes with get_since() learn that they are gone.
+_TOMBSTONE_AGE = 3600
+
+_MISSING = object()
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS notifications ("
+    " notification_id TEXT PRIMARY KEY,"
+    " version INTEGER NOT NULL,"
+    " cleared INTEGER NOT NULL DEFAULT 0,"
+    " timestamp REAL NOT NULL,"
+    " data TEXT)",
+    "CREATE INDEX IF NOT EXISTS notifications_version ON notifications (version)",
+    "CREATE TABLE IF NOT EXISTS version (version INTEGER NOT NULL, purged INTEGER NOT NULL)",
+]
+
+
+def get_default_path():
+    # Notifications are shown as html, so nobody else may be able to write them
+    return os.path.join(get_private_dir('notifications'), 'notifications.sqlite')
+
+
+class NotificationStore(object):
+    """ Dict like store of notifications, keyed by notification_id
+
+    Arguments:
+        path -- Path to the sqlite database. Defaults to the notification_db setting.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._connection = None
+        self._connection_key = None
+
+    def get_path(self):
+        if self._path:
+            return self._path
+        import adagios.settings
+        return getattr(adagios.settings, 'notification_db', None) or get_default_path()
+
+    def _connect(self):
+        """ Returns a connection to the database of this process, opens it if needed """
+        try:
+            path = self.get_path()
+        except InsecureDirectory:
+            path = ':memory:'
+        key = (os.getpid(), path)
+        if self._connection is not None and self._connection_key == key:
+            return self._connection
+        try:
+            connection = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._create_tables(connection)
+        except sqlite3.Error:
+            # Notifications must keep working even when the database can not
+            # be written, they are just not shared with other processes.
+            connection = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+            self._create_tables(connection)
+        self._connection = connection
+        self._connection_key = key
+        return connection
+
+    def _create_tables(self, connection):
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        if connection.execute("SELECT COUNT(*) FROM version").fetchone()[0] == 0:
+            connection.execute("INSERT INTO version (version, purged) VALUES (0, 0)")
+
+    def _write(self, function):
+        """ Runs function(connection, bump) in one transaction
+
+        bump() increases the version of the store and returns the new version,
+        call it once for every change.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                def bump():
+                    connection.execute("UPDATE version SET version = version + 1")
+                    return connection.execute("SELECT version FROM version").fetchone()[0]
+                result = function(connection, bump)
+                self._purge(connection)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            return result
+
+    def _purge(self, connection):
+        """ Forget notifications that were cleared a long time ago """
+        expired = time.time() - _TOMBSTONE_AGE
+        row = connection.execute(
+            "SELECT MAX(version) FROM notifications WHERE cleared = 1 AND timestamp < ?", (expired,)).fetchone()
+        if row[0] is None:
+            return
+        connection.execute("UPDATE version SET purged = MAX(purged, ?)", (row[0],))
+        connection.execute("DELETE FROM notifications WHERE cleared = 1 AND timestamp < ?", (expired,))
+
+    def _read(self, query, args=()):
+        with self._lock:
+            return self._connect().execute(query, args).fetchall()
+
+    def get_version(self):
+        """ Returns the version of the newest change in this store """
+        return self._read("SELECT version FROM version")[0][0]
+
+    def __setitem__(self, notification_id, notification):
+        data = json.dumps(notification)
+        # Pages add the same warnings over and over, that is not a change and
+        # should not wait for a write lock
+        query = "SELECT data FROM notifications WHERE notification_id = ? AND cleared = 0"
+        if [(data,)] == self._read(query, (notification_id,)):
+            return
+
+        def insert(connection, bump):
+            row = connection.execute(query, (notification_id,)).fetchone()
+            if row and row[0] == data:
+                return
+            connection.execute(
+                "INSERT OR REPLACE INTO notifications (notification_id, version, cleared, timestamp, data)"
+                " VALUES (?, ?, 0, ?, ?)", (notification_id, bump(), time.time(), data))
+        self._write(insert)
+
+    def __getitem__(self, notification_id):
+        rows = self._read("SELECT data FROM notifications WHERE notification_id = ? AND cleared = 0", (notification_id,))
+        if not rows:
+            raise KeyError(notification_id)
+        return json.loads(rows[0][0])
+
+    def __delitem__(self, notification_id):
+        if self.pop(notification_id, _MISSING) is _MISSING:
+            raise KeyError(notification_id)
+
+    def __contains__(self, notification_id):
+        return bool(self._read(
+            "SELECT 1 FROM notifications WHERE notification_id = ? AND cleared = 0", (notification_id,)))
+
+    def __len__(self):
+        return self._read("SELECT COUNT(*) FROM notifications WHERE cleared = 0")[0][0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, notification_id, default=None):
+        try:
+            return self[notification_id]
+        except KeyError:
+            return default
+
+    def pop(self, notification_id, default=None):
+        """ Clear notification_id, returns the notification or default if there was none """
+        if notification_id not in self:
+            return default
+
+        def clear(connection, bump):
+            row = connection.execute(
+                "SELECT data FROM notifications WHERE notification_id = ? AND cleared = 0", (notification_id,)).fetchone()
+            if not row:
+                return default
+            connection.execute(
+                "UPDATE notifications SET cleared = 1, version = ?, timestamp = ?, data = NULL"
+                " WHERE notification_id = ?", (bump(), time.time(), notification_id))
+            return json.loads(row[0])
+        return self._write(clear)
+
+    def keys(self):
+        return [x[0] for x in self._read("SELECT notification_id FROM notifications WHERE cleared = 0 ORDER BY version")]
+
+    def values(self):
+        return [json.loads(x[0]) for x in self._read("SELECT data FROM notifications WHERE cleared = 0 ORDER BY version")]
+
+    def items(self):
+        return [(x[0], json.loads(x[1])) for x in self._read(
+            "SELECT notification_id, data FROM notifications WHERE cleared = 0 ORDER BY version")]
+
+    def clear(self):
+        def clear_all(connection, bump):
+            if connection.execute("SELECT COUNT(*) FROM notifications WHERE cleared = 0").fetchone()[0]:
+                connection.execute(
+                    "UPDATE notifications SET cleared = 1, version = ?, timestamp = ?, data = NULL"
+                    " WHERE cleared = 0", (bump(), time.time()))
+        self._write(clear_all)
+
+    def get_since(self, version=0, user=None):
+        """ Returns every change made after version, as seen by user
+
+        Notifications of type show_once are cleared as soon as they are
+        returned, so only one client gets them, no matter which process it asks.
+
+        Returns:
+            Dict with the following keys:
+              version       -- Pass this as version next time to get only newer changes
+              notifications -- List of notifications added or changed after version
+              cleared       -- List of notification_id that were cleared after version
+              full          -- True if version was too old to tell what was cleared,
+                               notifications then has every current notification and
+                               the client should forget the ones it had.
+        """
+        version = int(version or 0)
+
+        def fetch(connection, bump):
+            current, purged = connection.execute("SELECT version, purged FROM version").fetchone()
+            full = version < purged
+            since = 0 if full else version
+            rows = connection.execute(
+                "SELECT notification_id, cleared, data FROM notifications WHERE version > ? ORDER BY version",
+                (since,)).fetchall()
+            notifications = []
+            cleared = []
+            show_once = []
+            for notification_id, is_cleared, data in rows:
+                if is_cleared:
+                    if not full:
+                        cleared.append(notification_id)
+                    continue
+                notification = json.loads(data)
+                if notification.get('user') and notification.get('user') != user:
+                    continue
+                if notification.get('notification_type') == 'show_once':
+                    show_once.append(notification_id)
+                notifications.append(notification)
+            if show_once:
+                current = bump()
+                connection.executemany(
+                    "UPDATE notifications SET cleared = 1, version = ?, timestamp = ?, data = NULL"
+                    " WHERE notification_id = ?", [(current, time.time(), x) for x in show_once])
+            return {'version': current, 'notifications': notifications, 'cleared': cleared, 'full': full}
+        return self._write(fetch)
@@ -35,6 +35,7 @@ from collections import defaultdict, namedtuple
 import pynag.Model
 
 from adagios import settings
+import adagios.maincfg
 from adagios.objectbrowser.forms import *
 from adagios.views import adagios_decorator
 
@@ -502,10 +503,10 @@ def edit_nagios_cfg(request):
     c = {'filename': Model.config.cfg_file}
     c['content'] = []
 
+    maincfg_values = adagios.maincfg.get_facts()['values']
     for conf in sorted(main_config):
         values = []
-        Model.config.parse_maincfg()
-        for k, v in Model.config.maincfg_values:
+        for k, v in maincfg_values:
             if conf == k:
                 values.append(v)
         c['content'].append({
@@ -518,7 +519,7 @@ def edit_nagios_cfg(request):
             'values': values
         })
 
-    for key, v in Model.config.maincfg_values:
+    for key, v in maincfg_values:
         if key not in main_config:
             c['content'].append({
                 'title': _('No documentation found'),
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Directories where adagios keeps files that only its own processes may touch
+
+Caches and databases shared between worker processes default to the temp
+directory. Everybody can create files there, so a directory we did not create
+ourselves, or that others can write to, is never used.
+"""
+
+from __future__ import unicode_literals
+import errno
+import os
+import stat
+import tempfile
+
+from adagios.exceptions import AdagiosError
+
+
+class InsecureDirectory(AdagiosError):
+    """ Raised when a directory is not owned by us, or others have access to it """
+    pass
+
+
+def check_private_dir(path):
+    """ Raises InsecureDirectory unless path is a real directory owned by us that nobody else can access """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise InsecureDirectory("%s is not a directory" % path)
+    if st.st_uid != os.getuid():
+        raise InsecureDirectory("%s is owned by uid %s, not by us" % (path, st.st_uid))
+    if st.st_mode & 0o077:
+        raise InsecureDirectory("%s has mode %o, expected 0700" % (path, stat.S_IMODE(st.st_mode)))
+    return path
+
+
+def get_private_dir(name, path=None):
+    """ Returns a directory that only this user can access, creates it if needed
+
+    Arguments:
+        name -- Used for the default directory, adagios-<name>-<uid> in the temp directory
+        path -- Directory to use instead of the default, for example from a setting
+
+    Raises:
+        InsecureDirectory if the directory exists and is not private to us
+    """
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'adagios-%s-%s' % (name, os.getuid()))
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return check_private_dir(path)
@@ -29,14 +29,17 @@ from builtins import str
 import cProfile
 import os
 import time
-from . import settings
 import tempfile
 import random
 
-try:
-    PROFILE_LOG_BASE = settings.PROFILE_LOG_BASE
-except:
-    PROFILE_LOG_BASE = tempfile.gettempdir()
+
+def get_profile_log_base():
+    """ Returns settings.PROFILE_LOG_BASE, or the temp directory if it is not set """
+    from . import settings
+    try:
+        return settings.PROFILE_LOG_BASE
+    except:
+        return tempfile.gettempdir()
 
 
 def profile(log_file):
@@ -53,14 +56,14 @@ def profile(log_file):
     multiple trials.
     """
 
-    if not os.path.isabs(log_file):
-        log_file = os.path.join(PROFILE_LOG_BASE, log_file)
-
     def _outer(f):
         def _inner(*args, **kwargs):
             # Add a timestamp to the profile output when the callable
             # is actually called.
-            (base, ext) = os.path.splitext(log_file)
+            path = log_file
+            if not os.path.isabs(path):
+                path = os.path.join(get_profile_log_base(), path)
+            (base, ext) = os.path.splitext(path)
             base = base + "-" + time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + str(random.randint(1,9999))
             final_log_file = base + ext
 
@@ -25,7 +25,7 @@ from builtins import map
 from builtins import str
 from django.shortcuts import render_to_response, redirect, render
 from django.core import serializers
-from django.http import HttpResponse, HttpResponseServerError
+from django.http import HttpResponse, HttpResponseServerError, StreamingHttpResponse
 import json
 #from django.core.context_processors import csrf
 from django.views.decorators.csrf import csrf_exempt
@@ -46,6 +46,26 @@ def _load(module_path):
     return my_module
 
 
+def _json_stream(items):
+    """ Returns an iterator over a json list of items, that serializes one item at a time.
+
+    The first item is fetched before anything is sent, so that errors that
+    happen right away (like livestatus being down) still get a proper error page.
+    """
+    items = iter(items)
+    try:
+        first = next(items)
+    except StopIteration:
+        return iter(['[]'])
+
+    def generate():
+        yield '[\n' + json.dumps(first, ensure_ascii=False, sort_keys=True, skipkeys=True, indent=4)
+        for item in items:
+            yield ',\n' + json.dumps(item, ensure_ascii=False, sort_keys=True, skipkeys=True, indent=4)
+        yield '\n]'
+    return generate()
+
+
 @csrf_exempt
 @adagios_decorator
 def handle_request(request, module_name, module_path, attribute, format):
@@ -99,6 +119,10 @@ def handle_request(request, module_name, module_path, attribute, format):
     else:
         raise BaseException(_("Unsupported operation: %s") % (request.method, ))
     # Everything below is just about formatting the results
+    if inspect.isgenerator(result) and format == 'json':
+        return StreamingHttpResponse(_json_stream(result), content_type='application/javascript')
+    elif inspect.isgenerator(result):
+        result = list(result)
     if format == 'json':
         result = json.dumps(
             result, ensure_ascii=False, sort_keys=True, skipkeys=True, indent=4)
@@ -24,6 +24,7 @@ USE_TZ = True
 
 # Hack to allow relative template paths
 import os
+import tempfile
 from glob import glob
 from warnings import warn
 import string
@@ -241,6 +242,26 @@ nagios_service = "nagios"
 nagios_binary = "/usr/bin/nagios"
 livestatus_path = None
 livestatus_limit = 500
+livestatus_keepalive = True
+livestatus_pool_size = 4
+livestatus_pool_idle_timeout = 60
+livestatus_backend_timeout = 10
+livestatus_health_interval = 10
+livestatus_breaker_threshold = 3
+livestatus_breaker_cooldown = 30
+status_cache_ttl = 0
+status_cache_dir = None
+debug_livestatus_columns = False
+daemon_status_interval = 30
+navbar_push_interval = 15
+navbar_push = False
+navbar_push_max_streams = 10
+navbar_push_max_age = 300
+role_cache_ttl = 60
+notification_db = None
+wsgi_warmup = False
+sla_rollup_db = None
+sla_rollup_days = 31
 default_host_template = 'generic-host'
 default_service_template = 'generic-service'
 default_contact_template = 'generic-contact'
@@ -286,10 +307,62 @@ PROFILE_LOG_BASE = "/var/lib/adagios"
 adagios_configfile = "/etc/adagios/adagios.conf"
 
 
+# Every worker process reloads adagios.conf when this file changes, see bump_config_generation().
+# None means a file in a directory only we can access, see adagios.private_files
+_config_generation_file = None
+
+# (adagios_configfile, [(filename, stat), ...]) for every file read by the last reload_configfile()
+_loaded_configfiles = None
+
+
+def _stat_configfile(filename):
+    """ Returns something that changes whenever filename is modified, replaced or removed """
+    try:
+        st = os.stat(filename)
+        return st.st_ino, st.st_mtime, st.st_size
+    except OSError:
+        return None
+
+
+def _get_config_generation_file():
+    """ Returns the path of the config generation file, or None if there is no safe place for it """
+    if _config_generation_file:
+        return _config_generation_file
+    from adagios.private_files import get_private_dir, InsecureDirectory
+    try:
+        return os.path.join(get_private_dir('config'), 'generation')
+    except (IOError, OSError, InsecureDirectory) as e:
+        warn('Config changes are not shared between processes: %s' % e)
+        return None
+
+
+def _configfiles_changed(adagios_configfile):
+    """ Returns True if adagios_configfile or any of its includes changed since they were last read """
+    if _loaded_configfiles is None:
+        return True
+    loaded_configfile, stats = _loaded_configfiles
+    if loaded_configfile != adagios_configfile:
+        return True
+    for filename, stat in stats:
+        if _stat_configfile(filename) != stat:
+            return True
+    return False
+
+
 def reload_configfile(adagios_configfile=None):
-    "Process adagios.conf style file and any includes; updating the settings"
+    """Process adagios.conf style file and any includes; updating the settings
+
+    Files are only executed again if one of them (or the directory of the
+    include pattern) has changed since last time, or another process called
+    bump_config_generation(). Otherwise this costs a few stat() calls.
+    """
+    global _loaded_configfiles
     if not adagios_configfile:
         adagios_configfile = globals()['adagios_configfile']
+    if not _configfiles_changed(adagios_configfile):
+        return
+    requested_configfile = adagios_configfile
+    stats = [(x, _stat_configfile(x)) for x in (adagios_configfile, _get_config_generation_file()) if x]
     try:
         if not os.path.exists(adagios_configfile):
             alternative_adagios_configfile = "%s/adagios.conf" % djangopath
@@ -297,15 +370,43 @@ def reload_configfile(adagios_configfile=None):
             warn(message.format(**locals()))
             adagios_configfile = alternative_adagios_configfile
             open(adagios_configfile, "a").close()
+            stats.append((adagios_configfile, _stat_configfile(adagios_configfile)))
 
         execfile(adagios_configfile, globals())
         # if config has any default include, lets include that as well
         configfiles = glob(include)
         for configfile in configfiles:
+            stats.append((configfile, _stat_configfile(configfile)))
             execfile(configfile, globals())
+        # New files matching the include pattern show up as a change in their directory
+        if include:
+            include_directories = set(os.path.dirname(x) for x in configfiles)
+            include_directories.add(os.path.dirname(include))
+            for directory in sorted(include_directories):
+                stats.append((directory, _stat_configfile(directory)))
+        _loaded_configfiles = (requested_configfile, stats)
     except IOError as e:
         warn('Unable to open %s: %s' % (adagios_configfile, e.strerror))
 
+
+def bump_config_generation():
+    """ Make every adagios process reload its config files, call this after writing to them """
+    generation_file = _get_config_generation_file()
+    if not generation_file:
+        return
+    try:
+        with open(generation_file) as f:
+            generation = int(f.read() or 0)
+    except (IOError, OSError, ValueError):
+        generation = 0
+    try:
+        fd, tempname = tempfile.mkstemp(dir=os.path.dirname(generation_file), prefix='.adagios-config')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(generation + 1))
+        os.rename(tempname, generation_file)
+    except (IOError, OSError) as e:
+        warn('Unable to update %s: %s' % (generation_file, e))
+
 reload_configfile()
 
 try:
@@ -333,6 +434,10 @@ else:
 
 ALLOWED_INCLUDE_ROOTS = (serverside_includes,)
 
+# Templates compiled during warm-up are only worth it if they are kept
+if wsgi_warmup:
+    TEMPLATE_LOADERS = (('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),)
+
 if enable_status_view:
     #plugins['status'] = 'adagios.status'
     plugins['status'] = 'status'
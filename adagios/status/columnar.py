@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Compact storage of large livestatus results.
+#
+# A list of dicts repeats every column name in every row. A Table stores one
+# list per column instead, and hands out small Row objects that look up their
+# values in those lists. Rows support dict style access, so templates and
+# most code that expects a list of dicts work without changes.
+
+from __future__ import unicode_literals
+from builtins import object
+from builtins import range
+from collections import OrderedDict
+
+
+class _Missing(object):
+    """ Marks a column that has no value in a row, the same way a key missing from a dict would """
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+
+class Table(object):
+    """ Livestatus rows, stored one list per column.
+
+    Example:
+        >>> table = Table.from_rows([{'name': 'localhost', 'state': 0}])
+        >>> table[0]['name']
+        'localhost'
+        >>> table.column('state')
+        [0]
+    """
+
+    def __init__(self, columns=()):
+        self._columns = OrderedDict((name, []) for name in columns)
+        self._length = 0
+
+    @classmethod
+    def from_rows(cls, rows, columns=()):
+        """ Returns a new Table with every row (dict) in rows. Rows are read one at a time, so rows can be a generator. """
+        table = cls(columns)
+        for row in rows:
+            table.append(row)
+        return table
+
+    def append(self, row):
+        """ Append one row (a dict) to the end of this table """
+        for name in row:
+            if name not in self._columns:
+                self._columns[name] = [MISSING] * self._length
+        for name, values in self._columns.items():
+            values.append(row.get(name, MISSING))
+        self._length += 1
+
+    def has_column(self, name):
+        return name in self._columns
+
+    def column(self, name):
+        """ Returns the list that holds the values of column name, an empty column is created if needed """
+        if name not in self._columns:
+            self._columns[name] = [MISSING] * self._length
+        return self._columns[name]
+
+    def set_column(self, name, values):
+        """ Replace every value of column name with values """
+        values = list(values)
+        if len(values) != self._length:
+            raise ValueError("Column %s has %s values, table has %s rows" % (name, len(values), self._length))
+        self._columns[name] = values
+
+    def sort(self, key=None, reverse=False):
+        """ Sort this table in place, key gets a Row and works like key for list.sort() """
+        if key is None:
+            raise ValueError("Tables can only be sorted with a key function")
+        order = sorted(range(self._length), key=lambda i: key(Row(self, i)), reverse=reverse)
+        for name, values in self._columns.items():
+            self._columns[name] = [values[i] for i in order]
+
+    def to_dicts(self):
+        """ Returns this table as a list of dicts, like a livestatus query would """
+        return [row.to_dict() for row in self]
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield Row(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = Table()
+            for name, values in self._columns.items():
+                table._columns[name] = values[index]
+            table._length = len(range(*index.indices(self._length)))
+            return table
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("Table index out of range")
+        return Row(self, index)
+
+    def __repr__(self):
+        return '<Table: %s rows, columns: %s>' % (self._length, ', '.join(self._columns))
+
+
+class Row(object):
+    """ One row in a Table, behaves like a dict """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        columns = self._table._columns
+        if key not in columns:
+            raise KeyError(key)
+        value = columns[key][self._index]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._table.column(key)[self._index] = value
+
+    def __contains__(self, key):
+        columns = self._table._columns
+        return key in columns and columns[key][self._index] is not MISSING
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [name for name in self._table._columns if name in self]
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
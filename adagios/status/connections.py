@@ -0,0 +1,647 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Long lived livestatus connections. Every worker process keeps a small pool
+# of sockets per backend that talk to livestatus with "KeepAlive: on", so
+# a page that makes a dozen queries does not pay a dozen socket setups.
+
+from __future__ import unicode_literals
+from builtins import object
+import ast
+import codecs
+import heapq
+import itertools
+import os
+import select
+import socket
+import threading
+import time
+from collections import defaultdict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+import pynag.Parsers
+from pynag.Parsers.livestatus import LivestatusError
+from django.utils.translation import ugettext as _
+
+import adagios.settings
+import adagios.status.health
+from adagios.misc.rest import add_notification, clear_notification
+
+# Length of the header livestatus sends back when "ResponseHeader: fixed16" is set
+_FIXED16_HEADER_LENGTH = 16
+
+_KEEPALIVE_HEADER = 'KeepAlive: on'
+_RESPONSEHEADER_FIXED16 = 'ResponseHeader: fixed16'
+
+# Number of threads that talk to livestatus backends in parallel
+_FANOUT_THREADS = 16
+
+
+class ConnectionPool(object):
+    """ Per process pool of idle livestatus sockets.
+
+    Sockets are keyed by (livestatus_socket_path, authuser). A socket is handed
+    out to one caller at a time, and put back when the caller has read a full
+    response from it. Sockets that have been idle for longer than idle_timeout
+    or that the remote end has closed are thrown away instead of being reused.
+    """
+
+    def __init__(self, max_idle=None, idle_timeout=None):
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self._pid = os.getpid()
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        self.statistics = defaultdict(int)
+
+    @property
+    def max_idle(self):
+        if self._max_idle is not None:
+            return self._max_idle
+        return int(adagios.settings.livestatus_pool_size)
+
+    @property
+    def idle_timeout(self):
+        if self._idle_timeout is not None:
+            return self._idle_timeout
+        return float(adagios.settings.livestatus_pool_idle_timeout)
+
+    def _check_pid(self):
+        """ Forget about sockets that were inherited from a parent process.
+
+        Sockets opened before a fork are shared between parent and child, so
+        the child must never write to them. We do not close them either, that
+        would also take them away from the parent.
+        """
+        if self._pid != os.getpid():
+            self._idle = defaultdict(list)
+            self._pid = os.getpid()
+
+    def get(self, key):
+        """ Returns an idle socket for key, or None if we have no healthy idle socket. """
+        now = time.time()
+        with self._lock:
+            self._check_pid()
+            idle = self._idle[key]
+            while idle:
+                sock, last_used = idle.pop()
+                if now - last_used > self.idle_timeout or not _is_alive(sock):
+                    self.statistics['evicted'] += 1
+                    _close(sock)
+                    continue
+                self.statistics['reused'] += 1
+                return sock
+        return None
+
+    def put(self, key, sock):
+        """ Return a socket to the pool after a complete response was read from it. """
+        with self._lock:
+            self._check_pid()
+            idle = self._idle[key]
+            if len(idle) >= self.max_idle:
+                self.statistics['discarded'] += 1
+                _close(sock)
+                return
+            idle.append((sock, time.time()))
+
+    def discard(self, sock):
+        """ Close a socket that is in an unknown state. """
+        with self._lock:
+            self.statistics['discarded'] += 1
+        _close(sock)
+
+    def record_created(self):
+        """ Count a new socket, made because the pool had no idle one. """
+        with self._lock:
+            self.statistics['created'] += 1
+
+    def evict_idle(self):
+        """ Close all sockets that have been idle for longer than idle_timeout. """
+        now = time.time()
+        with self._lock:
+            self._check_pid()
+            for key, idle in list(self._idle.items()):
+                keep = []
+                for sock, last_used in idle:
+                    if now - last_used > self.idle_timeout:
+                        self.statistics['evicted'] += 1
+                        _close(sock)
+                    else:
+                        keep.append((sock, last_used))
+                self._idle[key] = keep
+
+    def close_all(self):
+        """ Close every idle socket in the pool. """
+        with self._lock:
+            self._check_pid()
+            for idle in self._idle.values():
+                for sock, last_used in idle:
+                    _close(sock)
+            self._idle = defaultdict(list)
+
+    def get_statistics(self):
+        """ Returns a dict with counters and the number of idle sockets per backend. """
+        with self._lock:
+            result = dict(self.statistics)
+            result['idle'] = dict(('%s (%s)' % (path, authuser or 'no authuser'), len(idle))
+                                  for (path, authuser), idle in self._idle.items())
+        return result
+
+
+def _is_alive(sock):
+    """ Returns False if the remote end has closed sock.
+
+    An idle keepalive socket should never have anything to read, if select()
+    says it is readable then livestatus has hung up (or sent garbage).
+    """
+    try:
+        readable, writable, errors = select.select([sock], [], [sock], 0)
+    except (socket.error, ValueError):
+        return False
+    return not readable and not errors
+
+
+def _close(sock):
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+
+def _recv_exactly(sock, length):
+    """ Read exactly length bytes from sock. """
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            raise LivestatusError("Livestatus closed the connection in the middle of a response")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def _add_keepalive(query):
+    """ Returns query with a 'KeepAlive: on' header added to it. """
+    lines = [x for x in query.strip().splitlines()]
+    if _KEEPALIVE_HEADER not in lines:
+        lines.append(_KEEPALIVE_HEADER)
+    return '\n'.join(lines) + '\n\n'
+
+
+def _iter_python_rows(chunks):
+    """ Parse a livestatus response in python format, one row at a time.
+
+    Livestatus puts every row of a python formatted response on a line of its
+    own (newlines inside values are escaped), so we can parse each line as it
+    arrives instead of waiting for the whole response:
+
+        [["host_name","state"],
+        ["localhost",0]]
+
+    Arguments:
+        chunks -- Iterable of strings, the response body as it comes from the socket
+
+    Yields:
+        One list per row, the column headers (if any) being the first row.
+    """
+    buffer = ''
+    started = False
+    previous_line = None
+    for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split('\n')
+        buffer = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if not started:
+                # Opening bracket of the list that holds all the rows
+                line = line[1:]
+                started = True
+            # We are always one line behind, because the last line has the
+            # closing bracket of the outer list that we have to remove
+            if previous_line is not None:
+                for row in _parse_python_line(previous_line):
+                    yield row
+            previous_line = line
+    line = buffer.strip()
+    if line:
+        if not started:
+            line = line[1:]
+        if previous_line is not None:
+            for row in _parse_python_line(previous_line):
+                yield row
+        previous_line = line
+    if previous_line:
+        for row in _parse_python_line(previous_line.rstrip()[:-1]):
+            yield row
+
+
+def _parse_python_line(line):
+    """ Returns a list of rows found in one line of python formatted livestatus output """
+    line = line.strip().rstrip(',')
+    if not line:
+        return []
+    result = ast.literal_eval(line)
+    # More than one row on the same line
+    if isinstance(result, tuple):
+        return list(result)
+    return [result]
+
+
+# One pool per worker process
+pool = ConnectionPool()
+
+_fanout_pool = None
+_fanout_pool_pid = None
+_fanout_pool_lock = threading.Lock()
+
+
+def _get_fanout_pool():
+    """ Returns the thread pool used to query multiple backends at the same time.
+
+    Threads do not survive a fork, so every process creates its own pool.
+    """
+    global _fanout_pool, _fanout_pool_pid
+    with _fanout_pool_lock:
+        if _fanout_pool is None or _fanout_pool_pid != os.getpid():
+            _fanout_pool = ThreadPool(processes=_FANOUT_THREADS)
+            _fanout_pool_pid = os.getpid()
+        return _fanout_pool
+
+
+def _get_backend_timeout():
+    """ Returns livestatus_backend_timeout as a float, or None if there is no timeout """
+    timeout = adagios.settings.livestatus_backend_timeout
+    if not timeout:
+        return None
+    return float(timeout)
+
+
+class PooledLivestatus(pynag.Parsers.Livestatus):
+    """ Same as pynag.Parsers.Livestatus, except sockets are reused between queries.
+
+    Only queries that ask for a fixed16 response header can be pooled, because
+    that header tells us exactly how many bytes to read before the socket can
+    be used again. pynag adds that header to everything that goes through
+    query(), anything else falls back to one socket per query.
+    """
+
+    # If set, results of GET queries are remembered here (see adagios.status.utils.QueryCache)
+    query_cache = None
+
+    # True once a failure of the current query has been recorded, pynag
+    # retries a failed query and that is still only one failure.
+    _failure_recorded = False
+
+    # Seconds a socket may block before the query fails. None waits forever,
+    # PooledMultiSite sets this when it queries several backends at once.
+    socket_timeout = None
+
+    def _pool_key(self):
+        return self.livestatus_socket_path, self.authuser
+
+    def _get_socket(self):
+        sock = super(PooledLivestatus, self)._get_socket()
+        sock.settimeout(self.socket_timeout)
+        return sock
+
+    def query(self, query, *args, **kwargs):
+        cache = self.query_cache
+        if cache is None:
+            return self._query(query, *args, **kwargs)
+        key = cache.make_key(self.livestatus_socket_path, self.authuser, query, *args, **kwargs)
+        if key is None:
+            return self._query(query, *args, **kwargs)
+        found, result = cache.get(key)
+        if found:
+            return result
+        result = self._query(query, *args, **kwargs)
+        cache.set(key, result)
+        return result
+
+    def _query(self, query, *args, **kwargs):
+        self._failure_recorded = False
+        try:
+            return super(PooledLivestatus, self).query(query, *args, **kwargs)
+        finally:
+            self._failure_recorded = False
+
+    def write(self, livestatus_query):
+        """ Same as pynag.Parsers.Livestatus.write(), health of the backend is recorded on the way """
+        start_time = time.time()
+        try:
+            result = self._write(livestatus_query)
+        except Exception as e:
+            if not self._failure_recorded:
+                adagios.status.health.monitor.record_failure(self.livestatus_socket_path, e)
+                self._failure_recorded = True
+            raise
+        adagios.status.health.monitor.record_success(self.livestatus_socket_path, time.time() - start_time)
+        return result
+
+    def _write(self, livestatus_query):
+        if not adagios.settings.livestatus_keepalive or _RESPONSEHEADER_FIXED16 not in livestatus_query:
+            return super(PooledLivestatus, self).write(livestatus_query)
+
+        query = _add_keepalive(livestatus_query).encode('utf-8')
+        key = self._pool_key()
+
+        # A socket from the pool may have been closed by livestatus since we
+        # last used it (for example when nagios reloads). In that case we
+        # try exactly once more, with a brand new socket.
+        sock = pool.get(key)
+        if sock is not None:
+            try:
+                sock.settimeout(self.socket_timeout)
+                return self._write_to_socket(key, sock, query)
+            except (IOError, socket.error, LivestatusError):
+                pool.discard(sock)
+        sock = self._get_socket()
+        pool.record_created()
+        try:
+            return self._write_to_socket(key, sock, query)
+        except (IOError, socket.error):
+            pool.discard(sock)
+            msg = "Could not write to socket '%s'. Make sure you have the right permissions"
+            raise LivestatusError(msg % self.livestatus_socket_path)
+        except LivestatusError:
+            pool.discard(sock)
+            raise
+
+    def query_stream(self, query, *args, **kwargs):
+        """ Same as query(), except rows are yielded one at a time, as they are read from livestatus.
+
+        Stats queries are not supported, use query() for those.
+        """
+        kwargs.pop('columns', None)
+        livestatus_query = pynag.Parsers.LivestatusQuery(query, *args, **kwargs)
+        self._process_query(livestatus_query)
+        if livestatus_query.get_header('OutputFormat') != 'python':
+            raise LivestatusError("Only OutputFormat: python can be streamed")
+        rows = _iter_python_rows(self._stream(livestatus_query.get_query()))
+        if not livestatus_query.column_headers():
+            for row in rows:
+                yield row
+            return
+        column_headers = next(rows, None)
+        for row in rows:
+            yield dict(list(zip(column_headers, row)))
+
+    def _stream(self, livestatus_query):
+        """ Send livestatus_query and yield the response body in chunks of text.
+
+        The socket goes back to the pool only if the whole response was read.
+        """
+        keepalive = adagios.settings.livestatus_keepalive
+        if keepalive:
+            livestatus_query = _add_keepalive(livestatus_query)
+        query = livestatus_query.encode('utf-8')
+        key = self._pool_key()
+        start_time = time.time()
+        sock, header = None, None
+        try:
+            sock = keepalive and pool.get(key)
+            if sock:
+                try:
+                    sock.settimeout(self.socket_timeout)
+                    header = self._send_and_read_header(sock, query)
+                except (IOError, socket.error, LivestatusError):
+                    pool.discard(sock)
+                    sock = None
+            if not sock:
+                sock = self._get_socket()
+                pool.record_created()
+                header = self._send_and_read_header(sock, query)
+        except Exception as e:
+            if sock:
+                pool.discard(sock)
+            adagios.status.health.monitor.record_failure(self.livestatus_socket_path, e)
+            raise
+        adagios.status.health.monitor.record_success(self.livestatus_socket_path, time.time() - start_time)
+
+        complete = False
+        try:
+            length = int(header[4:15])
+            if not header.startswith(b'200'):
+                body = _recv_exactly(sock, length).decode('utf-8')
+                raise LivestatusError("Error '%s' from livestatus: %s" % (header[:3].decode('utf-8'), body))
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            while length > 0:
+                chunk = sock.recv(min(length, 65536))
+                if not chunk:
+                    raise LivestatusError("Livestatus closed the connection in the middle of a response")
+                length -= len(chunk)
+                yield decoder.decode(chunk)
+            complete = True
+        finally:
+            if complete and keepalive:
+                pool.put(key, sock)
+            else:
+                pool.discard(sock)
+
+    def _send_and_read_header(self, sock, query):
+        sock.sendall(query)
+        header = _recv_exactly(sock, _FIXED16_HEADER_LENGTH)
+        try:
+            int(header[4:15])
+        except ValueError:
+            raise LivestatusError("Invalid response header from livestatus: %r" % header)
+        return header
+
+    def _write_to_socket(self, key, sock, query):
+        """ Send query on sock, read exactly one response and put sock back in the pool. """
+        sock.sendall(query)
+        header = _recv_exactly(sock, _FIXED16_HEADER_LENGTH)
+        try:
+            length = int(header[4:15])
+        except ValueError:
+            raise LivestatusError("Invalid response header from livestatus: %r" % header)
+        body = _recv_exactly(sock, length)
+        if header.startswith(b'200'):
+            pool.put(key, sock)
+        else:
+            # Livestatus might close the connection after an error, so we
+            # do not risk reusing it.
+            pool.discard(sock)
+        return (header + body).decode('utf-8')
+
+
+class PooledMultiSite(pynag.Parsers.MultiSite):
+    """ Same as pynag.Parsers.MultiSite, except every backend is a PooledLivestatus
+
+    When there is more than one backend, queries are sent to all of them at
+    the same time. A backend that fails or does not answer within
+    livestatus_backend_timeout is left out of the results, and a warning is
+    shown in the notification bar until it answers again.
+
+    Backends whose circuit breaker is open (see adagios.status.health) are
+    skipped without waiting for them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.query_cache = kwargs.pop('query_cache', None)
+        super(PooledMultiSite, self).__init__(*args, **kwargs)
+        # Backends that failed during the lifetime of this instance. name -> error message
+        self.failed_backends = {}
+
+    def query(self, query, *args, **kwargs):
+        doing_stats = any([x.startswith('Stats:') for x in args + (query,)])
+        result = []
+        for name, query_result in self._query_backends(query, args, kwargs):
+            if doing_stats:
+                result = self._merge_statistics(result, query_result)
+            else:
+                for row in query_result:
+                    row['backend'] = name
+                    result.append(row)
+        return result
+
+    def query_stream(self, query, *args, **kwargs):
+        """ Same as query(), except rows are yielded one at a time as they are read from livestatus.
+
+        Backends are read one after another. A backend that fails is reported
+        with a notification and skipped, unless every backend fails.
+        """
+        backend = kwargs.pop('backend', None)
+        names = [name for name in self.backends if not backend or backend == name]
+        names = self._skip_unhealthy_backends(names)
+        errors = []
+        for name in names:
+            try:
+                for row in self.backends[name].query_stream(query, *args, **kwargs):
+                    row['backend'] = name
+                    yield row
+            except Exception as e:
+                if len(names) == 1:
+                    raise
+                errors.append((name, e))
+                self.failed_backends[name] = str(e)
+                message = _("Livestatus backend %(backend)s failed, results are incomplete: %(error)s")
+                add_notification(level="warning", notification_id='livestatus_backend_%s' % name,
+                                 message=message % {'backend': name, 'error': e})
+        if names and len(errors) == len(names):
+            raise errors[0][1]
+
+    def query_top(self, count, key, query, *args, **kwargs):
+        """ Same as query(), except only the first count rows, when sorted by key, are returned.
+
+        Every backend sorts its own rows and only hands over the first count of
+        them, then the sorted lists from all backends are merged.
+        """
+        def top(rows):
+            return heapq.nsmallest(count, rows, key=key)
+
+        sorted_lists = []
+        for i, (name, rows) in enumerate(self._query_backends(query, args, kwargs, top)):
+            for row in rows:
+                row['backend'] = name
+            # (key, backend, position) makes sure rows themselves are never compared
+            sorted_lists.append([(key(row), i, position, row) for position, row in enumerate(rows)])
+        merged = heapq.merge(*sorted_lists)
+        return [row for sort_key, i, position, row in itertools.islice(merged, count)]
+
+    def _query_backends(self, query, args, kwargs, process=None):
+        """ Send query to every backend at the same time.
+
+        Arguments:
+            process -- Optional function that every backend result is passed through
+                       in the worker thread, before it is handed back.
+
+        Returns:
+            List of (backend name, result) for every backend that answered.
+        """
+        backend = kwargs.pop('backend', None)
+        names = [name for name in self.backends if not backend or backend == name]
+        names = self._skip_unhealthy_backends(names)
+
+        def run(name):
+            result = self.backends[name].query(query, *args, **kwargs)
+            if process:
+                result = process(result)
+            return result
+
+        if len(names) < 2:
+            return [(name, run(name)) for name in names]
+
+        timeout = _get_backend_timeout()
+        fanout_pool = _get_fanout_pool()
+        pending = []
+        for name in names:
+            # A worker thread must not hang on a dead backend after we stop waiting for it
+            self.backends[name].socket_timeout = timeout
+            pending.append((name, fanout_pool.apply_async(run, (name,))))
+
+        # All backends are working at the same time, so they share one deadline
+        deadline = timeout and time.time() + timeout
+        results = []
+        errors = []
+        for name, async_result in pending:
+            try:
+                if deadline:
+                    query_result = async_result.get(max(0, deadline - time.time()))
+                else:
+                    query_result = async_result.get()
+            except TimeoutError:
+                error = LivestatusError(_("No response within %s seconds") % timeout)
+                errors.append((name, error))
+                continue
+            except Exception as e:
+                errors.append((name, e))
+                continue
+            clear_notification('livestatus_backend_%s' % name)
+            results.append((name, query_result))
+
+        # If no backend answered, there are no partial results to show
+        if len(errors) == len(names):
+            raise errors[0][1]
+
+        for name, error in errors:
+            self.failed_backends[name] = str(error)
+            message = _("Livestatus backend %(backend)s failed, results are incomplete: %(error)s")
+            add_notification(level="warning", notification_id='livestatus_backend_%s' % name,
+                             message=message % {'backend': name, 'error': error})
+        return results
+
+    def add_backend(self, path, name):
+        backend = PooledLivestatus(
+            livestatus_socket_path=path,
+            nagios_cfg_file=self.nagios_cfg_file,
+            authuser=self.authuser
+        )
+        backend.query_cache = self.query_cache
+        self.backends[name] = backend
+
+    def _skip_unhealthy_backends(self, names):
+        """ Returns names without the backends whose circuit breaker is open.
+
+        Raises LivestatusError if every backend in names is marked as down.
+        """
+        healthy = []
+        for name in names:
+            if adagios.status.health.monitor.allow(self.backends[name].livestatus_socket_path):
+                healthy.append(name)
+            else:
+                self.failed_backends[name] = _("Backend is marked as down")
+        if names and not healthy:
+            raise LivestatusError(_("All livestatus backends are marked as down: %s") % ', '.join(names))
+        return healthy
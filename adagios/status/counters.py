@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Counters in the navigation bar (unhandled problems, tagged comments,
+# notifications), computed by one poller per worker process.
+#
+# Counters depend on who is asking, so they are kept per remote user. Page
+# loads read the latest counters of their user, and browsers that keep
+# /status/counters open get new counters pushed to them as Server-Sent
+# Events whenever they change. However many tabs a user has open, their
+# counters are computed once every navbar_push_interval seconds.
+#
+# Every open event stream keeps a web server thread busy, so pushing is off
+# unless navbar_push is set, and each process serves at most
+# navbar_push_max_streams streams. Browsers that are turned away keep the
+# counters their page was rendered with.
+
+from __future__ import unicode_literals
+from builtins import object
+import os
+import threading
+import time
+from collections import defaultdict
+from queue import Queue, Empty
+
+import simplejson as json
+from django.http import HttpRequest
+
+import adagios.settings
+import adagios.status.utils
+from adagios import notifications
+
+# Keys of adagios.status.utils.get_statistics() that the navbar shows
+COUNTER_KEYS = [
+    'num_problems',
+    'num_unhandled_problems',
+    'num_service_problems_all',
+    'num_service_problems_unhandled',
+    'num_host_problems_all',
+    'num_host_problems_unhandled',
+    'num_problems_all',
+    'num_problems_unhandled',
+    'tagged_comments',
+]
+
+
+class CounterPoller(object):
+    """ Computes navbar counters once per interval and hands them to everyone who is interested """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # remote_user -> (timestamp, counters)
+        self._latest = {}
+        # remote_user -> list of Queue, one for every open event stream
+        self._subscribers = defaultdict(list)
+        self._thread = None
+        self._pid = None
+
+    def get_counters(self, remote_user):
+        """ Returns the counters of remote_user, computes them if they are older than navbar_push_interval """
+        interval = float(adagios.settings.navbar_push_interval or 0)
+        latest = self._latest.get(remote_user)
+        if latest and time.time() - latest[0] < interval:
+            return latest[1]
+        return self.refresh(remote_user)
+
+    def refresh(self, remote_user):
+        """ Compute the counters of remote_user now, and push them to its subscribers if they changed """
+        counters = compute_counters(remote_user)
+        with self._lock:
+            previous = self._latest.get(remote_user)
+            self._latest[remote_user] = (time.time(), counters)
+            subscribers = list(self._subscribers.get(remote_user, []))
+        if previous is None or previous[1] != counters:
+            for queue in subscribers:
+                queue.put(counters)
+        return counters
+
+    def subscribe(self, remote_user, max_subscribers=None):
+        """ Returns a Queue that receives new counters of remote_user. Call unsubscribe() when done.
+
+        Returns None if this process already has max_subscribers subscribers.
+        """
+        self.start()
+        queue = Queue()
+        counters = self.get_counters(remote_user)
+        with self._lock:
+            if max_subscribers is not None and self.count_subscribers() >= max_subscribers:
+                return None
+            queue.put(counters)
+            self._subscribers[remote_user].append(queue)
+        return queue
+
+    def count_subscribers(self):
+        return sum(len(x) for x in list(self._subscribers.values()))
+
+    def unsubscribe(self, remote_user, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(remote_user, [])
+            if queue in subscribers:
+                subscribers.remove(queue)
+            if not subscribers:
+                self._subscribers.pop(remote_user, None)
+
+    def start(self):
+        """ Start the background poller, unless it is already running in this process """
+        if not adagios.settings.navbar_push_interval:
+            return
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='adagios-navbar-counters')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(float(adagios.settings.navbar_push_interval))
+            with self._lock:
+                remote_users = list(self._subscribers.keys())
+            for remote_user in remote_users:
+                try:
+                    self.refresh(remote_user)
+                except Exception:
+                    pass
+
+
+def compute_counters(remote_user):
+    """ Returns a dict with navbar counters, as remote_user would see them """
+    request = HttpRequest()
+    if remote_user:
+        request.META['REMOTE_USER'] = remote_user
+    counters = {}
+    try:
+        statistics = adagios.status.utils.get_statistics(request)
+        for key in COUNTER_KEYS:
+            counters[key] = statistics[key]
+    except Exception:
+        pass
+    visible = [x for x in list(notifications.values()) if not x.get('user') or x.get('user') == remote_user]
+    counters['notifications'] = len(visible)
+    return counters
+
+
+def event_stream(request):
+    """ Returns an iterable of navbar counters of the user behind request, formatted as Server-Sent Events.
+
+    Returns None if pushing is turned off, or this process already serves
+    navbar_push_max_streams streams.
+
+    The stream ends after navbar_push_max_age seconds, browsers reconnect
+    on their own. That way a stream never keeps a web server worker forever.
+    """
+    if not adagios.settings.navbar_push or not adagios.settings.navbar_push_interval:
+        return None
+    remote_user = request.META.get('REMOTE_USER')
+    queue = poller.subscribe(remote_user, int(adagios.settings.navbar_push_max_streams))
+    if queue is None:
+        return None
+    return _EventStream(remote_user, queue)
+
+
+class _EventStream(object):
+    """ Server-Sent Events from queue. close() unsubscribes, even if iteration never started. """
+
+    def __init__(self, remote_user, queue):
+        self.remote_user = remote_user
+        self.queue = queue
+
+    def __iter__(self):
+        interval = float(adagios.settings.navbar_push_interval or 0) or 30
+        deadline = time.time() + float(adagios.settings.navbar_push_max_age)
+        try:
+            yield 'retry: %d\n\n' % (interval * 1000)
+            while time.time() < deadline:
+                try:
+                    counters = self.queue.get(timeout=interval)
+                except Empty:
+                    # Comments keep proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'data: %s\n\n' % json.dumps(counters)
+        finally:
+            self.close()
+
+    def close(self):
+        poller.unsubscribe(self.remote_user, self.queue)
+
+
+# One poller per worker process
+poller = CounterPoller()
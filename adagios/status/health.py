@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Health of livestatus backends. A background thread in every worker process
+# probes all backends on an interval, and every socket round trip made by
+# adagios.status.connections is recorded here as well. Pages read backend
+# health from memory instead of testing every backend on every page load.
+#
+# Every backend has a circuit breaker:
+#  closed    -- Backend works, queries are sent to it
+#  open      -- Backend failed livestatus_breaker_threshold times in a row,
+#               queries skip it until livestatus_breaker_cooldown has passed
+#  half_open -- Cooldown has passed, one query is let through to see if the
+#               backend is back. Others skip it until that query is done.
+
+from __future__ import unicode_literals
+from builtins import object
+import os
+import threading
+import time
+from collections import deque
+
+import adagios.settings
+import adagios.status.connections
+import adagios.status.utils
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# How many latency measurements we keep per backend
+_LATENCY_HISTORY = 60
+
+# Seconds a probe waits for a backend when livestatus_backend_timeout is 0.
+# Backends are probed one after another, a hung one must not stop the rest.
+_PROBE_TIMEOUT = 10
+
+
+class BackendHealth(object):
+    """ Circuit breaker state and latency history of one livestatus socket """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_success = None
+        self.last_failure = None
+        self.opened_at = None
+        # When the trial query of a half open breaker was let through
+        self.trial_started = None
+        self.latency = deque(maxlen=_LATENCY_HISTORY)
+
+    def to_dict(self):
+        latency = [seconds for timestamp, seconds in self.latency]
+        return {
+            'path': self.path,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'last_success': self.last_success,
+            'last_failure': self.last_failure,
+            'average_latency': sum(latency) / len(latency) if latency else None,
+            'latency': list(self.latency),
+        }
+
+
+class HealthMonitor(object):
+    """ Keeps track of the health of every livestatus backend in this process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health = {}
+        # Backend name (from livestatus_path) -> socket path livestatus resolved it to
+        self._paths = {}
+        self._thread = None
+        self._pid = None
+
+    def _get(self, path):
+        if path not in self._health:
+            self._health[path] = BackendHealth(path)
+        return self._health[path]
+
+    def record_success(self, path, latency):
+        with self._lock:
+            health = self._get(path)
+            health.latency.append((time.time(), latency))
+            health.last_success = time.time()
+            health.consecutive_failures = 0
+            health.last_error = None
+            health.state = CLOSED
+            health.opened_at = None
+            health.trial_started = None
+
+    def record_failure(self, path, error):
+        with self._lock:
+            health = self._get(path)
+            health.last_failure = time.time()
+            health.last_error = str(error)
+            health.consecutive_failures += 1
+            threshold = int(adagios.settings.livestatus_breaker_threshold)
+            if health.state == HALF_OPEN or health.consecutive_failures >= threshold:
+                health.state = OPEN
+                health.opened_at = time.time()
+                health.trial_started = None
+
+    def allow(self, path):
+        """ Returns False if the breaker of path is open and queries should skip it
+
+        After the cooldown, only one caller is allowed through as a trial. If
+        the trial never reports back, another one is allowed after one more cooldown.
+        """
+        self.start()
+        with self._lock:
+            health = self._health.get(path)
+            if health is None or health.state == CLOSED:
+                return True
+            now = time.time()
+            cooldown = float(adagios.settings.livestatus_breaker_cooldown)
+            if health.state == OPEN and now - health.opened_at < cooldown:
+                return False
+            if health.state == HALF_OPEN and now - health.trial_started < cooldown:
+                return False
+            health.state = HALF_OPEN
+            health.trial_started = now
+            return True
+
+    def get(self, path):
+        """ Returns health of path as a dict, or None if we know nothing about it yet """
+        with self._lock:
+            health = self._health.get(path)
+            return health and health.to_dict()
+
+    def get_backend(self, name):
+        """ Same as get() except name is a backend name as listed in livestatus_path """
+        return self.get(self._paths.get(name, name))
+
+    def get_nonworking_backends(self):
+        """ Returns a list of backend names whose last probe or query failed """
+        self.start()
+        result = []
+        with self._lock:
+            for name in adagios.status.utils.get_all_backends():
+                health = self._health.get(self._paths.get(name, name))
+                if health and health.consecutive_failures:
+                    result.append(name)
+        return result
+
+    def get_statistics(self):
+        """ Returns health of every backend we know about, keyed by backend name """
+        result = {}
+        for name in adagios.status.utils.get_all_backends():
+            result[name] = self.get_backend(name)
+        return result
+
+    def probe(self):
+        """ Test every configured backend once. Results are recorded by the connection layer. """
+        for name in adagios.status.utils.get_all_backends():
+            try:
+                backend = adagios.status.connections.PooledLivestatus(livestatus_socket_path=name)
+            except Exception as e:
+                self.record_failure(name, e)
+                continue
+            self._paths[name] = backend.livestatus_socket_path
+            backend.socket_timeout = adagios.status.connections._get_backend_timeout() or _PROBE_TIMEOUT
+            try:
+                backend.query('GET status', 'Columns: program_start')
+            except Exception:
+                pass
+
+    def start(self):
+        """ Start the background probe thread, unless it is already running in this process """
+        if not adagios.settings.livestatus_health_interval:
+            return
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='adagios-backend-health')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception:
+                pass
+            time.sleep(float(adagios.settings.livestatus_health_interval))
+
+
+# One monitor per worker process
+monitor = HealthMonitor()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Hostgroups with service counts, and where they sit in the hostgroup tree.
+#
+# Livestatus counts services per hostgroup, so one query on the hostgroups
+# table gives the counts of every group. Nagios adds the hosts of every
+# hostgroup_members subgroup to the members of the parent group when it loads
+# its configuration, so those counts already cover the whole subtree.
+#
+# Livestatus does not know which hostgroup is a subgroup of which, that comes
+# from the configuration files through pynag. Parsing them is slow, so the
+# tree is kept in memory until nagios is restarted or reloaded.
+
+from __future__ import unicode_literals
+from builtins import object
+from past.utils import old_div
+import threading
+
+import pynag.Model
+
+import adagios.status.utils
+
+# Columns of the hostgroups table that the hostgroup pages show
+HOSTGROUP_COLUMNS = [
+    'name', 'alias', 'members_with_state', 'num_services_ok', 'num_services_warn',
+    'num_services_crit', 'num_services_unknown', 'num_services_pending',
+]
+
+
+class HostgroupTree(object):
+    """ Which hostgroups are subgroups (hostgroup_members) of which
+
+    Example:
+        >>> tree = HostgroupTree({'world': ['europe'], 'europe': ['iceland']})
+        >>> sorted(tree.get_descendants('world'))
+        ['europe', 'iceland']
+        >>> sorted(tree.get_parents('iceland'))
+        ['europe']
+    """
+
+    def __init__(self, children):
+        self._children = dict((name, frozenset(subgroups)) for name, subgroups in children.items())
+        self._parents = {}
+        for name, subgroups in self._children.items():
+            for subgroup in subgroups:
+                self._parents.setdefault(subgroup, set()).add(name)
+        self._descendants = {}
+        self._lock = threading.Lock()
+
+    def get_children(self, hostgroup_name):
+        return self._children.get(hostgroup_name, frozenset())
+
+    def get_parents(self, hostgroup_name):
+        return self._parents.get(hostgroup_name, set())
+
+    def get_descendants(self, hostgroup_name):
+        """ Returns a frozenset of every subgroup of hostgroup_name, their subgroups and so on """
+        with self._lock:
+            return self._get_descendants(hostgroup_name, set())
+
+    def _get_descendants(self, hostgroup_name, visiting):
+        if hostgroup_name in self._descendants:
+            return self._descendants[hostgroup_name]
+        # Nagios refuses loops in hostgroup_members, but the files on disk may have one
+        visiting.add(hostgroup_name)
+        result = set()
+        for child in self.get_children(hostgroup_name):
+            result.add(child)
+            if child not in visiting:
+                result.update(self._get_descendants(child, visiting))
+        visiting.discard(hostgroup_name)
+        result.discard(hostgroup_name)
+        result = frozenset(result)
+        self._descendants[hostgroup_name] = result
+        return result
+
+
+_tree = {'key': None, 'tree': None}
+_tree_lock = threading.Lock()
+
+
+def _get_generation():
+    """ Returns something that changes whenever nagios loads a new configuration """
+    import adagios.daemon
+    return pynag.Model.cfg_file, adagios.daemon.status_probe.get().get('program_start')
+
+
+def get_tree():
+    """ Returns the HostgroupTree of the configuration nagios is running with """
+    key = _get_generation()
+    if _tree['key'] == key and _tree['tree'] is not None:
+        return _tree['tree']
+    with _tree_lock:
+        if _tree['key'] != key or _tree['tree'] is None:
+            # Parsing every hostgroup fills in ObjectRelations
+            pynag.Model.Hostgroup.objects.all
+            children = dict(pynag.Model.ObjectRelations.hostgroup_hostgroups)
+            _tree['tree'] = HostgroupTree(children)
+            _tree['key'] = key
+        return _tree['tree']
+
+
+def clear_cache():
+    with _tree_lock:
+        _tree['key'] = None
+        _tree['tree'] = None
+
+
+def get_hostgroups(request, *args):
+    """ Returns a list of hostgroups with service counts, health and their place in the hostgroup tree
+
+    Every hostgroup is fetched with one livestatus query, any args are added to it.
+    """
+    livestatus = adagios.status.utils.livestatus(request)
+    hostgroups = livestatus.query('GET hostgroups', 'Columns: %s' % ' '.join(HOSTGROUP_COLUMNS), *args)
+    add_statistics(hostgroups)
+    return hostgroups
+
+
+def add_statistics(hostgroups):
+    """ Enriches a list of hostgroup dicts with information about subgroups, parentgroups and health """
+    tree = get_tree()
+    for hg in hostgroups:
+        hg['child_hostgroups'] = tree.get_children(hg['name'])
+        hg['parent_hostgroups'] = tree.get_parents(hg['name'])
+        hg['descendant_hostgroups'] = tree.get_descendants(hg['name'])
+        if 'members' not in hg and 'members_with_state' in hg:
+            hg['members'] = [x[0] for x in hg['members_with_state']]
+        add_health(hg)
+
+
+def add_health(hg):
+    """ Adds total, problems, health and percent_<state> to a host or hostgroup dict with num_services_<state> """
+    ok = hg.get('num_services_ok')
+    warn = hg.get('num_services_warn')
+    crit = hg.get('num_services_crit')
+    pending = hg.get('num_services_pending')
+    unknown = hg.get('num_services_unknown')
+    total = ok + warn + crit + pending + unknown
+    hg['total'] = total
+    hg['problems'] = warn + crit + unknown
+    try:
+        total = float(total)
+        hg['health'] = float(ok) / total * 100.0
+        hg['percent_ok'] = old_div(ok, total) * 100
+        hg['percent_warn'] = old_div(warn, total) * 100
+        hg['percent_crit'] = old_div(crit, total) * 100
+        hg['percent_unknown'] = old_div(unknown, total) * 100
+        hg['percent_pending'] = old_div(pending, total) * 100
+    except ZeroDivisionError:
+        pass
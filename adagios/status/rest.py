@@ -28,11 +28,16 @@ from past.builtins import cmp
 from functools import cmp_to_key
 from builtins import str, int
 from past.utils import old_div
+import threading
 import time
 import pynag.Control.Command
 import pynag.Model
 import pynag.Utils
+import adagios.settings
 import adagios.status.utils
+import adagios.status.health
+import adagios.status.snapshots
+import adagios.status.topology
 import pynag.Parsers
 import collections
 
@@ -47,26 +52,115 @@ def hosts(request, fields=None, **kwargs):
 
             Any **kwargs will be treated as a pynag.Utils.grep()-style filter
     """
+    # A compact columnar.Table can not be serialized, it is only for views
+    kwargs.pop('compact', None)
     return adagios.status.utils.get_hosts(request=request, fields=fields, **kwargs)
 
 
 def services(request, fields=None, **kwargs):
     """ Similar to hosts(), is a wrapper around adagios.status.utils.get_services()
+
+    Services are streamed to the client as they are read from livestatus.
     """
-    return adagios.status.utils.get_services(request=request, fields=fields, **kwargs)
+    return adagios.status.utils.get_services_stream(request=request, fields=fields, **kwargs)
+
+# Livestatus can not sort, so a sorted services_dt page needs every matching
+# service. The sorted services are kept this many seconds, so paging through
+# the same table does not fetch and sort every service again for each page.
+_DT_CACHE_TTL = 30
+
+# How many sorted tables we keep per process
+_DT_CACHE_SIZE = 8
+
+_dt_cache = collections.OrderedDict()
+_dt_cache_lock = threading.Lock()
+
+
+def _get_int(kwargs, name, default, minimum=None, maximum=None):
+    """ Returns kwargs[name] as an int clamped to minimum and maximum, or default if it is not a number """
+    try:
+        value = int(kwargs.get(name))
+    except (TypeError, ValueError):
+        return default
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def _get_sorted_services(request, columns, order_by, filters, refresh=False):
+    """ Returns every service matching filters sorted by order_by, possibly from _dt_cache """
+    key = (request.META.get('REMOTE_USER'), tuple(columns), tuple(order_by), tuple(sorted(filters.items())))
+    now = time.time()
+    with _dt_cache_lock:
+        cached = _dt_cache.get(key)
+    if cached and not refresh and now - cached[0] < _DT_CACHE_TTL:
+        return cached[1]
+    services = adagios.status.utils.get_services(
+        request=request, fields=columns, limit=0, order_by=order_by, **filters)
+    with _dt_cache_lock:
+        _dt_cache.pop(key, None)
+        _dt_cache[key] = (now, services)
+        while len(_dt_cache) > _DT_CACHE_SIZE:
+            _dt_cache.popitem(last=False)
+    return services
+
 
 def services_dt(request, fields=None, **kwargs):
-    """ Similar to hosts(), is a wrapper around adagios.status.utils.get_services()
+    """ Services in the format of the DataTables server-side processing protocol.
+
+    Only one page of services is returned, as requested by DataTables with
+    iDisplayStart, iDisplayLength, sSearch, iSortingCols, iSortCol_N and sSortDir_N.
+
+    Unsorted pages are fetched one at a time. Livestatus can not sort, so for
+    a sorted table every matching service is fetched and sorted, and kept for
+    _DT_CACHE_TTL seconds for the following pages. The first page is always
+    fetched again, so other pages may be up to _DT_CACHE_TTL seconds old.
+
+        Arguments:
+            fields -- Comma separated list of columns, in the same order as the columns of the table
     """
-    services = adagios.status.utils.get_services(request=request, fields='host_name,description')
+    columns = (fields or 'host_name,description').split(',')
+    offset = _get_int(kwargs, 'iDisplayStart', 0, minimum=0)
+    # DataTables asks for -1 rows when it wants all of them
+    limit = _get_int(kwargs, 'iDisplayLength', adagios.settings.livestatus_limit, minimum=0)
+
+    order_by = []
+    for i in range(_get_int(kwargs, 'iSortingCols', 0, minimum=0, maximum=len(columns))):
+        column_number = _get_int(kwargs, 'iSortCol_%s' % i, None)
+        if column_number is None or not 0 <= column_number < len(columns):
+            continue
+        column = columns[column_number]
+        if kwargs.get('sSortDir_%s' % i) == 'desc':
+            column = '-' + column
+        order_by.append(column)
+
+    filters = {}
+    if kwargs.get('sSearch'):
+        filters['q'] = kwargs['sSearch']
+
+    total = adagios.status.utils.get_services_count(request)
+    if order_by:
+        services = _get_sorted_services(request, columns, order_by, filters, refresh=offset == 0)
+        total_display = len(services)
+        services = services[offset:offset + limit] if limit else services[offset:]
+    else:
+        services = adagios.status.utils.get_services(
+            request=request, fields=columns, offset=offset, limit=limit, **filters)
+        if filters:
+            total_display = adagios.status.utils.get_services_count(request, **filters)
+        else:
+            total_display = total
 
     result = {
-        'sEcho': len(services),
-	'iTotalRecords': len(services),
+        'sEcho': _get_int(kwargs, 'sEcho', 0),
+        'iTotalRecords': total,
+        'iTotalDisplayRecords': total_display,
         'aaData': []
     }
     for service in services:
-        result['aaData'].append(list(service.values()))
+        result['aaData'].append([service.get(x) for x in columns])
     return result
 
 
@@ -132,6 +226,7 @@ def acknowledge(host_name, service_description=None, sticky=1, notify=1, persist
                                                       author=author,
                                                       comment=comment,
                                                       )
+    adagios.status.snapshots.invalidate()
 
 
 def downtime_many(hostlist, servicelist, hostgrouplist, start_time=None, end_time=None, fixed=1, trigger_id=0, duration=7200, author='adagios', comment='Downtime scheduled by adagios', all_services_on_host=False, hostgroup_name=None):
@@ -206,7 +301,7 @@ def downtime(host_name=None, service_description=None, start_time=None, end_time
             author=author,
             comment=comment,
         )
-        return result1, result2
+        result = result1, result2
     # Check if we are recursively scheduling downtime for host and all its services:
     elif all_services_on_host:
         result1 = pynag.Control.Command.schedule_host_svc_downtime(
@@ -229,10 +324,10 @@ def downtime(host_name=None, service_description=None, start_time=None, end_time
             author=author,
             comment=comment,
         )
-        return result1, result2
+        result = result1, result2
     # Otherwise, if this is a host
     elif service_description in (None, '', u'', '_HOST_'):
-        return pynag.Control.Command.schedule_host_downtime(
+        result = pynag.Control.Command.schedule_host_downtime(
             host_name=host_name,
             start_time=start_time,
             end_time=end_time,
@@ -244,7 +339,7 @@ def downtime(host_name=None, service_description=None, start_time=None, end_time
         )
     # otherwise it must be a service:
     else:
-        return pynag.Control.Command.schedule_svc_downtime(
+        result = pynag.Control.Command.schedule_svc_downtime(
             host_name=host_name,
             service_description=service_description,
             start_time=start_time,
@@ -255,6 +350,8 @@ def downtime(host_name=None, service_description=None, start_time=None, end_time
             author=author,
             comment=comment,
         )
+    adagios.status.snapshots.invalidate()
+    return result
 
 import adagios.utils
 
@@ -322,6 +419,7 @@ def reschedule(request, host_name=None, service_description=None, check_time=Non
                              "WaitTrigger: check",
                              "Filter: host_name = %s" % host_name,
                              )
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -330,13 +428,13 @@ def comment(author, comment, host_name, service_description=None, persistent=1):
 
     If the "persistent" field is set to zero (0), the comment will be deleted the next time Nagios is restarted.
     Otherwise, the comment will persist across program restarts until it is deleted manually. """
-
     if service_description in (None, '', u'', '_HOST_'):
         pynag.Control.Command.add_host_comment(
             host_name=host_name, persistent=persistent, author=author, comment=comment)
     else:
         pynag.Control.Command.add_svc_comment(
             host_name=host_name, service_description=service_description, persistent=persistent, author=author, comment=comment)
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -350,6 +448,7 @@ def delete_comment(comment_id, object_type=None, host_name=None, service_descrip
         pynag.Control.Command.del_host_comment(comment_id=comment_id)
     else:
         pynag.Control.Command.del_svc_comment(comment_id=comment_id)
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -373,10 +472,13 @@ def edit(object_type, short_name, attribute_name, new_value):
     return str(my_obj)
 
 
+# Columns the map in status_map.html uses
+_MAP_HOST_COLUMNS = ['name', 'state', 'address', 'parents', 'services_with_state']
+
+
 def get_map_data(request, host_name=None):
     """ Returns a list of (host_name,2d_coords). If host_name is provided, returns a list with only that host """
-    livestatus = adagios.status.utils.livestatus(request)
-    all_hosts = livestatus.query('GET hosts', )
+    all_hosts = adagios.status.utils.get_hosts(request, fields=_MAP_HOST_COLUMNS, limit=0)
     hosts_with_coordinates = pynag.Model.Host.objects.filter(
         **{'2d_coords__exists': True})
     hosts = []
@@ -443,9 +545,9 @@ def autocomplete(request, q):
         q = ''
     result = {}
 
-    hosts = adagios.status.utils.get_hosts(request, host_name__contains=q)
-    services = adagios.status.utils.get_services(request, service_description__contains=q)
-    hostgroups = adagios.status.utils.get_hostgroups(request, hostgroup_name__contains=q)
+    hosts = adagios.status.utils.get_hosts(request, fields=['name'], host_name__contains=q)
+    services = adagios.status.utils.get_services(request, fields=['description'], service_description__contains=q)
+    hostgroups = adagios.status.utils.get_hostgroups(request, 'Columns: name', hostgroup_name__contains=q)
 
     result['hosts'] = sorted(set([x['name'] for x in hosts]))
     result['hostgroups'] = sorted(set([x['name'] for x in hostgroups]))
@@ -465,6 +567,7 @@ def delete_downtime(downtime_id, is_service=True):
         pynag.Control.Command.del_svc_downtime(downtime_id)
     else:
         pynag.Control.Command.del_host_downtime(downtime_id)
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -696,6 +799,7 @@ def remove_downtime(request, host_name, service_description=None, downtime_id=No
     else:
         for i in downtimes_to_remove:
             pynag.Control.Command.del_host_downtime(downtime_id=i)
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -705,6 +809,7 @@ def remove_acknowledgement(host_name, service_description=None):
         pynag.Control.Command.remove_host_acknowledgement(host_name=host_name)
     else:
         pynag.Control.Command.remove_svc_acknowledgement(host_name=host_name, service_description=service_description)
+    adagios.status.snapshots.invalidate()
     return "ok"
 
 
@@ -740,6 +845,7 @@ def submit_check_result(request, host_name, service_description=None, autocreate
             pynag.Control.Command.process_host_check_result(host_name, status_code, output)
         else:
             pynag.Control.Command.process_service_check_result(host_name, service_description, status_code, output)
+        adagios.status.snapshots.invalidate()
         result['message'] = _("Command has been submitted.")
     return result
 
@@ -749,12 +855,55 @@ def statistics(request, **kwargs):
     return adagios.status.utils.get_statistics(request, **kwargs)
 
 
+def backend_health(request):
+    """ Returns circuit breaker state and latency history of every livestatus backend. """
+    return adagios.status.health.monitor.get_statistics()
+
+
+def network_outages(request):
+    """ Returns hosts that are down while all their parents are up, with every host behind each of them
+
+    Hosts that are acknowledged or in scheduled downtime are not counted as down.
+    """
+    topology = adagios.status.topology.get_topology(request)
+    network_problems, host_problems = topology.get_outages()
+    result = []
+    for host in sorted(network_problems + host_problems, key=lambda x: x['name']):
+        host_name = host['name']
+        behind = topology.get_blast_radius(host_name)
+        result.append({
+            'host_name': host_name,
+            'state': host['state'],
+            'children': sorted(topology.get_children(host_name)),
+            'blast_radius': len(behind),
+            'affected_hosts': sorted(behind),
+        })
+    return result
+
+
+def unread_columns(request):
+    """ Returns livestatus columns that views fetched but never read (needs debug_livestatus_columns). """
+    result = {}
+    for view_name, tables in adagios.status.utils.unread_columns.items():
+        result[view_name] = dict((table, sorted(columns)) for table, columns in tables.items())
+    return result
+
+
+def query_cache_statistics(request):
+    """ Returns livestatus query cache hits and misses per view, since this process started. """
+    result = {}
+    for view_name, counters in adagios.status.utils.query_cache_statistics.items():
+        result[view_name] = dict(counters)
+    return result
+
+
 def metrics(request, **kwargs):
     """ Returns a list of dicts which contain service perfdata metrics
+
+    Metrics are streamed to the client as services are read from livestatus.
     """
-    result = []
     fields = "host_name description perf_data state host_state".split()
-    services = adagios.status.utils.get_services(request, fields=fields, **kwargs)
+    services = adagios.status.utils.get_services_stream(request, fields=fields, **kwargs)
     for service in services:
         metrics = pynag.Utils.PerfData(service['perf_data']).metrics
         metrics = [x for x in metrics if x.is_valid()]
@@ -772,8 +921,7 @@ def metrics(request, **kwargs):
                 'min': metric.min,
                 'max': metric.max,
             }
-            result.append(metric_dict)
-    return result
+            yield metric_dict
 
 def metric_names(request, **kwargs):
     """ Returns the names of all perfdata metrics that match selected request """
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Availability (SLA) of hosts and services over any time window.
+#
+# Reading weeks of nagios logs on every page load is slow, so the time every
+# host and service spent in each state is added up per day and kept in a
+# small sqlite database (setting sla_rollup_db). Days are only added once
+# they are over, and only log lines newer than the last rolled up day are
+# read. A report for a time window sums up the days that fit completely in
+# it, and reads the logs only for the partial days at either end. A window
+# that starts before the first rolled up day has every day from its start on
+# rolled up again, so states carry over correctly from one day to the next.
+#
+# Logs are read without holding any database lock. Only one process rolls up
+# days at a time, the others do not wait for it and read the logs for
+# whatever is not rolled up yet.
+
+from __future__ import unicode_literals
+from builtins import object
+from past.utils import old_div
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+import pynag.Parsers
+
+import adagios.settings
+from adagios.private_files import get_private_dir, InsecureDirectory
+
+SECONDS_IN_A_DAY = 60 * 60 * 24
+
+# Nagios states we keep seconds for, anything else is counted as unknown
+STATES = [0, 1, 2, 3]
+
+_STATE_NAMES = {0: 'ok', 1: 'warning', 2: 'critical', 3: 'unknown'}
+
+_CSS_HINT = {0: 'success', 1: 'warning', 2: 'danger', 3: 'info'}
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS rollups ("
+    " day INTEGER NOT NULL,"
+    " host_name TEXT NOT NULL,"
+    " service_description TEXT NOT NULL,"
+    " seconds_ok INTEGER NOT NULL,"
+    " seconds_warning INTEGER NOT NULL,"
+    " seconds_critical INTEGER NOT NULL,"
+    " seconds_unknown INTEGER NOT NULL,"
+    " num_problems INTEGER NOT NULL,"
+    " end_state INTEGER NOT NULL,"
+    " PRIMARY KEY (day, host_name, service_description))",
+    # State of every host and service at the end of the last rolled up day
+    "CREATE TABLE IF NOT EXISTS current_state ("
+    " host_name TEXT NOT NULL,"
+    " service_description TEXT NOT NULL,"
+    " state INTEGER NOT NULL,"
+    " PRIMARY KEY (host_name, service_description))",
+    "CREATE TABLE IF NOT EXISTS progress (rolled_up_since INTEGER NOT NULL, rolled_up_until INTEGER NOT NULL)",
+]
+
+
+def get_default_path():
+    return os.path.join(get_private_dir('sla'), 'sla.sqlite')
+
+
+def get_day(timestamp):
+    """ Returns the unix timestamp of midnight (UTC) at the start of the day timestamp is in
+
+    >>> get_day(86400 * 3 + 5)
+    259200
+    """
+    timestamp = int(timestamp)
+    return timestamp - timestamp % SECONDS_IN_A_DAY
+
+
+def _get_key(line):
+    """ Returns (host_name, service_description) of a state history log line, host alerts get '' """
+    return line['host_name'], line.get('service_description') or ''
+
+
+def replay(states, log_entries, start_time, end_time, totals=None):
+    """ Adds up how long every host and service was in each state between start_time and end_time
+
+    Arguments:
+        states      -- dict of (host_name, service_description) -> state before
+                       the first log entry. It is updated in place to the states at end_time.
+        log_entries -- State history log lines sorted by time. Lines before
+                       start_time only change the state, lines from end_time on are ignored.
+        totals      -- dict to add the results to, created if None
+
+    Returns:
+        dict of (host_name, service_description) -> {state: seconds, ..., 'num_problems': n}
+
+    Example:
+        >>> states = {('localhost', ''): 0}
+        >>> lines = [{'time': 50, 'host_name': 'localhost', 'state': 2}]
+        >>> result = replay(states, lines, 0, 100)
+        >>> result[('localhost', '')][0], result[('localhost', '')][2], result[('localhost', '')]['num_problems']
+        (50, 50, 1)
+    """
+    if totals is None:
+        totals = {}
+    since = dict((key, start_time) for key in states)
+    for line in log_entries:
+        timestamp = int(line['time'])
+        if timestamp >= end_time:
+            break
+        if 'state' not in line or not line.get('host_name'):
+            continue
+        key = _get_key(line)
+        state = line['state'] if line['state'] in STATES else 3
+        timestamp = max(timestamp, start_time)
+        if key in states:
+            _add(totals, key, states[key], timestamp - since[key])
+        else:
+            _add(totals, key, state, 0)
+        if state != 0 and line['time'] >= start_time:
+            totals[key]['num_problems'] += 1
+        states[key] = state
+        since[key] = timestamp
+    for key, state in states.items():
+        _add(totals, key, state, end_time - since[key])
+    return totals
+
+
+def _add(totals, key, state, seconds):
+    if key not in totals:
+        totals[key] = dict((x, 0) for x in STATES)
+        totals[key]['num_problems'] = 0
+    totals[key][state] += max(seconds, 0)
+
+
+class _UpdateLock(object):
+    """ Non blocking lock next to the database, so only one process at a time rolls up days
+
+    Evaluates to False in the with statement if another process holds the lock.
+    """
+
+    def __init__(self, path):
+        self.filename = None if path == ':memory:' else path + '.lock'
+        self._file = None
+
+    def __enter__(self):
+        if self.filename is None:
+            return True
+        try:
+            self._file = open(self.filename, 'a')
+        except (IOError, OSError):
+            # The database can not be written either, nothing to protect
+            return True
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def __exit__(self, *args):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class SlaRollups(object):
+    """ Daily availability of every host and service, kept on disk
+
+    Arguments:
+        path     -- Path to the sqlite database. Defaults to the sla_rollup_db setting.
+        logfiles -- Something with get_log_entries() like pynag.Parsers.LogFiles,
+                    defaults to the log files of nagios_config.
+    """
+
+    def __init__(self, path=None, logfiles=None):
+        self._path = path
+        self._logfiles = logfiles
+        self._lock = threading.RLock()
+        self._update_lock = threading.Lock()
+        self._connection = None
+        self._connection_key = None
+
+    def get_path(self):
+        if self._path:
+            return self._path
+        if adagios.settings.sla_rollup_db:
+            return adagios.settings.sla_rollup_db
+        try:
+            return get_default_path()
+        except InsecureDirectory:
+            return ':memory:'
+
+    def get_logfiles(self):
+        if self._logfiles is not None:
+            return self._logfiles
+        return pynag.Parsers.LogFiles(maincfg=adagios.settings.nagios_config)
+
+    def _connect(self):
+        path = self.get_path()
+        key = (os.getpid(), path)
+        if self._connection is not None and self._connection_key == key:
+            return self._connection
+        try:
+            connection = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._create_tables(connection)
+        except sqlite3.Error:
+            # Reports still work without the database, they are just slower
+            connection = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+            self._create_tables(connection)
+        self._connection = connection
+        self._connection_key = key
+        return connection
+
+    def _create_tables(self, connection):
+        for statement in _SCHEMA:
+            connection.execute(statement)
+
+    def _get_log_entries(self, start_time, end_time):
+        """ Returns state history log lines between start_time and end_time, sorted by time """
+        entries = self.get_logfiles().get_log_entries(
+            start_time=start_time, end_time=end_time, strict=True, class_name='alerts')
+        return [x for x in entries if 'state' in x and x.get('host_name')]
+
+    def _get_progress(self):
+        with self._lock:
+            return self._connect().execute("SELECT rolled_up_since, rolled_up_until FROM progress").fetchone()
+
+    def get_rolled_up_since(self):
+        """ Returns the timestamp where the first rolled up day starts, or None if nothing is rolled up """
+        progress = self._get_progress()
+        return progress[0] if progress else None
+
+    def get_rolled_up_until(self):
+        """ Returns the timestamp where the last rolled up day ends, or None if nothing is rolled up """
+        progress = self._get_progress()
+        return progress[1] if progress else None
+
+    def update(self, now=None, since=None):
+        """ Roll up every day that is over and is not rolled up yet
+
+        The first time, history goes back sla_rollup_days days. If since is
+        before the first rolled up day, every day from since on is rolled up again.
+
+        Returns immediately if another thread or process is rolling up days.
+
+        Returns:
+            Number of days that were added
+        """
+        if now is None:
+            now = time.time()
+        if not self._update_lock.acquire(False):
+            return 0
+        try:
+            with _UpdateLock(self.get_path()) as locked:
+                if not locked:
+                    return 0
+                return self._update(get_day(now), since)
+        finally:
+            self._update_lock.release()
+
+    def _update(self, today, since):
+        progress = self._get_progress()
+        first_day = today - SECONDS_IN_A_DAY * adagios.settings.sla_rollup_days
+        if progress:
+            first_day = progress[0]
+        if since is not None:
+            first_day = min(first_day, get_day(since))
+        if progress and first_day == progress[0]:
+            first_day = progress[1]
+            states = self._get_current_states()
+            rolled_up_since = progress[0]
+        else:
+            states = {}
+            rolled_up_since = first_day
+        if first_day >= today:
+            return 0
+
+        # Read the logs before locking the database, pages can still read it meanwhile
+        log_entries = self._get_log_entries(first_day, today - 1)
+        rows = []
+        position = 0
+        for day in range(first_day, today, SECONDS_IN_A_DAY):
+            next_day = day + SECONDS_IN_A_DAY
+            end = position
+            while end < len(log_entries) and log_entries[end]['time'] < next_day:
+                end += 1
+            totals = replay(states, log_entries[position:end], day, next_day)
+            position = end
+            rows.extend(
+                (day, host_name, service_description) +
+                tuple(seconds[x] for x in STATES) +
+                (seconds['num_problems'], states[(host_name, service_description)])
+                for (host_name, service_description), seconds in totals.items())
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if connection.execute("SELECT rolled_up_since, rolled_up_until FROM progress").fetchone() != progress:
+                    # Somebody else rolled up days while we read the logs
+                    connection.execute("ROLLBACK")
+                    return 0
+                connection.execute("DELETE FROM rollups WHERE day >= ?", (first_day,))
+                connection.executemany("INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.execute("DELETE FROM current_state")
+                connection.executemany(
+                    "INSERT INTO current_state VALUES (?, ?, ?)",
+                    [(h, s, state) for (h, s), state in states.items()])
+                connection.execute("DELETE FROM progress")
+                connection.execute("INSERT INTO progress VALUES (?, ?)", (rolled_up_since, today))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return (today - first_day) // SECONDS_IN_A_DAY
+
+    def _get_states_at(self, day):
+        """ Returns the state of every host and service at midnight at the start of day """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT host_name, service_description, end_state FROM rollups WHERE day = ?",
+                (day - SECONDS_IN_A_DAY,)).fetchall()
+        return dict(((h, s), state) for h, s, state in rows)
+
+    def _get_current_states(self):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT host_name, service_description, state FROM current_state").fetchall()
+        return dict(((h, s), state) for h, s, state in rows)
+
+    def _add_partial(self, totals, start_time, end_time, rolled_up_until):
+        """ Adds the part of a day between start_time and end_time to totals, read from the logs """
+        if start_time >= end_time:
+            return
+        if rolled_up_until is not None and start_time >= rolled_up_until:
+            anchor = rolled_up_until
+            states = self._get_current_states()
+        else:
+            anchor = get_day(start_time)
+            states = self._get_states_at(anchor)
+        log_entries = self._get_log_entries(anchor, end_time)
+        replay(states, log_entries, start_time, end_time, totals)
+
+    def _add_rolled_up(self, totals, first_day, last_day):
+        """ Adds the rolled up days from first_day up to (not including) last_day to totals """
+        if first_day >= last_day:
+            return
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT host_name, service_description, SUM(seconds_ok), SUM(seconds_warning),"
+                " SUM(seconds_critical), SUM(seconds_unknown), SUM(num_problems)"
+                " FROM rollups WHERE day >= ? AND day < ? GROUP BY host_name, service_description",
+                (first_day, last_day)).fetchall()
+        for row in rows:
+            key = (row[0], row[1])
+            for state, seconds in zip(STATES, row[2:6]):
+                _add(totals, key, state, seconds)
+            totals[key]['num_problems'] += row[6]
+
+    def get_totals(self, start_time, end_time):
+        """ Returns how many seconds every host and service was in each state between start_time and end_time
+
+        Returns:
+            dict of (host_name, service_description) -> {state: seconds, ..., 'num_problems': n}
+        """
+        start_time = int(start_time)
+        end_time = int(end_time)
+        self.update(since=start_time)
+        progress = self._get_progress()
+        totals = {}
+        if not progress or start_time < progress[0]:
+            # Days at the start of the window are not rolled up, most likely
+            # because another process is rolling them up right now
+            self._add_partial(totals, start_time, end_time, None)
+            return totals
+        rolled_up_until = progress[1]
+        first_day = get_day(start_time)
+        if first_day < start_time:
+            first_day += SECONDS_IN_A_DAY
+        last_day = min(get_day(end_time), rolled_up_until)
+        if first_day >= last_day:
+            # No whole rolled up day fits in the window
+            self._add_partial(totals, start_time, end_time, rolled_up_until)
+            return totals
+        self._add_partial(totals, start_time, first_day, rolled_up_until)
+        self._add_rolled_up(totals, first_day, last_day)
+        self._add_partial(totals, last_day, end_time, rolled_up_until)
+        return totals
+
+    def get_report(self, start_time, end_time):
+        """ Returns a list of dicts with availability of every host and service between start_time and end_time
+
+        Every dict has host_name, service_description (None for hosts), sla
+        (percent of the window the object was ok), num_problems, and
+        percent_<state> and seconds_<state> for every state.
+        """
+        total_duration = max(int(end_time) - int(start_time), 1)
+        result = []
+        for (host_name, service_description), seconds in self.get_totals(start_time, end_time).items():
+            s = {}
+            s['host_name'] = host_name
+            s['service_description'] = service_description or None
+            s['num_problems'] = seconds['num_problems']
+            s['states'] = []
+            for state in STATES:
+                name = _STATE_NAMES[state]
+                s['seconds_%s' % name] = seconds[state]
+                s['percent_%s' % name] = old_div(100.0 * seconds[state], total_duration)
+                if seconds[state]:
+                    s['states'].append({
+                        'state': state,
+                        'status': name,
+                        'bootstrap_status': _CSS_HINT[state],
+                        'duration': seconds[state],
+                        'duration_percent': s['percent_%s' % name],
+                    })
+            s['sla'] = s['percent_ok']
+            result.append(s)
+        result.sort(key=lambda x: (x['host_name'], x['service_description'] or ''))
+        return result
+
+
+rollups = SlaRollups()
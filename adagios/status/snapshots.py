@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Short lived snapshots of host and service lists, shared by every request
+# and every worker process on this machine.
+#
+# When many people look at the same status pages at the same time, they all
+# ask livestatus the same questions. With status_cache_ttl set, the answer to
+# each question is stored in status_cache_dir for that many seconds, and only
+# one process at a time asks livestatus for a missing answer while the others
+# wait for it. Any command submitted via adagios.status.rest invalidates all
+# snapshots, so people see the result of their acknowledgements right away.
+# Snapshots and lock files that have not been used for a while are deleted.
+
+from __future__ import unicode_literals
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import simplejson as json
+
+import adagios.settings
+from adagios.private_files import get_private_dir
+
+_GENERATION_FILE = 'generation'
+
+# Files untouched for this many seconds (or status_cache_ttl if it is longer)
+# are deleted, at most once per interval in every process.
+_CLEANUP_INTERVAL = 300
+
+# Hits and misses in this process
+statistics = defaultdict(int)
+
+_last_cleanup = {'time': 0}
+
+
+def get_cache_dir():
+    """ Returns the directory where snapshots are stored, creates it if needed
+
+    Raises InsecureDirectory if the directory is not private to us, see adagios.private_files
+    """
+    return get_private_dir('status-cache', adagios.settings.status_cache_dir)
+
+
+def make_key(*args):
+    """ Returns a cache key (a filename) that identifies args """
+    text = json.dumps(args, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def get_or_fetch(key, fetch):
+    """ Returns the snapshot stored under key, or the result of fetch() if we have no fresh snapshot.
+
+    Arguments:
+        key   -- A key from make_key()
+        fetch -- Function that gets fresh data from livestatus. Must return something json serializable.
+    """
+    ttl = float(adagios.settings.status_cache_ttl or 0)
+    if ttl <= 0:
+        return fetch()
+    try:
+        cache_dir = get_cache_dir()
+        found, result = _read(cache_dir, key, ttl)
+    except Exception:
+        return fetch()
+    if found:
+        statistics['hits'] += 1
+        return result
+
+    # Only one process fetches a key at a time, everyone else waits here and
+    # then reads what the first one wrote.
+    with _FileLock(os.path.join(cache_dir, key + '.lock')):
+        found, result = _read(cache_dir, key, ttl)
+        if found:
+            statistics['coalesced'] += 1
+            return result
+        statistics['misses'] += 1
+        generation = _get_generation(cache_dir)
+        result = fetch()
+        try:
+            _write(cache_dir, key, generation, result)
+        except Exception:
+            pass
+    if time.time() - _last_cleanup['time'] > _CLEANUP_INTERVAL:
+        try:
+            cleanup(cache_dir, max(ttl, _CLEANUP_INTERVAL))
+        except Exception:
+            pass
+    return result
+
+
+def cleanup(cache_dir, max_age):
+    """ Delete snapshots, lock files and leftover temp files that are older than max_age seconds
+
+    Snapshots that old are never read again. A lock file that is deleted while
+    somebody holds it can at worst make two processes fetch the same key.
+    """
+    _last_cleanup['time'] = now = time.time()
+    for filename in os.listdir(cache_dir):
+        if filename in (_GENERATION_FILE, _GENERATION_FILE + '.lock'):
+            continue
+        path = os.path.join(cache_dir, filename)
+        try:
+            if now - os.stat(path).st_mtime > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def invalidate():
+    """ Mark every snapshot in every process as stale """
+    if not adagios.settings.status_cache_ttl:
+        return
+    try:
+        cache_dir = get_cache_dir()
+        with _FileLock(os.path.join(cache_dir, _GENERATION_FILE + '.lock')):
+            generation = _get_generation(cache_dir) + 1
+            _atomic_write(os.path.join(cache_dir, _GENERATION_FILE), str(generation))
+    except Exception:
+        pass
+
+
+def _get_generation(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _GENERATION_FILE)) as f:
+            return int(f.read())
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def _read(cache_dir, key, ttl):
+    """ Returns (True, data) if there is a fresh snapshot stored under key, otherwise (False, None) """
+    try:
+        with open(os.path.join(cache_dir, key)) as f:
+            snapshot = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False, None
+    if time.time() - snapshot['timestamp'] > ttl:
+        return False, None
+    if snapshot['generation'] != _get_generation(cache_dir):
+        return False, None
+    return True, snapshot['data']
+
+
+def _write(cache_dir, key, generation, data):
+    snapshot = {'timestamp': time.time(), 'generation': generation, 'data': data}
+    _atomic_write(os.path.join(cache_dir, key), json.dumps(snapshot))
+
+
+def _atomic_write(filename, content):
+    """ Write content to filename, readers see either the old file or the new one, never half of it """
+    fd, tempname = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.rename(tempname, filename)
+    except Exception:
+        os.remove(tempname)
+        raise
+
+
+class _FileLock(object):
+    """ Exclusive lock on filename, shared between threads and processes """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.filename, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        # Lock files in use are not old enough for cleanup()
+        os.utime(self.filename, None)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
@@ -24,7 +24,13 @@ from django.utils.translation import ugettext as _
 
 import pynag.Parsers
 import os
+import socket
+import shutil
+import tempfile
+import threading
+import time
 from django.test.client import RequestFactory
+from django.http import HttpRequest
 from django.test import LiveServerTestCase
 import adagios.status
 import adagios.status.utils
@@ -35,6 +41,15 @@ import simplejson as json
 import adagios.seleniumtests
 from mock import patch
 import adagios.status.rest
+import adagios.status.columnar
+import adagios.status.connections
+import adagios.status.counters
+import adagios.status.health
+import adagios.status.hostgroups
+import adagios.status.sla
+import adagios.status.snapshots
+import adagios.status.topology
+import adagios.misc.rest
 
 try:
     from selenium.webdriver.common.by import By
@@ -187,6 +202,117 @@ class UtilsTest(TestCase):
         self.host_query = pynag.Parsers.LivestatusQuery('GET hosts')
         self.service_query = pynag.Parsers.LivestatusQuery('GET services')
 
+    def test_get_statistics_sends_one_query_per_table(self):
+        queries = []
+
+        def query(table, *args, **kwargs):
+            queries.append(table)
+            number_of_stats = len([x for x in args if x.startswith('Stats:')])
+            number_of_ands = sum(int(x.split()[1]) - 1 for x in args if x.startswith('StatsAnd:'))
+            return list(range(number_of_stats - number_of_ands))
+
+        request = RequestFactory().get('/status/', REMOTE_USER='nagiosadmin')
+        with patch('adagios.status.utils.livestatus') as livestatus:
+            livestatus.return_value.query.side_effect = query
+            statistics = adagios.status.utils.get_statistics(request)
+        self.assertEqual(['GET hosts', 'GET services', 'GET comments'], queries)
+        self.assertEqual([0, 1, 2], statistics['host_totals'])
+        self.assertEqual([0, 1, 2, 3], statistics['service_totals'])
+        self.assertEqual(3, statistics['total_hosts'])
+        self.assertEqual(5, statistics['unhandled_services'])
+        self.assertEqual(5 + 5, statistics['num_problems_unhandled'])
+
+    def test_get_services_offset_and_order_by(self):
+        rows = [{'host_name': 'host%s' % i, 'state': i % 3} for i in range(10)]
+        with patch('adagios.status.utils.livestatus') as livestatus:
+            livestatus.return_value.authuser = None
+            livestatus.return_value.backends = {}
+            livestatus.return_value.query.side_effect = lambda *args, **kwargs: [dict(x) for x in rows]
+            livestatus.return_value.query_top.side_effect = lambda count, key, *args: sorted(rows, key=key)[:count]
+            services = adagios.status.utils.get_services(
+                fields=['host_name'], offset='2', limit='3', order_by='-state,host_name')
+            query = livestatus.return_value.query_top.call_args[0][2]
+        self.assertEqual(['host8', 'host1', 'host4'], [x['host_name'] for x in services])
+        self.assertEqual(5, livestatus.return_value.query_top.call_args[0][0])
+        self.assertIsNone(query.get_header('Limit'))
+        self.assertEqual('host_name state', query.get_header('Columns'))
+
+    def test_services_dt_protocol(self):
+        request = RequestFactory().get('/rest/status/json/services_dt')
+        rows = [{'host_name': 'localhost', 'description': 'Ping %02d' % i} for i in range(30)]
+        adagios.status.rest._dt_cache.clear()
+        with patch('adagios.status.utils.get_services') as get_services, \
+                patch('adagios.status.utils.get_services_count') as get_services_count:
+            get_services.return_value = rows
+            get_services_count.return_value = 100
+            result = adagios.status.rest.services_dt(
+                request, sEcho='4', iDisplayStart='20', iDisplayLength='5',
+                iSortingCols='1', iSortCol_0='1', sSortDir_0='desc')
+            # The next page is cut from the same sorted services
+            adagios.status.rest.services_dt(
+                request, sEcho='5', iDisplayStart='25', iDisplayLength='5',
+                iSortingCols='1', iSortCol_0='1', sSortDir_0='desc')
+        self.assertEqual(1, get_services.call_count)
+        kwargs = get_services.call_args[1]
+        self.assertEqual(0, kwargs['limit'])
+        self.assertEqual(['-description'], kwargs['order_by'])
+        self.assertEqual(4, result['sEcho'])
+        self.assertEqual(100, result['iTotalRecords'])
+        self.assertEqual(30, result['iTotalDisplayRecords'])
+        self.assertEqual([['localhost', 'Ping %02d' % i] for i in range(20, 25)], result['aaData'])
+
+    def test_services_dt_unsorted_page_is_pushed_down(self):
+        request = RequestFactory().get('/rest/status/json/services_dt')
+        with patch('adagios.status.utils.get_services') as get_services, \
+                patch('adagios.status.utils.get_services_count') as get_services_count:
+            get_services.return_value = [{'host_name': 'localhost', 'description': 'Ping'}]
+            get_services_count.return_value = 100
+            adagios.status.rest.services_dt(request, iDisplayStart='20', iDisplayLength='10')
+        kwargs = get_services.call_args[1]
+        self.assertEqual((20, 10), (kwargs['offset'], kwargs['limit']))
+
+    def test_services_dt_ignores_bad_parameters(self):
+        request = RequestFactory().get('/rest/status/json/services_dt')
+        adagios.status.rest._dt_cache.clear()
+        with patch('adagios.status.utils.get_services') as get_services, \
+                patch('adagios.status.utils.get_services_count') as get_services_count:
+            get_services.return_value = []
+            get_services_count.return_value = 0
+            result = adagios.status.rest.services_dt(
+                request, sEcho='x', iDisplayStart='-5', iDisplayLength='abc',
+                iSortingCols='9', iSortCol_0='7', iSortCol_1='0', sSortDir_1='asc')
+        self.assertEqual(['host_name'], get_services.call_args[1]['order_by'])
+        self.assertEqual(0, result['sEcho'])
+
+    def test_report_unread_columns(self):
+        request = RequestFactory().get('/status/')
+        rows = [{'name': 'localhost', 'state': 0, 'address': '127.0.0.1'}]
+        with patch('adagios.settings.debug_livestatus_columns', True):
+            rows = adagios.status.utils._track_columns(request, 'hosts', ['name', 'state', 'address'], rows)
+            self.assertEqual('localhost', rows[0]['name'])
+            rows[0].get('state')
+            adagios.status.utils.report_unread_columns(request, 'test_view')
+        self.assertEqual(set(['address']), adagios.status.utils.unread_columns['test_view']['hosts'])
+
+    def test_track_columns_off_by_default(self):
+        rows = [{'name': 'localhost'}]
+        with patch('adagios.settings.debug_livestatus_columns', False):
+            result = adagios.status.utils._track_columns(RequestFactory().get('/'), 'hosts', ['name'], rows)
+        self.assertIs(rows, result)
+
+    def test_autocomplete_asks_for_names_only(self):
+        request = RequestFactory().get('/rest/status/json/autocomplete')
+        with patch('adagios.status.utils.get_hosts') as get_hosts, \
+                patch('adagios.status.utils.get_services') as get_services, \
+                patch('adagios.status.utils.get_hostgroups') as get_hostgroups:
+            get_hosts.return_value = []
+            get_services.return_value = []
+            get_hostgroups.return_value = []
+            adagios.status.rest.autocomplete(request, q='local')
+        self.assertEqual(['name'], get_hosts.call_args[1]['fields'])
+        self.assertEqual(['description'], get_services.call_args[1]['fields'])
+        self.assertEqual(('Columns: name',), get_hostgroups.call_args[0][1:])
+
     def test_search_multiple_attributes_multiple_attributes(self):
         attributes = ['host_name', 'address']
         adagios.status.utils._search_multiple_attributes(self.host_query, attributes, 'test')
@@ -290,6 +416,886 @@ class UtilsTest(TestCase):
         self.assertEqual(self.service_query, query)
 
 
+class FakeLivestatusServer(object):
+    """ A tiny livestatus lookalike on a unix socket, it answers every query with the same rows.
+
+    It understands 'ResponseHeader: fixed16' and 'KeepAlive: on', which is all
+    the connection pool needs.
+    """
+    def __init__(self, rows, delay=0):
+        self.rows = rows
+        self.delay = delay
+        self.connections = 0
+        self.queries = []
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'live')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(5)
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except Exception:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, conn):
+        data = b''
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+            while b'\n\n' in data:
+                query, data = data.split(b'\n\n', 1)
+                query = query.decode('utf-8')
+                self.queries.append(query)
+                time.sleep(self.delay)
+                # Like livestatus, every row goes on a line of its own
+                body = ('[' + ',\n'.join(repr(x) for x in self.rows) + ']\n').encode('utf-8')
+                conn.sendall(('200 %11d\n' % len(body)).encode('utf-8') + body)
+                if 'KeepAlive: on' not in query:
+                    conn.close()
+                    return
+        conn.close()
+
+    def close(self):
+        self.server.close()
+
+
+class ConnectionPoolTest(TestCase):
+    """Tests for adagios.status.connections"""
+    def setUp(self):
+        self.server = FakeLivestatusServer([['name', 'state'], ['localhost', 0]])
+        self.pool = adagios.status.connections.pool
+        self.pool.close_all()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.close()
+
+    def test_queries_reuse_one_connection(self):
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        for i in range(3):
+            hosts = livestatus.query('GET hosts')
+            self.assertEqual([{'name': 'localhost', 'state': 0}], hosts)
+        self.assertEqual(1, self.server.connections)
+        self.assertTrue(all('KeepAlive: on' in x for x in self.server.queries))
+
+    def test_new_connections_are_counted(self):
+        created = self.pool.statistics['created']
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        for i in range(3):
+            livestatus.query('GET hosts')
+        self.assertEqual(created + 1, self.pool.statistics['created'])
+
+    def test_authusers_get_separate_connections(self):
+        for authuser in ('alice', 'bob'):
+            livestatus = adagios.status.connections.PooledLivestatus(
+                livestatus_socket_path=self.server.path, authuser=authuser)
+            livestatus.query('GET hosts')
+        self.assertEqual(2, self.server.connections)
+
+    def test_idle_connections_are_evicted(self):
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        livestatus.query('GET hosts')
+        self.pool._idle_timeout = -1
+        try:
+            self.pool.evict_idle()
+            livestatus.query('GET hosts')
+        finally:
+            self.pool._idle_timeout = None
+        self.assertEqual(2, self.server.connections)
+
+    def test_single_backend_sockets_have_no_timeout(self):
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        livestatus.query('GET hosts')
+        sock = self.pool.get(livestatus._pool_key())
+        self.assertEqual(None, sock.gettimeout())
+        self.pool.put(livestatus._pool_key(), sock)
+
+    def test_keepalive_can_be_turned_off(self):
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        with patch('adagios.settings.livestatus_keepalive', False):
+            livestatus.query('GET hosts')
+            livestatus.query('GET hosts')
+        self.assertEqual(2, self.server.connections)
+        self.assertFalse(any('KeepAlive: on' in x for x in self.server.queries))
+
+
+class StreamingTest(TestCase):
+    """Tests for streaming livestatus results"""
+    def setUp(self):
+        self.server = FakeLivestatusServer([['name', 'state'], ['localhost', 0], ['otherhost', 1]])
+        self.livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        adagios.status.connections.pool.close_all()
+
+    def tearDown(self):
+        adagios.status.connections.pool.close_all()
+        self.server.close()
+
+    def test_rows_on_separate_lines(self):
+        chunks = ['[["name","st', 'ate"],\n["local\\nhost",0],\n', '["otherhost",1]]\n']
+        rows = list(adagios.status.connections._iter_python_rows(chunks))
+        self.assertEqual([['name', 'state'], ['local\nhost', 0], ['otherhost', 1]], rows)
+
+    def test_rows_on_one_line(self):
+        rows = list(adagios.status.connections._iter_python_rows(["[['name'], ['localhost']]\n"]))
+        self.assertEqual([['name'], ['localhost']], rows)
+
+    def test_query_stream(self):
+        hosts = self.livestatus.query_stream('GET hosts')
+        self.assertEqual({'name': 'localhost', 'state': 0}, next(hosts))
+        self.assertEqual([{'name': 'otherhost', 'state': 1}], list(hosts))
+        self.livestatus.query_stream('GET hosts')
+        list(self.livestatus.query_stream('GET hosts'))
+        self.assertEqual(1, self.server.connections)
+
+    def test_unfinished_stream_does_not_reuse_socket(self):
+        self.server.rows += [['host%s' % i, 0] for i in range(10000)]
+        hosts = self.livestatus.query_stream('GET hosts')
+        next(hosts)
+        hosts.close()
+        list(self.livestatus.query_stream('GET hosts'))
+        self.assertEqual(2, self.server.connections)
+
+    def test_json_stream(self):
+        import adagios.rest.views
+        result = ''.join(adagios.rest.views._json_stream(iter([{'a': 1}, {'b': 2}])))
+        self.assertEqual([{'a': 1}, {'b': 2}], json.loads(result))
+        self.assertEqual([], json.loads(''.join(adagios.rest.views._json_stream(iter([])))))
+
+
+class MultiSiteFanoutTest(TestCase):
+    """Tests for adagios.status.connections.PooledMultiSite"""
+    def setUp(self):
+        self.servers = []
+        self.livestatus = adagios.status.connections.PooledMultiSite(livestatus_socket_path='/nonexistent/live')
+        adagios.misc.rest.notifications.clear()
+        self.monitor = patch('adagios.status.health.monitor', adagios.status.health.HealthMonitor())
+        self.monitor.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+        adagios.status.connections.pool.close_all()
+        adagios.misc.rest.notifications.clear()
+        for server in self.servers:
+            server.close()
+
+    def add_backend(self, name, rows, delay=0):
+        server = FakeLivestatusServer(rows, delay=delay)
+        self.servers.append(server)
+        self.livestatus.add_backend(path=server.path, name=name)
+
+    def test_backends_are_queried_at_the_same_time(self):
+        for name in ('site1', 'site2', 'site3'):
+            self.add_backend(name, [['name'], [name]], delay=0.3)
+        start_time = time.time()
+        hosts = self.livestatus.query('GET hosts')
+        self.assertTrue(time.time() - start_time < 0.8)
+        self.assertEqual(['site1', 'site2', 'site3'], sorted(x['backend'] for x in hosts))
+
+    def test_backends_are_pooled(self):
+        self.add_backend('site1', [['name'], ['site1']])
+        self.assertTrue(isinstance(self.livestatus.backends['site1'], adagios.status.connections.PooledLivestatus))
+
+    def test_stats_are_merged(self):
+        self.add_backend('site1', [[1, 2]])
+        self.add_backend('site2', [[3, 4]])
+        self.assertEqual([4, 6], self.livestatus.query('GET hosts', 'Stats: state = 0', 'Stats: state = 1'))
+
+    def test_slow_backend_gives_partial_results(self):
+        self.add_backend('fast', [['name'], ['fast']])
+        self.add_backend('slow', [['name'], ['slow']], delay=1)
+        with patch('adagios.settings.livestatus_backend_timeout', 0.2):
+            hosts = self.livestatus.query('GET hosts')
+        self.assertEqual(['fast'], [x['backend'] for x in hosts])
+        self.assertIn('slow', self.livestatus.failed_backends)
+        self.assertIn('livestatus_backend_slow', adagios.misc.rest.notifications)
+
+    def test_query_top_merges_sorted_backends(self):
+        self.add_backend('site1', [['name', 'state'], ['a', 2], ['b', 0], ['c', 1]])
+        self.add_backend('site2', [['name', 'state'], ['d', 1], ['e', 3]])
+        key = adagios.status.utils._RowSortKey.factory(['-state', 'name'])
+        hosts = self.livestatus.query_top(3, key, 'GET hosts')
+        self.assertEqual(['e', 'a', 'c'], [x['name'] for x in hosts])
+        self.assertEqual(['site2', 'site1', 'site1'], [x['backend'] for x in hosts])
+
+    def test_all_backends_down_raises(self):
+        self.livestatus.add_backend(path='/nonexistent/live1', name='site1')
+        self.livestatus.add_backend(path='/nonexistent/live2', name='site2')
+        with patch('pynag.Parsers.Livestatus._RETRY_INTERVAL', 0):
+            self.assertRaises(Exception, self.livestatus.query, 'GET hosts')
+
+
+class HealthMonitorTest(TestCase):
+    """Tests for adagios.status.health"""
+    def setUp(self):
+        self.monitor = adagios.status.health.HealthMonitor()
+        self.patches = [
+            patch('adagios.status.health.monitor', self.monitor),
+            patch('adagios.settings.livestatus_health_interval', 0),
+            patch('adagios.settings.livestatus_breaker_threshold', 2),
+            patch('adagios.settings.livestatus_breaker_cooldown', 30),
+        ]
+        for i in self.patches:
+            i.start()
+
+    def tearDown(self):
+        for i in self.patches:
+            i.stop()
+        adagios.status.connections.pool.close_all()
+
+    def test_probe_does_not_hang_on_a_silent_backend(self):
+        import socket
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'live')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(path)
+        server.listen(5)
+        with patch('adagios.settings.livestatus_backend_timeout', 0.2), \
+                patch('adagios.status.utils.get_all_backends', return_value=[path]):
+            start = time.time()
+            self.monitor.probe()
+            self.assertTrue(time.time() - start < 5)
+            self.assertEqual([path], self.monitor.get_nonworking_backends())
+
+    def test_breaker_opens_after_threshold(self):
+        self.monitor.record_failure('site1', 'error')
+        self.assertTrue(self.monitor.allow('site1'))
+        self.monitor.record_failure('site1', 'error')
+        self.assertFalse(self.monitor.allow('site1'))
+        self.assertEqual('open', self.monitor.get('site1')['state'])
+
+    def test_breaker_is_half_open_after_cooldown(self):
+        self.monitor.record_failure('site1', 'error')
+        self.monitor.record_failure('site1', 'error')
+        with patch('adagios.settings.livestatus_breaker_cooldown', 0):
+            self.assertTrue(self.monitor.allow('site1'))
+        self.assertEqual('half_open', self.monitor.get('site1')['state'])
+        # Only one trial query goes through while the breaker is half open
+        self.assertFalse(self.monitor.allow('site1'))
+        self.monitor.record_success('site1', 0.1)
+        self.assertEqual('closed', self.monitor.get('site1')['state'])
+        self.assertEqual(0.1, self.monitor.get('site1')['average_latency'])
+
+    def test_retried_query_is_one_failure(self):
+        livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path='/nonexistent/live')
+        error = adagios.status.connections.LivestatusError('Connection reset')
+        with patch('pynag.Parsers.Livestatus._RETRY_INTERVAL', 0), \
+                patch.object(livestatus, '_write', side_effect=error) as write:
+            self.assertRaises(Exception, livestatus.query, 'GET hosts')
+        self.assertEqual(2, write.call_count)
+        self.assertEqual(1, self.monitor.get('/nonexistent/live')['consecutive_failures'])
+
+    def test_nonworking_backends_come_from_memory(self):
+        with patch('adagios.settings.livestatus_path', 'site1,site2'):
+            self.monitor.record_failure('site2', 'error')
+            self.assertEqual(['site2'], self.monitor.get_nonworking_backends())
+
+    def test_queries_record_latency(self):
+        server = FakeLivestatusServer([['name'], ['localhost']])
+        try:
+            livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=server.path)
+            livestatus.query('GET hosts')
+        finally:
+            server.close()
+        self.assertEqual(1, len(self.monitor.get(server.path)['latency']))
+
+    def test_queries_skip_backends_with_open_breaker(self):
+        server = FakeLivestatusServer([['name'], ['localhost']])
+        try:
+            livestatus = adagios.status.connections.PooledMultiSite(livestatus_socket_path=server.path)
+            livestatus.add_backend(path=server.path, name='up')
+            livestatus.add_backend(path='/nonexistent/live', name='down')
+            self.monitor.record_failure('/nonexistent/live', 'error')
+            self.monitor.record_failure('/nonexistent/live', 'error')
+            hosts = livestatus.query('GET hosts')
+        finally:
+            server.close()
+        self.assertEqual(['up'], [x['backend'] for x in hosts])
+        self.assertIn('down', livestatus.failed_backends)
+
+
+class SnapshotCacheTest(TestCase):
+    """Tests for adagios.status.snapshots"""
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetches = 0
+        self.patches = [
+            patch('adagios.settings.status_cache_ttl', 5),
+            patch('adagios.settings.status_cache_dir', self.cache_dir),
+        ]
+        for i in self.patches:
+            i.start()
+
+    def tearDown(self):
+        for i in self.patches:
+            i.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def fetch(self):
+        self.fetches += 1
+        time.sleep(0.1)
+        return [{'name': 'localhost', 'state': 0}]
+
+    def test_snapshot_is_reused(self):
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        result = adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        self.assertEqual([{'name': 'localhost', 'state': 0}], result)
+        self.assertEqual(1, self.fetches)
+
+    def test_concurrent_requests_are_coalesced(self):
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        threads = [threading.Thread(target=adagios.status.snapshots.get_or_fetch, args=(key, self.fetch))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.fetches)
+
+    def test_commands_invalidate_snapshots(self):
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        with patch('pynag.Control.Command.add_host_comment'):
+            adagios.status.rest.comment(author='test', comment='test', host_name='localhost')
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        self.assertEqual(2, self.fetches)
+
+    def test_snapshots_are_invalidated_after_the_command(self):
+        generations = []
+
+        def add_host_comment(**kwargs):
+            generations.append(adagios.status.snapshots._get_generation(self.cache_dir))
+        with patch('pynag.Control.Command.add_host_comment', side_effect=add_host_comment):
+            adagios.status.rest.comment(author='test', comment='test', host_name='localhost')
+        self.assertEqual([0], generations)
+        self.assertEqual(1, adagios.status.snapshots._get_generation(self.cache_dir))
+
+    def test_insecure_cache_dir_is_not_used(self):
+        os.chmod(self.cache_dir, 0o777)
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        self.assertEqual(2, self.fetches)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_old_snapshots_are_deleted(self):
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        self.assertEqual({key, key + '.lock'}, set(os.listdir(self.cache_dir)))
+        for filename in os.listdir(self.cache_dir):
+            os.utime(os.path.join(self.cache_dir, filename), (0, 0))
+        adagios.status.snapshots.cleanup(self.cache_dir, 60)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_ttl_zero_disables_cache(self):
+        key = adagios.status.snapshots.make_key('GET hosts', None, [''])
+        with patch('adagios.settings.status_cache_ttl', 0):
+            adagios.status.snapshots.get_or_fetch(key, self.fetch)
+            adagios.status.snapshots.get_or_fetch(key, self.fetch)
+        self.assertEqual(2, self.fetches)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
+class QueryCacheTest(TestCase):
+    """Tests for adagios.status.utils.QueryCache"""
+    def setUp(self):
+        self.server = FakeLivestatusServer([['name', 'state'], ['localhost', 0]])
+        self.cache = adagios.status.utils.QueryCache()
+        self.livestatus = adagios.status.connections.PooledLivestatus(livestatus_socket_path=self.server.path)
+        self.livestatus.query_cache = self.cache
+
+    def tearDown(self):
+        adagios.status.connections.pool.close_all()
+        self.server.close()
+
+    def test_identical_queries_are_sent_once(self):
+        self.livestatus.query('GET hosts', 'Columns: name state')
+        self.livestatus.query('GET hosts', 'Columns: name state', columns=True)
+        self.assertEqual(1, len(self.server.queries))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_different_filters_are_not_shared(self):
+        self.livestatus.query('GET hosts', name='localhost')
+        self.livestatus.query('GET hosts', name='otherhost')
+        self.assertEqual(2, len(self.server.queries))
+
+    def test_cached_results_are_copies(self):
+        hosts = self.livestatus.query('GET hosts')
+        hosts[0]['state'] = 2
+        hosts = self.livestatus.query('GET hosts')
+        self.assertEqual(0, hosts[0]['state'])
+
+    def test_wait_queries_are_not_cached(self):
+        self.livestatus.query('GET hosts', 'WaitTimeout: 1')
+        self.livestatus.query('GET hosts', 'WaitTimeout: 1')
+        self.assertEqual(2, len(self.server.queries))
+        self.assertEqual(0, self.cache.misses)
+
+    def test_cache_is_attached_to_request(self):
+        request = HttpRequest()
+        cache = adagios.status.utils.get_query_cache(request)
+        self.assertIs(cache, adagios.status.utils.get_query_cache(request))
+        self.assertIsNone(adagios.status.utils.get_query_cache(None))
+
+
+class ColumnarTest(TestCase):
+    """ Tests for adagios.status.columnar and compact results from get_hosts/get_services """
+
+    def _services(self):
+        return [
+            {'host_name': 'host1', 'description': 'Ping', 'state': 2, 'acknowledged': 0, 'downtimes': [],
+             'host_downtimes': [], 'last_state_change': 100},
+            {'host_name': 'host1', 'description': 'Disk', 'state': 1, 'acknowledged': 1, 'downtimes': [],
+             'host_downtimes': [], 'last_state_change': 100},
+            {'host_name': 'host2', 'description': 'Load', 'state': 0, 'acknowledged': 0, 'downtimes': [1],
+             'host_downtimes': [], 'last_state_change': 0},
+            {'host_name': 'host2', 'description': 'Swap', 'state': 0, 'acknowledged': 0, 'downtimes': [],
+             'host_downtimes': [], 'last_state_change': 100},
+        ]
+
+    def _hosts(self):
+        return [
+            {'name': 'host1', 'state': 1, 'num_services_ok': 2, 'num_services_warn': 1, 'num_services_crit': 1,
+             'num_services_pending': 0, 'num_services_unknown': 0, 'services_with_state': [],
+             'last_state_change': 10, 'last_check': 10},
+            {'name': 'host2', 'state': 0, 'num_services_ok': 0, 'num_services_warn': 0, 'num_services_crit': 0,
+             'num_services_pending': 0, 'num_services_unknown': 0, 'services_with_state': [],
+             'last_state_change': 0, 'last_check': 0},
+        ]
+
+    def test_rows_behave_like_dicts(self):
+        table = adagios.status.columnar.Table.from_rows([{'name': 'host1'}, {'name': 'host2', 'state': 1}])
+        self.assertEqual(2, len(table))
+        self.assertEqual('host2', table[-1]['name'])
+        self.assertEqual(None, table[0].get('state'))
+        self.assertNotIn('state', table[0])
+        self.assertRaises(KeyError, lambda: table[0]['state'])
+        table[0]['state'] = 3
+        self.assertEqual({'name': 'host1', 'state': 3}, table[0].to_dict())
+        self.assertEqual(['host2'], [x['name'] for x in table[1:]])
+
+    def test_sort(self):
+        table = adagios.status.columnar.Table.from_rows(self._services())
+        table.sort(key=adagios.status.utils._RowSortKey.factory(['-state', 'description']))
+        self.assertEqual(['Ping', 'Disk', 'Load', 'Swap'], table.column('description'))
+
+    def test_bulk_service_tags_match_dicts(self):
+        expected = adagios.status.utils._add_custom_tags_to_services(self._services())
+        table = adagios.status.columnar.Table.from_rows(self._services())
+        adagios.status.utils._add_custom_tags_to_services(table)
+        self.assertEqual(expected, table.to_dicts())
+
+    def test_bulk_host_statistics_match_dicts(self):
+        expected = self._hosts()
+        adagios.status.utils.add_statistics_to_hosts(expected)
+        table = adagios.status.columnar.Table.from_rows(self._hosts())
+        adagios.status.utils.add_statistics_to_hosts(table)
+        self.assertEqual(expected, table.to_dicts())
+
+    def test_get_services_compact(self):
+        with patch('adagios.status.utils.livestatus') as livestatus:
+            livestatus.return_value.query_stream.side_effect = lambda *args, **kwargs: iter(self._services())
+            services = adagios.status.utils.get_services(compact='1', offset=1, limit=2)
+        self.assertIsInstance(services, adagios.status.columnar.Table)
+        self.assertEqual(['Disk', 'Load'], [x['description'] for x in services])
+        self.assertEqual('warning', services[0]['status'])
+
+    def test_rest_hosts_are_never_compact(self):
+        request = RequestFactory().get('/rest/status/json/hosts', {'compact': '1'})
+        with patch('adagios.status.utils.livestatus'), \
+                patch('adagios.status.utils._query_snapshot', side_effect=lambda *args: self._hosts()), \
+                patch('adagios.status.utils._query_compact') as query_compact:
+            hosts = adagios.status.rest.hosts(request, compact='1')
+        self.assertEqual(0, query_compact.call_count)
+        self.assertEqual(['host1', 'host2'], sorted(x['name'] for x in json.loads(json.dumps(hosts))))
+
+
+class CounterPollerTest(TestCase):
+    """ Tests for adagios.status.counters """
+
+    def setUp(self):
+        self.poller = adagios.status.counters.CounterPoller()
+        self.statistics = dict((key, 0) for key in adagios.status.counters.COUNTER_KEYS)
+
+    def test_counters_are_shared_within_interval(self):
+        with patch('adagios.settings.navbar_push_interval', 60), \
+                patch('adagios.status.utils.get_statistics') as get_statistics:
+            get_statistics.return_value = self.statistics
+            self.poller.get_counters('nagiosadmin')
+            counters = self.poller.get_counters('nagiosadmin')
+            self.poller.get_counters('someone_else')
+        self.assertEqual(2, get_statistics.call_count)
+        self.assertEqual('nagiosadmin', get_statistics.call_args_list[0][0][0].META['REMOTE_USER'])
+        self.assertEqual(0, counters['num_problems'])
+
+    def test_subscribers_get_changed_counters(self):
+        with patch('adagios.settings.navbar_push_interval', 60), \
+                patch.object(self.poller, 'start'), \
+                patch('adagios.status.utils.get_statistics') as get_statistics:
+            get_statistics.return_value = dict(self.statistics)
+            queue = self.poller.subscribe('nagiosadmin')
+            self.assertEqual(0, queue.get_nowait()['num_problems'])
+
+            self.poller.refresh('nagiosadmin')
+            self.assertTrue(queue.empty())
+
+            get_statistics.return_value = dict(self.statistics, num_problems=5)
+            self.poller.refresh('nagiosadmin')
+            self.assertEqual(5, queue.get_nowait()['num_problems'])
+            self.poller.unsubscribe('nagiosadmin', queue)
+
+    def test_event_stream(self):
+        request = RequestFactory().get('/status/counters', REMOTE_USER='nagiosadmin')
+        with patch('adagios.settings.navbar_push_interval', 60), \
+                patch('adagios.settings.navbar_push', True), \
+                patch('adagios.status.counters.poller', self.poller), \
+                patch.object(self.poller, 'start'), \
+                patch('adagios.status.utils.get_statistics') as get_statistics:
+            get_statistics.return_value = self.statistics
+            stream = adagios.status.counters.event_stream(request)
+            events = iter(stream)
+            self.assertEqual('retry: 60000\n\n', next(events))
+            event = next(events)
+            stream.close()
+        self.assertTrue(event.startswith('data: '))
+        self.assertEqual(0, json.loads(event[len('data: '):])['num_problems'])
+        self.assertFalse(self.poller._subscribers)
+
+    def test_push_is_off_by_default(self):
+        request = RequestFactory().get('/status/counters', REMOTE_USER='nagiosadmin')
+        self.assertEqual(None, adagios.status.counters.event_stream(request))
+        response = self.client.get('/status/counters')
+        self.assertEqual(204, response.status_code)
+
+    def test_streams_are_capped_per_process(self):
+        request = RequestFactory().get('/status/counters', REMOTE_USER='nagiosadmin')
+        with patch('adagios.settings.navbar_push_interval', 60), \
+                patch('adagios.settings.navbar_push', True), \
+                patch('adagios.settings.navbar_push_max_streams', 2), \
+                patch('adagios.status.counters.poller', self.poller), \
+                patch.object(self.poller, 'start'), \
+                patch('adagios.status.utils.get_statistics') as get_statistics:
+            get_statistics.return_value = self.statistics
+            streams = [adagios.status.counters.event_stream(request) for i in range(3)]
+            self.assertEqual(None, streams[2])
+            # Closing a stream that was never read still frees its slot
+            streams[0].close()
+            self.assertNotEqual(None, adagios.status.counters.event_stream(request))
+        self.assertEqual(2, self.poller.count_subscribers())
+
+
+class TopologyTest(TestCase):
+    """ Tests for adagios.status.topology """
+
+    def host(self, name, state=0, parents=(), childs=(), acknowledged=0):
+        return {'name': name, 'state': state, 'acknowledged': acknowledged, 'downtimes': [],
+                'parents': list(parents), 'childs': list(childs)}
+
+    def network(self, router=0, switch=0, web=0):
+        return [
+            self.host('router', router, childs=['switch']),
+            self.host('switch', switch, parents=['router'], childs=['web']),
+            self.host('web', web, parents=['switch']),
+        ]
+
+    def test_only_the_first_host_down_is_a_root_cause(self):
+        topology = adagios.status.topology.Topology()
+        topology.update(self.network(router=1, switch=1, web=1))
+        self.assertEqual(['router'], topology.get_root_causes())
+        self.assertEqual({'switch', 'web'}, set(topology.get_blast_radius('router')))
+        network_problems, host_problems = topology.get_outages()
+        self.assertEqual(['router'], [x['name'] for x in network_problems])
+        self.assertEqual([], host_problems)
+
+    def test_updates_are_incremental(self):
+        topology = adagios.status.topology.Topology()
+        topology.update(self.network(switch=1, web=1))
+        self.assertEqual(['switch'], topology.get_root_causes())
+        self.assertEqual(set(), topology.update(self.network(switch=1, web=1)))
+        self.assertEqual({'switch'}, topology.update(self.network(web=1)))
+        self.assertEqual(['web'], topology.get_root_causes())
+
+    def test_acknowledged_hosts_are_not_root_causes(self):
+        topology = adagios.status.topology.Topology()
+        hosts = self.network(switch=1, web=1)
+        hosts[1]['acknowledged'] = 1
+        topology.update(hosts)
+        self.assertEqual(['web'], topology.get_root_causes())
+
+    def test_removed_hosts_are_forgotten(self):
+        topology = adagios.status.topology.Topology()
+        topology.update(self.network(switch=1, web=1))
+        topology.update([self.host('web', 1)])
+        self.assertEqual(['web'], topology.get_root_causes())
+        self.assertEqual(['web'], list(topology.hosts))
+
+    def test_network_outages(self):
+        request = RequestFactory().get('/rest/status/json/network_outages', REMOTE_USER='topologytest')
+        with patch('adagios.status.utils.get_hosts', return_value=self.network(router=1, switch=1)):
+            outages = adagios.status.rest.network_outages(request)
+        self.assertEqual(1, len(outages))
+        self.assertEqual('router', outages[0]['host_name'])
+        self.assertEqual(['switch', 'web'], outages[0]['affected_hosts'])
+
+    def test_host_rows_are_copies(self):
+        topology = adagios.status.topology.Topology()
+        topology.update(self.network(router=1))
+        rows = topology.get_hosts(['web', 'unknown', 'router'])
+        self.assertEqual(['web', 'router'], [x['name'] for x in rows])
+        rows[0]['state'] = 2
+        network_problems, host_problems = topology.get_outages()
+        network_problems[0]['state'] = 2
+        self.assertEqual([0, 1], [x['state'] for x in topology.get_hosts(['web', 'router'])])
+        # Rows handed out stay usable after the host is gone
+        topology.update([self.host('web')])
+        self.assertEqual('router', network_problems[0]['name'])
+
+    def test_network_parents_topology_has_every_host(self):
+        import adagios.status.views
+        request = RequestFactory().get('/status/parents', REMOTE_USER='topologytest')
+        topology = adagios.status.topology.Topology()
+        topology.update(self.network(router=1))
+        with patch('adagios.status.utils.get_hosts', return_value=self.network(router=1)[:1]), \
+                patch('adagios.status.topology.get_topology', return_value=topology) as get_topology, \
+                patch('adagios.status.views.render_to_response') as render_to_response:
+            adagios.status.views.network_parents(request)
+        get_topology.assert_called_once_with(request)
+        context = render_to_response.call_args[0][1]
+        self.assertEqual(['switch'], [x['name'] for x in context['hosts'][0]['child_hosts']])
+
+
+class NetworkParentsTest(TestCase):
+    """ Tests for adagios.status.views._get_network_parents """
+
+    hosts = {
+        'web': {'name': 'web', 'state': 0, 'parents': ['switch1', 'switch2']},
+        'switch1': {'name': 'switch1', 'state': 0, 'parents': ['router']},
+        'switch2': {'name': 'switch2', 'state': 1, 'parents': ['router']},
+        'router': {'name': 'router', 'state': 0, 'parents': []},
+    }
+
+    def setUp(self):
+        import adagios.status.views
+        self.views = adagios.status.views
+        self.request = RequestFactory().get('/status/detail', REMOTE_USER='networkparentstest')
+        self.livestatus = patch('adagios.status.utils.livestatus').start().return_value
+        self.addCleanup(patch.stopall)
+        self.livestatus.get_host.side_effect = lambda name, backend=None: self.hosts[name]
+        self.livestatus.query.side_effect = self.query
+
+    def query(self, *args, **kwargs):
+        names = [x.split(' = ')[1] for x in args if x.startswith('Filter: name = ')]
+        return [dict(self.hosts[x]) for x in names if x in self.hosts]
+
+    def test_one_query_per_level(self):
+        result = self.views._get_network_parents(self.request, 'web')
+        self.assertEqual([['switch1', 'switch2'], ['router']], [[x['name'] for x in level] for level in result])
+        self.assertEqual(2, self.livestatus.query.call_count)
+
+    def test_one_query_with_known_topology(self):
+        topology = adagios.status.topology.Topology()
+        topology.update([dict(x, acknowledged=0, downtimes=[], childs=[]) for x in self.hosts.values()])
+        with patch.dict(adagios.status.topology._topologies, {'networkparentstest': topology}):
+            result = self.views._get_network_parents(self.request, 'web')
+        self.assertEqual([['switch1', 'switch2'], ['router']], [[x['name'] for x in level] for level in result])
+        self.assertEqual(1, self.livestatus.query.call_count)
+
+
+class HostgroupsTest(TestCase):
+    """ Tests for adagios.status.hostgroups """
+
+    def setUp(self):
+        adagios.status.hostgroups.clear_cache()
+        self.addCleanup(adagios.status.hostgroups.clear_cache)
+        self.generation = patch('adagios.status.hostgroups._get_generation', return_value=('nagios.cfg', 1)).start()
+        self.objects = patch.object(pynag.Model.Hostgroup, 'objects').start()
+        self.relations = patch.object(pynag.Model.ObjectRelations, 'hostgroup_hostgroups',
+                                      {'world': {'europe'}, 'europe': {'iceland'}}).start()
+        self.addCleanup(patch.stopall)
+
+    def test_tree_is_kept_until_nagios_reloads(self):
+        first = adagios.status.hostgroups.get_tree()
+        self.assertTrue(first is adagios.status.hostgroups.get_tree())
+        self.generation.return_value = ('nagios.cfg', 2)
+        self.assertFalse(first is adagios.status.hostgroups.get_tree())
+
+    def test_descendants_survive_loops(self):
+        tree = adagios.status.hostgroups.HostgroupTree({'a': ['b'], 'b': ['c'], 'c': ['a']})
+        self.assertEqual({'b', 'c'}, set(tree.get_descendants('a')))
+        self.assertEqual({'a', 'c'}, set(tree.get_descendants('b')))
+
+    def test_get_hostgroups_is_one_query(self):
+        row = {'name': 'europe', 'alias': 'Europe', 'members_with_state': [['localhost', 0, 1]],
+               'num_services_ok': 3, 'num_services_warn': 1, 'num_services_crit': 0,
+               'num_services_unknown': 0, 'num_services_pending': 0}
+        with patch('adagios.status.utils.livestatus') as livestatus:
+            livestatus.return_value.query.return_value = [row]
+            hostgroups = adagios.status.hostgroups.get_hostgroups(None)
+        self.assertEqual(1, livestatus.return_value.query.call_count)
+        europe = hostgroups[0]
+        self.assertEqual({'world'}, europe['parent_hostgroups'])
+        self.assertEqual({'iceland'}, europe['child_hostgroups'])
+        self.assertEqual(['localhost'], europe['members'])
+        self.assertEqual(75.0, europe['health'])
+
+
+class GroupLookupTest(TestCase):
+    """ Tests for adagios.status.utils.get_groups """
+
+    def setUp(self):
+        self.livestatus = patch('adagios.status.utils.livestatus').start().return_value
+        self.addCleanup(patch.stopall)
+        self.livestatus.query.return_value = [
+            {'name': 'windows-servers', 'alias': 'Windows'},
+            {'name': 'linux-servers', 'alias': 'Linux'},
+        ]
+
+    def test_one_query_for_every_group(self):
+        groups = adagios.status.utils.get_groups(None, 'hostgroup', ['linux-servers', 'missing', 'windows-servers'])
+        self.assertEqual(['linux-servers', 'windows-servers'], [x['name'] for x in groups])
+        self.assertEqual(1, self.livestatus.query.call_count)
+        args = self.livestatus.query.call_args[0]
+        self.assertEqual('GET hostgroups', args[0])
+        self.assertTrue('Or: 3' in args)
+
+    def test_no_names_no_query(self):
+        self.assertEqual([], adagios.status.utils.get_groups(None, 'servicegroup', []))
+        self.assertFalse(self.livestatus.query.called)
+
+    def test_unknown_group_type(self):
+        self.assertRaises(ValueError, adagios.status.utils.get_groups, None, 'hosts', ['localhost'])
+
+    def test_hostgroup_detail_fetches_subgroups_in_one_query(self):
+        import adagios.status.views
+        request = RequestFactory().get('/status/hostgroups/linux-servers')
+        tree = adagios.status.hostgroups.HostgroupTree({'servers': ['linux-servers', 'windows-servers']})
+        counts = {'num_services_ok': 1, 'num_services_warn': 0, 'num_services_crit': 0,
+                  'num_services_unknown': 0, 'num_services_pending': 0}
+        self.livestatus.query.return_value = [dict(counts, name=x) for x in ('windows-servers', 'servers', 'linux-servers')]
+        with patch('adagios.status.hostgroups.get_tree', return_value=tree), \
+                patch('adagios.status.views.render_to_response') as render_to_response:
+            adagios.status.views.hostgroup_detail(request, b'servers')
+        c = render_to_response.call_args[0][1]
+        self.assertEqual('servers', c['my_hostgroup']['name'])
+        self.assertEqual(['linux-servers', 'windows-servers'], [x['name'] for x in c['hostgroups']])
+        self.assertEqual(1, self.livestatus.query.call_count)
+
+
+class FakeLogFiles(object):
+    """ Serves state history log lines from a list, like pynag.Parsers.LogFiles """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.calls = []
+
+    def get_log_entries(self, start_time=None, end_time=None, strict=True, class_name=None):
+        self.calls.append((start_time, end_time))
+        return [dict(x) for x in self.entries if start_time <= x['time'] <= end_time]
+
+
+class SlaRollupsTest(TestCase):
+    """ Tests for adagios.status.sla """
+
+    day = adagios.status.sla.SECONDS_IN_A_DAY
+    first_day = 100 * adagios.status.sla.SECONDS_IN_A_DAY
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        first_day, day = self.first_day, self.day
+        self.entries = [
+            {'time': first_day, 'host_name': 'web', 'service_description': 'http', 'state': 0},
+            {'time': first_day, 'host_name': 'web', 'service_description': None, 'state': 0},
+            {'time': first_day + day // 2, 'host_name': 'web', 'service_description': 'http', 'state': 2},
+            {'time': first_day + day + day // 2, 'host_name': 'web', 'service_description': 'http', 'state': 0},
+            {'time': first_day + 3 * day + 600, 'host_name': 'web', 'service_description': 'http', 'state': 1},
+        ]
+        self.logfiles = FakeLogFiles(self.entries)
+        self.rollups = adagios.status.sla.SlaRollups(os.path.join(self.tempdir, 'sla.sqlite'), self.logfiles)
+        patch.object(adagios.settings, 'sla_rollup_days', 3).start()
+        patch('time.time', return_value=first_day + 3 * day + 3600).start()
+        self.addCleanup(patch.stopall)
+
+    def test_rollups_match_the_logs(self):
+        start_time = self.first_day + self.day // 4
+        end_time = self.first_day + 3 * self.day + 1800
+        expected = adagios.status.sla.replay({}, self.entries, start_time, end_time)
+        self.assertEqual(expected, self.rollups.get_totals(start_time, end_time))
+        self.assertEqual(self.first_day + 3 * self.day, self.rollups.get_rolled_up_until())
+
+    def test_whole_days_are_not_read_again(self):
+        self.rollups.update()
+        self.logfiles.calls = []
+        totals = self.rollups.get_totals(self.first_day + self.day, self.first_day + 3 * self.day)
+        self.assertEqual([], self.logfiles.calls)
+        http = totals[('web', 'http')]
+        self.assertEqual((self.day + self.day // 2, self.day // 2), (http[0], http[2]))
+
+    def test_update_only_adds_new_days(self):
+        self.assertEqual(3, self.rollups.update())
+        self.assertEqual(0, self.rollups.update())
+        self.logfiles.calls = []
+        self.assertEqual(1, self.rollups.update(now=self.first_day + 4 * self.day + 60))
+        self.assertEqual([(self.first_day + 3 * self.day, self.first_day + 4 * self.day - 1)], self.logfiles.calls)
+
+    def test_window_longer_than_rollup_days(self):
+        with patch.object(adagios.settings, 'sla_rollup_days', 1):
+            self.assertEqual(1, self.rollups.update())
+            start_time = self.first_day + self.day // 4
+            end_time = self.first_day + 3 * self.day + 1800
+            expected = adagios.status.sla.replay({}, self.entries, start_time, end_time)
+            self.assertEqual(expected, self.rollups.get_totals(start_time, end_time))
+            self.assertEqual(self.first_day, self.rollups.get_rolled_up_since())
+            # The older days are rolled up now, only partial days are read
+            self.logfiles.calls = []
+            self.assertEqual(expected, self.rollups.get_totals(start_time, end_time))
+            self.assertEqual([(self.first_day, self.first_day + self.day), (self.first_day + 3 * self.day, end_time)], self.logfiles.calls)
+
+    def test_reports_do_not_wait_for_another_process(self):
+        import fcntl
+        with open(self.rollups.get_path() + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertEqual(0, self.rollups.update())
+            start_time = self.first_day + self.day // 4
+            end_time = self.first_day + 3 * self.day + 1800
+            expected = adagios.status.sla.replay({}, self.entries, start_time, end_time)
+            self.assertEqual(expected, self.rollups.get_totals(start_time, end_time))
+        self.assertEqual(None, self.rollups.get_rolled_up_until())
+        self.assertEqual(3, self.rollups.update())
+
+    def test_default_database_is_in_a_private_directory(self):
+        with patch('tempfile.tempdir', self.tempdir), \
+                patch.object(adagios.settings, 'sla_rollup_db', None):
+            rollups = adagios.status.sla.SlaRollups()
+            path = rollups.get_path()
+            self.assertEqual(0o700, os.stat(os.path.dirname(path)).st_mode & 0o777)
+            os.chmod(os.path.dirname(path), 0o755)
+            self.assertEqual(':memory:', rollups.get_path())
+
+    def test_report(self):
+        report = self.rollups.get_report(self.first_day, self.first_day + self.day)
+        self.assertEqual([None, 'http'], [x['service_description'] for x in report])
+        self.assertEqual(100.0, report[0]['sla'])
+        self.assertEqual(50.0, report[1]['sla'])
+        self.assertEqual(1, report[1]['num_problems'])
+        self.assertEqual(['success', 'danger'], [x['bootstrap_status'] for x in report[1]['states']])
+
+
 class SeleniumStatusTestCase(adagios.seleniumtests.SeleniumTestCase):
     def test_network_parents(self):
         """Status Overview, Network Parents should show an integer"""
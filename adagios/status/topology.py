@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Network topology of monitored hosts, and which outages are root causes.
+#
+# A host that is down, not acknowledged and not in downtime is a root cause
+# unless one of its parents is also such a host. Every worker process keeps a
+# Topology per remote user, built from the parents and childs columns of
+# livestatus. When new host rows come in, only hosts whose state or links
+# changed, and their children, are looked at again.
+
+from __future__ import unicode_literals
+from builtins import object
+import threading
+
+import adagios.status.utils
+
+# Columns a Topology needs from the hosts table
+HOST_COLUMNS = ['name', 'state', 'acknowledged', 'downtimes', 'parents', 'childs']
+
+
+def is_unhandled_problem(host):
+    """ Returns True if host is down, and nobody has acknowledged it or scheduled downtime for it """
+    return host['state'] != 0 and host['acknowledged'] == 0 and not host['downtimes']
+
+
+class Topology(object):
+    """ Parent/child index of hosts, with root cause outages kept up to date
+
+    Example:
+        >>> topology = Topology()
+        >>> changed = topology.update([
+        ...     {'name': 'router', 'state': 1, 'acknowledged': 0, 'downtimes': [], 'parents': [], 'childs': ['web']},
+        ...     {'name': 'web', 'state': 1, 'acknowledged': 0, 'downtimes': [], 'parents': ['router'], 'childs': []},
+        ... ])
+        >>> topology.get_root_causes()
+        ['router']
+        >>> sorted(topology.get_blast_radius('router'))
+        ['web']
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # host_name -> the last host row we got for it
+        self.hosts = {}
+        self._parents = {}
+        self._children = {}
+        self._problems = set()
+        self._root_causes = set()
+        # host_name -> every host behind it, forgotten when links change
+        self._blast_radius = {}
+
+    def update(self, rows):
+        """ Replace every host with rows (dicts with at least HOST_COLUMNS)
+
+        Returns:
+            Set of host names whose state, parents or children changed
+        """
+        with self._lock:
+            seen = set()
+            changed = set()
+            affected = set()
+            for row in rows:
+                name = row['name']
+                seen.add(name)
+                self.hosts[name] = row
+                parents = frozenset(row['parents'] or ())
+                children = frozenset(row['childs'] or ())
+                old_children = self._children.get(name, frozenset())
+                if self._parents.get(name) != parents or old_children != children:
+                    self._parents[name] = parents
+                    self._children[name] = children
+                    self._blast_radius.clear()
+                    changed.add(name)
+                    affected.update(old_children)
+                if is_unhandled_problem(row) != (name in self._problems):
+                    if name in self._problems:
+                        self._problems.discard(name)
+                    else:
+                        self._problems.add(name)
+                    changed.add(name)
+            for name in set(self.hosts) - seen:
+                affected.update(self._children.pop(name, ()))
+                del self.hosts[name]
+                self._parents.pop(name, None)
+                self._problems.discard(name)
+                self._root_causes.discard(name)
+                self._blast_radius.clear()
+                changed.add(name)
+
+            # Whether a host is a root cause depends only on itself and its parents
+            for name in changed:
+                affected.add(name)
+                affected.update(self._children.get(name, ()))
+            for name in affected:
+                self._evaluate(name)
+            return changed
+
+    def _evaluate(self, name):
+        if name in self._problems and not self._parents.get(name, frozenset()) & self._problems:
+            self._root_causes.add(name)
+        else:
+            self._root_causes.discard(name)
+
+    def get_root_causes(self):
+        """ Returns a sorted list with names of hosts that are down while all their parents are up """
+        with self._lock:
+            return sorted(self._root_causes)
+
+    def get_children(self, host_name):
+        return self._children.get(host_name, frozenset())
+
+    def get_parents(self, host_name):
+        return self._parents.get(host_name, frozenset())
+
+    def get_ancestors(self, host_name):
+        """ Returns a set of every host in front of host_name in the network (parents, grandparents, ...) """
+        with self._lock:
+            ancestors = set()
+            pending = list(self.get_parents(host_name))
+            while pending:
+                name = pending.pop()
+                if name in ancestors or name == host_name:
+                    continue
+                ancestors.add(name)
+                pending.extend(self.get_parents(name))
+            return ancestors
+
+    def get_blast_radius(self, host_name):
+        """ Returns a set of every host that is behind host_name in the network (children, grandchildren, ...) """
+        with self._lock:
+            if host_name not in self._blast_radius:
+                behind = set()
+                pending = list(self.get_children(host_name))
+                while pending:
+                    name = pending.pop()
+                    if name in behind or name == host_name:
+                        continue
+                    behind.add(name)
+                    pending.extend(self.get_children(name))
+                self._blast_radius[host_name] = frozenset(behind)
+            return self._blast_radius[host_name]
+
+    def get_hosts(self, host_names):
+        """ Returns copies of the rows of every host in host_names that is known, in the same order
+
+        Another request may update the topology at any time, so read host rows
+        through here instead of from self.hosts.
+        """
+        with self._lock:
+            return [dict(self.hosts[x]) for x in host_names if x in self.hosts]
+
+    def get_outages(self):
+        """ Returns a tuple of two lists of host rows that are root causes: (network_problems, host_problems)
+
+        network_problems are hosts that have children, host_problems are hosts without children.
+        Rows are copies, taken at the same moment.
+        """
+        with self._lock:
+            network_problems = []
+            host_problems = []
+            for name in self.get_root_causes():
+                if self._children.get(name):
+                    network_problems.append(dict(self.hosts[name]))
+                else:
+                    host_problems.append(dict(self.hosts[name]))
+            return network_problems, host_problems
+
+
+_topologies = {}
+_topologies_lock = threading.Lock()
+
+
+def get_cached_topology(request):
+    """ Returns the Topology of the user behind request as it was last seen, or None. Livestatus is not asked. """
+    remote_user = request.META.get('REMOTE_USER') if request is not None else None
+    return _topologies.get(remote_user)
+
+
+def get_topology(request, hosts=None):
+    """ Returns the Topology of the user behind request, updated with the current state of every host
+
+    Arguments:
+        request -- Django request, only hosts this user is allowed to see are included
+        hosts   -- Host rows with at least HOST_COLUMNS, if the caller already has them.
+                   Otherwise they are fetched from livestatus.
+    """
+    remote_user = request.META.get('REMOTE_USER') if request is not None else None
+    with _topologies_lock:
+        topology = _topologies.get(remote_user)
+        if topology is None:
+            topology = _topologies[remote_user] = Topology()
+    if hosts is None:
+        hosts = adagios.status.utils.get_hosts(request, fields=HOST_COLUMNS, limit=0)
+    topology.update(hosts)
+    return topology
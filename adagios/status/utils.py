@@ -23,7 +23,6 @@
 from __future__ import division
 from __future__ import unicode_literals
 from future.utils import string_types
-from functools import cmp_to_key
 from past.builtins import cmp
 #from past.builtins import six.string_types
 from builtins import str
@@ -34,11 +33,19 @@ import adagios.settings
 from adagios.misc.rest import add_notification, clear_notification
 import simplejson as json
 import django.utils.six
+import itertools
+import logging
+import threading
 
 from collections import defaultdict
 from adagios import userdata
+from adagios.status import columnar
+from adagios.status import connections
+from adagios.status import snapshots
 #import six
 
+logger = logging.getLogger(__name__)
+
 state = defaultdict(lambda: "unknown")
 state[0] = "ok"
 state[1] = "warning"
@@ -55,6 +62,15 @@ _SEARCH_KEYWORD = 'q'
 # This keyword is used to define how many rows the we should return
 _LIMIT_KEYWORD = 'limit'
 
+# How many rows to skip, used together with _LIMIT_KEYWORD for paging
+_OFFSET_KEYWORD = 'offset'
+
+# Comma separated list of columns to sort by, prefix a column with '-' for descending order
+_ORDER_BY_KEYWORD = 'order_by'
+
+# If set, results are returned as a columnar.Table instead of a list of dicts
+_COMPACT_KEYWORD = 'compact'
+
 # This is a common querystring key to filter for hosts/services in downtime.
 _IN_SCHEDULED_DOWNTIME = 'in_scheduled_downtime'
 
@@ -95,6 +111,164 @@ _GENERIC_SEARCH_FIELDS_SERVICE = [
 _ATTRIBUTE_DESCRIPTION = 'description'
 
 
+# Name of the attribute where we keep the livestatus query cache of a request
+_QUERY_CACHE_ATTRIBUTE = '_adagios_query_cache'
+
+# Cache hits and misses of every view, so we can see how much the query cache saves
+query_cache_statistics = defaultdict(lambda: defaultdict(int))
+
+
+class QueryCache(object):
+    """ Remembers the results of livestatus GET queries for the lifetime of one request.
+
+    Entries are keyed by normalized query text, livestatus backend and authuser,
+    so asking the same question twice during one page render only costs one
+    round trip to livestatus. Callers get a copy of the cached result, so they
+    are free to modify the rows they get back.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, backend, authuser, query, *args, **kwargs):
+        """ Returns a hashable key for query, or None if query should not be cached. """
+        kwargs.pop('columns', None)
+        livestatus_query = pynag.Parsers.LivestatusQuery(query, *args, **kwargs)
+        lines = [x.strip() for x in livestatus_query.splitlines()]
+        lines = tuple(x for x in lines if x)
+
+        # Only plain GET queries are safe to remember, Wait* headers mean the
+        # caller wants livestatus to block until something changes.
+        if not lines or not lines[0].startswith('GET '):
+            return None
+        if any(x.startswith('Wait') for x in lines):
+            return None
+        return lines, backend, authuser
+
+    def get(self, key):
+        """ Returns (True, result) on a cache hit, otherwise (False, None) """
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return True, _copy_result(self._results[key])
+            self.misses += 1
+            return False, None
+
+    def set(self, key, result):
+        with self._lock:
+            self._results[key] = _copy_result(result)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+def _copy_result(result):
+    """ Returns a copy of a livestatus result that can be modified without touching the original. """
+    if not isinstance(result, list):
+        return result
+    copy = []
+    for row in result:
+        if isinstance(row, dict):
+            row = dict(row)
+        elif isinstance(row, list):
+            row = list(row)
+        copy.append(row)
+    return copy
+
+
+def get_query_cache(request):
+    """ Returns the QueryCache that belongs to request, or None if there is no request to attach to """
+    if request is None:
+        return None
+    cache = getattr(request, _QUERY_CACHE_ATTRIBUTE, None)
+    if cache is None:
+        cache = QueryCache()
+        try:
+            setattr(request, _QUERY_CACHE_ATTRIBUTE, cache)
+        except AttributeError:
+            return None
+    return cache
+
+
+def record_query_cache_statistics(request, view_name):
+    """ Adds the cache hits and misses of request to the running totals of view_name """
+    cache = getattr(request, _QUERY_CACHE_ATTRIBUTE, None)
+    if cache is None:
+        return
+    statistics = query_cache_statistics[view_name]
+    statistics['requests'] += 1
+    statistics['hits'] += cache.hits
+    statistics['misses'] += cache.misses
+
+
+# Name of the attribute where we keep track of which columns a request has read
+_COLUMN_USAGE_ATTRIBUTE = '_adagios_column_usage'
+
+# Columns that views fetched from livestatus but never read, only collected
+# when debug_livestatus_columns is on. {view_name: {table: set(columns)}}
+unread_columns = defaultdict(lambda: defaultdict(set))
+
+
+class _ColumnTrackingRow(dict):
+    """ A livestatus row that remembers which of its columns have been read """
+
+    def __init__(self, read, *args, **kwargs):
+        super(_ColumnTrackingRow, self).__init__(*args, **kwargs)
+        self._read = read
+
+    def __getitem__(self, key):
+        self._read.add(key)
+        return super(_ColumnTrackingRow, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self._read.add(key)
+        return super(_ColumnTrackingRow, self).get(key, default)
+
+    def items(self):
+        self._read.update(list(self.keys()))
+        return super(_ColumnTrackingRow, self).items()
+
+    def values(self):
+        self._read.update(list(self.keys()))
+        return super(_ColumnTrackingRow, self).values()
+
+
+def _track_columns(request, table, fields, rows):
+    """ If debug_livestatus_columns is on, returns rows wrapped so we notice which columns are read.
+
+    See report_unread_columns()
+    """
+    if not adagios.settings.debug_livestatus_columns or request is None:
+        return rows
+    if isinstance(rows, columnar.Table):
+        return rows
+    usage = getattr(request, _COLUMN_USAGE_ATTRIBUTE, None)
+    if usage is None:
+        usage = []
+        setattr(request, _COLUMN_USAGE_ATTRIBUTE, usage)
+    read = set()
+    usage.append((table, list(fields), read))
+    return [_ColumnTrackingRow(read, row) for row in rows]
+
+
+def report_unread_columns(request, view_name):
+    """ Log the columns that view_name fetched from livestatus during request but never read """
+    usage = getattr(request, _COLUMN_USAGE_ATTRIBUTE, None)
+    if not usage:
+        return
+    for table, fields, read in usage:
+        unread = set(fields) - read
+        if not unread:
+            continue
+        unread_columns[view_name][table].update(unread)
+        logger.warning("%s fetched columns from %s that were never read: %s",
+                       view_name, table, ', '.join(sorted(unread)))
+
+
 def get_all_backends():
     # TODO: Properly support multiple instances, using split here is not a good idea
     backends = adagios.settings.livestatus_path or ''
@@ -105,6 +279,9 @@ def get_all_backends():
 
 def livestatus(request):
     """ Returns a new pynag.Parsers.mk_livestatus() object with authauser automatically set from request.META['remoteuser']
+
+    Backends share a per process pool of livestatus sockets, see adagios.status.connections
+    Identical queries made during the same request are only sent once, see QueryCache
     """
 
     if request is None:
@@ -126,10 +303,14 @@ def livestatus(request):
             message = "%s: %s" % (type(e), str(e))
             add_notification(level="warning", notification_id="userdata problem", message=message)
 
-    livestatus = pynag.Parsers.MultiSite(
+    # Sockets are kept open between queries, close the ones nobody has used lately
+    connections.pool.evict_idle()
+
+    livestatus = connections.PooledMultiSite(
         nagios_cfg_file=adagios.settings.nagios_config,
         livestatus_socket_path=adagios.settings.livestatus_path,
-        authuser=authuser)
+        authuser=authuser,
+        query_cache=get_query_cache(request))
     
     for i in backends:
         livestatus.add_backend(path=i, name=i)
@@ -143,6 +324,70 @@ def query(request, *args, **kwargs):
     return l.query(*args, **kwargs)
 
 
+def _query_snapshot(l, query, order_by=None, count=None):
+    """ Same as l.query(query), except results may come from the shared snapshot cache.
+
+    If order_by is specified, results are sorted by it and if count is also
+    specified only the first count rows are returned.
+
+    See adagios.status.snapshots
+    """
+    def fetch():
+        if not order_by:
+            return l.query(query)
+        sort_key = _RowSortKey.factory(order_by)
+        if count:
+            return l.query_top(count, sort_key, query)
+        return sorted(l.query(query), key=sort_key)
+
+    key = snapshots.make_key(query.get_query(), l.authuser, sorted(l.backends), order_by, count)
+    return snapshots.get_or_fetch(key, fetch)
+
+
+def _query_compact(l, query, fields, order_by=None, count=None):
+    """ Same as _query_snapshot(), except the result is a columnar.Table.
+
+    When no snapshot cache or sorting is involved, rows are streamed straight
+    into the table so we never hold every row as a dict at the same time.
+    """
+    if order_by or adagios.settings.status_cache_ttl or not hasattr(l, 'query_stream'):
+        rows = _query_snapshot(l, query, order_by, count)
+    else:
+        rows = l.query_stream(query)
+    return columnar.Table.from_rows(rows, fields)
+
+
+class _RowSortKey(object):
+    """ Sort key for livestatus rows, that sorts on multiple columns in mixed directions.
+
+    Columns are compared with past.builtins.cmp, so rows where a column is
+    missing or has mixed types can still be sorted.
+    """
+
+    def __init__(self, row, order_by):
+        self.row = row
+        self.order_by = order_by
+
+    @classmethod
+    def factory(cls, order_by):
+        """ Returns a key function for sorted() and friends. order_by is a list like ['-state', 'host_name'] """
+        order_by = [(x.lstrip('-'), x.startswith('-')) for x in order_by]
+        return lambda row: cls(row, order_by)
+
+    def __lt__(self, other):
+        for column, descending in self.order_by:
+            result = cmp(self.row.get(column), other.row.get(column))
+            if result:
+                return result > 0 if descending else result < 0
+        return False
+
+
+def query_stream(request, *args, **kwargs):
+    """ Same as query(), except rows are yielded one at a time as they are read from livestatus """
+    l = livestatus(request)
+    return l.query_stream(*args, **kwargs)
+
+
 def get_hostgroups(request, *args, **kwargs):
     """ Get a list of hostgroups from mk_livestatus
     """
@@ -150,7 +395,59 @@ def get_hostgroups(request, *args, **kwargs):
     return l.get_hostgroups(*args, **kwargs)
 
 
+def get_by_names(request, table, names, *args, **kwargs):
+    """ Returns every row in livestatus table whose name is in names, fetched with one query
+
+    Arguments:
+        request: Django request object
+        table:   Livestatus table, for example 'hostgroups' or 'contacts'
+        names:   List of names to look up. Names that are not found are left out.
+
+        *args will be passed directly to livestatus, for example 'Columns: name alias'
+        **kwargs are passed to livestatus.query(), for example backend='...'
+
+    Returns:
+        List of dicts, in the same order as names. If a name is found in
+        more than one backend, the first one is returned.
+    """
+    names = [x for x in names if x]
+    if not names:
+        return []
+    query = ['GET %s' % table]
+    query += ['Filter: name = %s' % x for x in sorted(set(names))]
+    if len(set(names)) > 1:
+        query.append('Or: %s' % len(set(names)))
+    query += list(args)
+    l = livestatus(request)
+    found = {}
+    for row in l.query(*query, **kwargs):
+        found.setdefault(row['name'], row)
+    return [found[x] for x in names if x in found]
+
+
+def get_groups(request, group_type, names, *args, **kwargs):
+    """ Returns the hostgroups, servicegroups or contactgroups named in names, fetched with one query
+
+    Example:
+        get_groups(request, 'hostgroup', ['linux-servers', 'windows-servers'])
+
+    See get_by_names() for details
+    """
+    if group_type not in ('hostgroup', 'servicegroup', 'contactgroup'):
+        raise ValueError("group_type must be hostgroup, servicegroup or contactgroup, not %s" % group_type)
+    return get_by_names(request, group_type + 's', names, *args, **kwargs)
+
+
+# Columns add_statistics_to_hosts() needs to work on a columnar.Table in bulk
+_HOST_STATISTICS_COLUMNS = [
+    'num_services_ok', 'num_services_warn', 'num_services_crit', 'num_services_pending',
+    'num_services_unknown', 'services_with_state', 'state',
+]
+
+
 def add_statistics_to_hosts(result):
+    if isinstance(result, columnar.Table) and all(result.has_column(x) for x in _HOST_STATISTICS_COLUMNS):
+        return _add_statistics_to_host_table(result)
     # Add statistics to every hosts:
     for host in result:
         try:
@@ -190,6 +487,51 @@ def add_statistics_to_hosts(result):
             pass
 
 
+def _add_statistics_to_host_table(hosts):
+    """ Same as add_statistics_to_hosts() for a columnar.Table, one column at a time """
+    missing = columnar.MISSING
+    length = len(hosts)
+    ok = hosts.column('num_services_ok')
+    warn = hosts.column('num_services_warn')
+    crit = hosts.column('num_services_crit')
+    pending = hosts.column('num_services_pending')
+    unknown = hosts.column('num_services_unknown')
+
+    problems = [w + c + u for w, c, u in zip(warn, crit, unknown)]
+    hosts.set_column('num_problems', problems)
+    hosts.set_column('problems', problems)
+    hosts.set_column('children', hosts.column('services_with_state'))
+
+    # Pending hosts get state=3, see add_statistics_to_hosts()
+    last_state_change = hosts.column('last_state_change') if hosts.has_column('last_state_change') else [missing] * length
+    last_check = hosts.column('last_check') if hosts.has_column('last_check') else [missing] * length
+    states = [3 if lsc == 0 and lc == 0 else s
+              for s, lsc, lc in zip(hosts.column('state'), last_state_change, last_check)]
+    hosts.set_column('state', states)
+    hosts.set_column('status', [state[s] for s in states])
+
+    totals = [o + w + c + p + u for o, w, c, p, u in zip(ok, warn, crit, pending, unknown)]
+    hosts.set_column('total', totals)
+    health = []
+    percentages = dict((name, []) for name in ('percent_ok', 'percent_warn', 'percent_crit', 'percent_unknown', 'percent_pending'))
+    for i, total in enumerate(totals):
+        if not total:
+            health.append('n/a')
+            for values in percentages.values():
+                values.append(missing)
+            continue
+        total = float(total)
+        health.append(float(ok[i]) / total * 100.0)
+        percentages['percent_ok'].append(old_div(ok[i], total) * 100)
+        percentages['percent_warn'].append(old_div(warn[i], total) * 100)
+        percentages['percent_crit'].append(old_div(crit[i], total) * 100)
+        percentages['percent_unknown'].append(old_div(unknown[i], total) * 100)
+        percentages['percent_pending'].append(old_div(pending[i], total) * 100)
+    hosts.set_column('health', health)
+    for name, values in percentages.items():
+        hosts.set_column(name, values)
+
+
 def _search_multiple_attributes(search_query, attributes, value):
     """Adds search filter to search_query that allows searching for multiple attributes.
 
@@ -272,6 +614,57 @@ def _get_limit_from_kwargs(kwargs):
     return limit
 
 
+def _get_offset_from_kwargs(kwargs):
+    """Remove _OFFSET_KEYWORD from kwargs if present, and convert to int.
+
+    Returns:
+        Integer. 'offset' if it was inside kwargs, otherwise 0
+    """
+    offset = kwargs.pop(_OFFSET_KEYWORD, 0)
+    if isinstance(offset, list):
+        offset = offset[0]
+    return int(offset or 0)
+
+
+def _get_order_by_from_kwargs(kwargs):
+    """Remove _ORDER_BY_KEYWORD from kwargs if present.
+
+    Returns:
+        List of strings, like ['-state', 'host_name']. Empty list if there was no order_by in kwargs
+    """
+    order_by = kwargs.pop(_ORDER_BY_KEYWORD, None) or []
+    if isinstance(order_by, string_types):
+        order_by = order_by.split(',')
+    result = []
+    for i in order_by:
+        result += [x.strip() for x in i.split(',') if x.strip()]
+    return result
+
+
+def _get_compact_from_kwargs(kwargs):
+    """Remove _COMPACT_KEYWORD from kwargs if present.
+
+    Returns:
+        True if a compact columnar.Table was asked for, otherwise False
+    """
+    compact = kwargs.pop(_COMPACT_KEYWORD, False)
+    if isinstance(compact, list):
+        compact = compact[0]
+    if isinstance(compact, string_types):
+        compact = compact.lower() not in ('', '0', 'false', 'no')
+    return bool(compact)
+
+
+def _add_order_by_to_fields(fields, order_by):
+    """ Returns fields with every column we are sorting on added to it """
+    fields = list(fields)
+    for column in order_by:
+        column = column.lstrip('-')
+        if column not in fields:
+            fields.append(column)
+    return fields
+
+
 def get_hosts(request, fields=None, *args, **kwargs):
     """ Get a list of hosts from mk_livestatus
 
@@ -282,15 +675,22 @@ def get_hosts(request, fields=None, *args, **kwargs):
         fields: List of strings. Which fields should be present in our response. If undefined, use _DEFAULT_HOST_FIELDS
 
         *args will be passed directly to livestatus
-        **kwargs passed in will be converted to livestatus 'Filter:' strings
+        **kwargs passed in will be converted to livestatus 'Filter:' strings,
+          except limit, offset and order_by (e.g. order_by='-state,name') which control paging and sorting
 
     Returns:
         List of dicts. The output from livestatus query.
+        If compact=True is passed in, a columnar.Table is returned instead.
     """
     limit = _get_limit_from_kwargs(kwargs)
+    offset = _get_offset_from_kwargs(kwargs)
+    order_by = _get_order_by_from_kwargs(kwargs)
+    compact = _get_compact_from_kwargs(kwargs)
     query = _process_querystring_for_host(*args, **kwargs)
-    if limit:
-        query.set_limit(limit)
+
+    # Livestatus can not sort, so when sorting we need every matching row
+    if limit and not order_by:
+        query.set_limit(offset + limit)
     else:
         query.remove_limit()
 
@@ -307,18 +707,25 @@ def get_hosts(request, fields=None, *args, **kwargs):
 #    if isinstance(fields, six.string_types):
 #        fields = fields.split(',')
 
+    fields = _add_order_by_to_fields(fields, order_by)
     query.set_columns(*fields)
     l = livestatus(request)
-    hosts = l.query(query)
+    if compact:
+        hosts = _query_compact(l, query, fields, order_by, limit and offset + limit)
+    else:
+        hosts = _query_snapshot(l, query, order_by, limit and offset + limit)
 
     add_statistics_to_hosts(hosts)
-    
-    hosts.sort(reverse=True, key=cmp_to_key(lambda a, b: cmp(a.get('num_problems'), b.get('num_problems'))))
-    hosts.sort(reverse=True, key=cmp_to_key(lambda a, b: cmp(a.get('state'), b.get('state'))))
+
+    # By default, hosts with the worst state and most problems come first
+    if not order_by:
+        hosts.sort(key=_RowSortKey.factory(['-state', '-num_problems']))
 
     if limit:
-        return hosts[:limit]
-    return hosts
+        hosts = hosts[offset:offset + limit]
+    else:
+        hosts = hosts[offset:]
+    return _track_columns(request, 'hosts', fields, hosts)
 
 
 def _process_querystring_for_service(*args, **kwargs):
@@ -386,32 +793,89 @@ def get_services(request=None, fields=None, *args, **kwargs):
             fields: List of strings. If defined, collect these specific columns from livestatus. Otherwise a
               sane default from _DEFAULT_SERVICE_COLUMNS will be returned.
             *args will be passed directly to livestatus
-            **kwargs passed in will be converted to livestatus 'Filter:' strings
+            **kwargs passed in will be converted to livestatus 'Filter:' strings,
+              except limit, offset and order_by (e.g. order_by='-state,host_name') which control paging and sorting
 
         Returns:
             List of dicts. The output from livestatus query.
+            If compact=True is passed in, a columnar.Table is returned instead.
     """
     limit = _get_limit_from_kwargs(kwargs)
+    offset = _get_offset_from_kwargs(kwargs)
+    order_by = _get_order_by_from_kwargs(kwargs)
+    compact = _get_compact_from_kwargs(kwargs)
     query = _process_querystring_for_service(*args, **kwargs)
-    if limit:
-        query.set_limit(limit)
+
+    # Livestatus can not sort, so when sorting we need every matching row
+    if limit and not order_by:
+        query.set_limit(offset + limit)
     else:
         query.remove_limit()
 
     fields = fields or _DEFAULT_SERVICE_COLUMNS
     if not isinstance(fields, list):  # HACK, we still have web rest queries that reference us like this
         fields = fields.split()
+    fields = _add_order_by_to_fields(fields, order_by)
     query.set_columns(*fields)
 
     l = livestatus(request)
-    services = l.query(query)
+    if compact:
+        services = _query_compact(l, query, fields, order_by, limit and offset + limit)
+    else:
+        services = _query_snapshot(l, query, order_by, limit and offset + limit)
 
     # TODO: Can we get rid of this function in the future and workaround this another way ?
     _add_custom_tags_to_services(services)
 
     if limit:
-        return services[:limit]
-    return services
+        services = services[offset:offset + limit]
+    else:
+        services = services[offset:]
+    return _track_columns(request, 'services', fields, services)
+
+
+def get_services_stream(request=None, fields=None, *args, **kwargs):
+    """ Same as get_services(), except services are yielded one at a time as they are read from livestatus.
+
+    Use this when there are many services and the caller does not need all of
+    them in memory at the same time. Results are not cached, and if order_by
+    is specified we have to fetch everything anyway, so get_services() is
+    used in that case.
+    """
+    if kwargs.get(_ORDER_BY_KEYWORD):
+        for service in get_services(request, fields, *args, **kwargs):
+            yield service
+        return
+
+    limit = _get_limit_from_kwargs(kwargs)
+    offset = _get_offset_from_kwargs(kwargs)
+    _get_compact_from_kwargs(kwargs)  # Streamed rows are never held in memory at once anyway
+    query = _process_querystring_for_service(*args, **kwargs)
+    if limit:
+        query.set_limit(offset + limit)
+    else:
+        query.remove_limit()
+
+    fields = fields or _DEFAULT_SERVICE_COLUMNS
+    if not isinstance(fields, list):  # HACK, we still have web rest queries that reference us like this
+        fields = fields.split()
+    query.set_columns(*fields)
+
+    l = livestatus(request)
+    services = l.query_stream(query)
+    for service in itertools.islice(services, offset, offset + limit if limit else None):
+        _add_custom_tags_to_services([service])
+        yield service
+
+
+def get_services_count(request=None, *args, **kwargs):
+    """ Returns how many services get_services() would find with the same filters and no limit """
+    for keyword in (_LIMIT_KEYWORD, _OFFSET_KEYWORD, _ORDER_BY_KEYWORD, _COMPACT_KEYWORD):
+        kwargs.pop(keyword, None)
+    query = _process_querystring_for_service(*args, **kwargs)
+    l = livestatus(request)
+    result = l.query(query, 'Stats: state >= 0')
+    return result[0] if result else 0
 
 
 def _add_custom_tags_to_services(services):
@@ -419,8 +883,11 @@ def _add_custom_tags_to_services(services):
 
     Args:
         services. List of dict. Usually the output from a livestatus query.
+          Can also be a columnar.Table, which is then tagged one column at a time.
 
     """
+    if isinstance(services, columnar.Table) and all(services.has_column(x) for x in _SERVICE_TAG_COLUMNS):
+        return _add_custom_tags_to_service_table(services)
     # Add custom tags to our service list
     try:
         for service in services:
@@ -451,6 +918,54 @@ def _add_custom_tags_to_services(services):
     return services
 
 
+# Columns _add_custom_tags_to_services() needs to work on a columnar.Table in bulk
+_SERVICE_TAG_COLUMNS = ['state', 'acknowledged', 'downtimes', 'host_downtimes']
+
+
+def _add_custom_tags_to_service_table(services):
+    """ Same as _add_custom_tags_to_services() for a columnar.Table, one column at a time """
+    missing = columnar.MISSING
+    length = len(services)
+    last_state_change = services.column('last_state_change') if services.has_column('last_state_change') else [missing] * length
+    states = []
+    tags = []
+    unhandled = []
+    handled = []
+    for service_state, acknowledged, downtimes, host_downtimes, lsc in zip(
+            services.column('state'), services.column('acknowledged'), services.column('downtimes'),
+            services.column('host_downtimes'), last_state_change):
+        service_tags = []
+        is_unhandled = is_handled = missing
+        if service_state != 0:
+            service_tags.append('problem')
+            service_tags.append('problems')
+            if acknowledged == 0 and downtimes == [] and host_downtimes == []:
+                service_tags.append('unhandled')
+                is_unhandled = "unhandled"
+            else:
+                service_tags.append('ishandled')
+                is_handled = "handled"
+        elif lsc == 0:
+            service_state = 3
+            service_tags.append('pending')
+        else:
+            service_tags.append('ok')
+        if acknowledged == 1:
+            service_tags.append('acknowledged')
+        if downtimes != []:
+            service_tags.append('downtime')
+        states.append(service_state)
+        tags.append(' '.join(service_tags))
+        unhandled.append(is_unhandled)
+        handled.append(is_handled)
+    services.set_column('state', states)
+    services.set_column('unhandled', unhandled)
+    services.set_column('handled', handled)
+    services.set_column('tags', tags)
+    services.set_column('status', [state[x] for x in states])
+    return services
+
+
 def get_contacts(request, *args, **kwargs):
     l = livestatus(request)
     return l.get_contacts(*args, **kwargs)
@@ -461,29 +976,85 @@ def get_contactgroups(request, *args, **kwargs):
     return l.get_contactgroups(*args, **kwargs)
 
 
+# Counters computed by get_statistics(). Every counter is either one Stats: line,
+# or several Stats: lines that are combined with StatsAnd:, so all counters of
+# one table are fetched with a single query.
+_HOST_STATISTICS = [
+    ('hosts_up', ['Stats: state = 0']),
+    ('hosts_down', ['Stats: state = 1']),
+    ('hosts_unreachable', ['Stats: state = 2']),
+    ('hosts_problems', ['Stats: state != 0']),
+    ('hosts_unhandled', ['Stats: state = 1', 'Stats: acknowledged = 0', 'Stats: scheduled_downtime_depth = 0']),
+    ('hosts_unhandled_navbar', ['Stats: state != 0', 'Stats: acknowledged = 0', 'Stats: scheduled_downtime_depth = 0',
+                                'Stats: host_state = 1']),
+    ('network_parents', ['Stats: childs != ', 'Stats: state >= 0']),
+    ('network_problems', ['Stats: childs != ', 'Stats: state > 0']),
+    ('network_unhandled', ['Stats: childs != ', 'Stats: state = 1', 'Stats: acknowledged = 0',
+                           'Stats: scheduled_downtime_depth = 0']),
+]
+
+_SERVICE_STATISTICS = [
+    ('services_ok', ['Stats: state = 0']),
+    ('services_warning', ['Stats: state = 1']),
+    ('services_critical', ['Stats: state = 2']),
+    ('services_unknown', ['Stats: state = 3']),
+    ('services_problems', ['Stats: state != 0']),
+    ('services_unhandled', ['Stats: state > 0', 'Stats: acknowledged = 0', 'Stats: scheduled_downtime_depth = 0',
+                            'Stats: host_state = 0']),
+    ('services_unhandled_everywhere', ['Stats: state != 0', 'Stats: acknowledged = 0', 'Stats: host_acknowledged = 0',
+                                      'Stats: scheduled_downtime_depth = 0', 'Stats: host_scheduled_downtime_depth = 0']),
+    ('services_unhandled_everywhere_host_down', ['Stats: state != 0', 'Stats: acknowledged = 0',
+                                                 'Stats: host_acknowledged = 0', 'Stats: scheduled_downtime_depth = 0',
+                                                 'Stats: host_scheduled_downtime_depth = 0', 'Stats: host_state != 0']),
+]
+
+
+def _get_stats(l, table, counters, arguments):
+    """ Fetch all counters of one table with a single livestatus query.
+
+    Arguments:
+        l         -- livestatus instance, see livestatus()
+        table     -- Name of the livestatus table, e.g. "hosts"
+        counters  -- List of (name, [Stats: lines]) tuples, like _HOST_STATISTICS
+        arguments -- List of Filter: lines that apply to every counter
+
+    Returns:
+        dict. Counter name -> integer
+    """
+    query = list(arguments)
+    for name, conditions in counters:
+        query += conditions
+        if len(conditions) > 1:
+            query.append('StatsAnd: %s' % len(conditions))
+    result = l.query('GET %s' % table, *query) or []
+    names = [name for name, conditions in counters]
+    if len(result) != len(names):
+        result = [0] * len(names)
+    return dict(list(zip(names, result)))
+
+
 def get_statistics(request, *args, **kwargs):
     """ Return a list of dict. That contains various statistics from mk_livestatus (like service totals and host totals)
+
+    Also contains the problem counters that the navigation bar shows (num_problems_all,
+    num_problems_unhandled, tagged_comments, etc). Everything is fetched with one
+    query per livestatus table.
     """
     c = {}
     l = livestatus(request)
     arguments = pynag.Utils.grep_to_livestatus(*args, **kwargs)
 
+    hosts = _get_stats(l, 'hosts', _HOST_STATISTICS, arguments)
+    services = _get_stats(l, 'services', _SERVICE_STATISTICS, arguments)
+
     # Get service totals as an array of [ok,warn,crit,unknown]
-    c['service_totals'] = l.get_services(
-        'Stats: state = 0',
-        'Stats: state = 1',
-        'Stats: state = 2',
-        'Stats: state = 3',
-        *arguments
-    ) or [0, 0, 0, 0]
+    c['service_totals'] = [
+        services['services_ok'], services['services_warning'],
+        services['services_critical'], services['services_unknown'],
+    ]
 
     # Get host totals as an array of [up,down,unreachable]
-    c['host_totals'] = l.get_hosts(
-        'Stats: state = 0',
-        'Stats: state = 1',
-        'Stats: state = 2',
-        *arguments
-    ) or [0, 0, 0]
+    c['host_totals'] = [hosts['hosts_up'], hosts['hosts_down'], hosts['hosts_unreachable']]
 
     # Get total number of host/ host_problems
     c['total_hosts'] = sum(c['host_totals'])
@@ -502,42 +1073,29 @@ def get_statistics(request, *args, **kwargs):
         c['host_totals_percent'] = [float(old_div(100.0 * x, c['total_hosts'])) for x in c['host_totals']]
     except ZeroDivisionError:
         c['host_totals_percent'] = [0, 0, 0, 0]
-    
-    unhandled_services = l.get_services(
-        'Stats: state > 0',
-        acknowledged=0,
-        scheduled_downtime_depth=0,
-        host_state=0,
-        *arguments
-    ) or [0]
-
-    unhandled_hosts = l.get_hosts(
-        'Stats: state = 1',
-        acknowledged=0,
-        scheduled_downtime_depth=0,
-        *arguments
-    ) or [0]
-
-    c['unhandled_services'] = unhandled_services[0]
-    c['unhandled_hosts'] = unhandled_hosts[0]
-
-    total_unhandled_network_problems = l.get_hosts(
-        'Filter: childs != ',
-        'Stats: state = 1',
-        acknowledged=0,
-        scheduled_downtime_depth=0,
-        *arguments
-    ) or [0]
-    c['total_unhandled_network_problems'] = total_unhandled_network_problems[0]
-
-    tmp = l.get_hosts(
-        'Filter: childs != ',
-        'Stats: state >= 0',
-        'Stats: state > 0',
-        *arguments
-    ) or [0, 0]
-
-    c['total_network_parents'], c['total_network_problems'] = tmp
+
+    c['unhandled_services'] = services['services_unhandled']
+    c['unhandled_hosts'] = hosts['hosts_unhandled']
+    c['total_unhandled_network_problems'] = hosts['network_unhandled']
+    c['total_network_parents'] = hosts['network_parents']
+    c['total_network_problems'] = hosts['network_problems']
+
+    # Counters for the navigation bar
+    c['num_service_problems_all'] = services['services_problems']
+    c['num_service_problems_unhandled'] = services['services_unhandled']
+    c['num_host_problems_all'] = hosts['hosts_problems']
+    c['num_host_problems_unhandled'] = hosts['hosts_unhandled_navbar']
+    c['num_problems_all'] = c['num_service_problems_all'] + c['num_host_problems_all']
+    c['num_problems_unhandled'] = c['num_service_problems_unhandled'] + c['num_host_problems_unhandled']
+    c['num_problems'] = c['num_problems_unhandled']
+    c['num_unhandled_problems'] = services['services_unhandled_everywhere'] + \
+        services['services_unhandled_everywhere_host_down']
+
+    c['tagged_comments'] = 0
+    if request is not None:
+        remote_user = request.META.get('REMOTE_USER', 'anonymous')
+        comments = _get_stats(l, 'comments', [('tagged', ['Stats: comment ~ %s' % remote_user])], [])
+        c['tagged_comments'] = comments['tagged']
     return c
 
 
@@ -563,3 +1121,17 @@ def get_state_history(request, *args, **kwargs):
         return []
     log = pynag.Parsers.LogFiles(maincfg=adagios.settings.nagios_config)
     return log.get_state_history(*args, **kwargs)
+
+
+def get_sla_report(request, start_time, end_time):
+    """ Get availability of every host and service between start_time and end_time
+
+    See adagios.status.sla.SlaRollups.get_report()
+
+    Returns:
+        List of dicts, one for every host and service
+    """
+    if not adagios.settings.enable_local_logs:
+        return []
+    from adagios.status import sla
+    return sla.rollups.get_report(start_time, end_time)
@@ -25,7 +25,7 @@ from future.utils import string_types
 from builtins import str
 from builtins import map
 from past.utils import old_div
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from functools import cmp_to_key
 
 import time
@@ -50,6 +50,10 @@ import adagios.settings
 from adagios.pnp.functions import run_pnp
 from adagios.status import utils
 import adagios.status.rest
+import adagios.status.health
+import adagios.status.counters
+import adagios.status.topology
+import adagios.status.hostgroups
 import adagios.status.forms
 import adagios.businessprocess
 from django.core.urlresolvers import reverse
@@ -102,24 +106,21 @@ def network_parents(request):
     c = {}
     c['messages'] = []
     hosts = utils.get_hosts(request, **request.GET)
-    host_dict = {}
-    list(map(lambda x: host_dict.__setitem__(x['name'], x), hosts))
+    # hosts is cut at livestatus_limit, the topology needs every host there is
+    topology = adagios.status.topology.get_topology(request)
+    c['root_causes'] = topology.get_root_causes()
     c['hosts'] = []
 
     for i in hosts:
         if i['childs']:
 
             c['hosts'].append(i)
-            ok = 0
-            crit = 0
-            i['child_hosts'] = []
-            for x in i['childs']:
-                i['child_hosts'].append(host_dict[x])
-                if host_dict[x]['state'] == 0:
-                    ok += 1
-                else:
-                    crit += 1
-            total = float(len(i['childs']))
+            i['child_hosts'] = topology.get_hosts(i['childs'])
+            i['blast_radius'] = len(topology.get_blast_radius(i['name']))
+            i['root_cause'] = i['name'] in c['root_causes']
+            ok = len([x for x in i['child_hosts'] if x['state'] == 0])
+            crit = len(i['child_hosts']) - ok
+            total = float(len(i['child_hosts']) or 1)
             i['health'] = float(ok) / total * 100.0
             i['percent_ok'] = old_div(ok, total) * 100
             i['percent_crit'] = old_div(crit, total) * 100
@@ -145,7 +146,9 @@ def services(request):
     fields = [
         'host_name', 'description', 'plugin_output', 'last_check', 'host_state', 'state',
         'last_state_change', 'acknowledged', 'downtimes', 'host_downtimes', 'comments_with_info']
-    c['services'] = utils.get_services(request, fields=fields, **request.GET)
+    search_filter = request.GET.copy()
+    search_filter['compact'] = True  # This list can be very long, keep it small in memory
+    c['services'] = utils.get_services(request, fields=fields, **search_filter)
     return render_to_response('status_services.html', c, context_instance=RequestContext(request))
 
 @adagios_decorator
@@ -157,7 +160,10 @@ def services_js(request):
     fields = [
         'host_name', 'description', 'plugin_output', 'last_check', 'host_state', 'state',
         'last_state_change', 'acknowledged', 'downtimes', 'host_downtimes', 'comments_with_info']
-    c['services'] = json.dumps(utils.get_services(request, fields=fields, **request.GET))
+    search_filter = request.GET.copy()
+    # A compact columnar.Table can not be serialized
+    search_filter.pop('compact', None)
+    c['services'] = json.dumps(utils.get_services(request, fields=fields, **search_filter))
     return render_to_response('status_services_js.html', c, context_instance=RequestContext(request))
 
 
@@ -355,11 +361,19 @@ def service_detail(request, host_name, service_description):
     return render_to_response('status_detail.html', c, context_instance=RequestContext(request))
 
 
+# Columns of network parents on the host detail page
+_NETWORK_PARENT_COLUMNS = ['name', 'state', 'parents']
+
+
 def _get_network_parents(request, host_name):
     """ Returns a list of hosts that are network parents (or grandparents) to host_name
 
      Every item in the list is a host dictionary from mk_livestatus
 
+     Parents are fetched with one query per level of the tree. If the
+     network topology of this user is already known (see adagios.status.topology)
+     every parent is fetched with a single query.
+
      Returns:
         List of lists
 
@@ -373,26 +387,39 @@ def _get_network_parents(request, host_name):
     result = []
     backend = request.GET.get('backend', None)
     livestatus = adagios.status.utils.livestatus(request)
-    if isinstance(u'host_name', str):
-        host_name = smart_str(host_name)
 
-    if isinstance(u'host_name', str):
-        host = livestatus.get_host(host_name, backend)
-    elif isinstance(u'host_name', dict):
+    if isinstance(host_name, dict):
         host = host_name
+    elif isinstance(host_name, string_types):
+        host = livestatus.get_host(smart_str(host_name), backend)
     else:
         raise KeyError(
             'host_name must be str or dict (got %s)' % type(host_name))
-    parent_names = host['parents']
+
+    columns = 'Columns: %s' % ' '.join(_NETWORK_PARENT_COLUMNS)
+    fetched = {}
+    topology = adagios.status.topology.get_cached_topology(request)
+    if topology is not None:
+        ancestors = topology.get_ancestors(host['name'])
+        for row in utils.get_by_names(request, 'hosts', ancestors, columns, backend=backend):
+            fetched[row['name']] = row
+
+    seen = set([host['name']])
+    parent_names = set(host['parents'])
     while len(parent_names) > 0:
-        parents = [livestatus.get_host(x, backend) for x in parent_names]
+        # The topology may be out of date, anything it missed is fetched here
+        missing = [x for x in parent_names if x not in fetched]
+        for row in utils.get_by_names(request, 'hosts', missing, columns, backend=backend):
+            fetched[row['name']] = row
+        parents = [fetched[x] for x in sorted(parent_names) if x in fetched]
+        seen.update(parent_names)
 
         # generate a list of grandparent names:
         grand_parents = set()
         for i in parents:
-            list(map(lambda x: grand_parents.add(x), i.get('parents')))
+            grand_parents.update(i.get('parents') or [])
         result.append(parents)
-        parent_names = list(grand_parents)
+        parent_names = grand_parents - seen
     return result
 
 
@@ -404,62 +431,23 @@ def hostgroup_detail(request, hostgroup_name):
     c['errors'] = []
     c['hostgroup_name'] = hostgroup_name
     c['object_type'] = 'hostgroup'
-    livestatus = adagios.status.utils.livestatus(request)
-    my_hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname(hostgroup_name.decode('utf-8'))
-    c['my_hostgroup'] = livestatus.get_hostgroups('Filter: name = %s' % hostgroup_name.decode('utf-8'))[0]
-    _add_statistics_to_hostgroups([c['my_hostgroup']])
-    
-    # Get information about child hostgroups
-    try:
-        subgroups = my_hostgroup.hostgroup_members or ''
-        subgroups = subgroups.split(',')
-        if subgroups == ['']:
-            subgroups = []
-        c['hostgroups'] = [livestatus.get_hostgroups('Filter: name = %s' % x)[0] for x in subgroups]
-        _add_statistics_to_hostgroups(c['hostgroups'])
-    except Exception as e:
-        c['errors'].append(e)
+    hostgroup_name = hostgroup_name.decode('utf-8')
+
+    # Our hostgroup and all of its child hostgroups come back in one query
+    subgroups = sorted(adagios.status.hostgroups.get_tree().get_children(hostgroup_name))
+    hostgroups = utils.get_groups(request, 'hostgroup', [hostgroup_name] + subgroups)
+    if not hostgroups or hostgroups[0]['name'] != hostgroup_name:
+        raise Exception(_("Hostgroup %s was not found") % hostgroup_name)
+    c['my_hostgroup'] = hostgroups[0]
+    c['hostgroups'] = hostgroups[1:]
+    _add_statistics_to_hostgroups(hostgroups)
     return render_to_response('status_hostgroup.html', c, context_instance=RequestContext(request))
 
 
 def _add_statistics_to_hostgroups(hostgroups):
     """ Enriches a list of hostgroup dicts with information about subgroups and parentgroups
     """
-    # Lets establish a good list of all hostgroups and parentgroups
-    all_hostgroups = pynag.Model.Hostgroup.objects.all
-    all_subgroups = set()  # all hostgroups that belong in some other hostgroup
-    # "subgroup":['master1','master2']
-    hostgroup_parentgroups = defaultdict(set)
-    hostgroup_childgroups = pynag.Model.ObjectRelations.hostgroup_hostgroups
-
-    for hostgroup, subgroups in list(hostgroup_childgroups.items()):
-        list(map(lambda x: hostgroup_parentgroups[x].add(hostgroup), subgroups))
-
-    for i in hostgroups:
-        i['child_hostgroups'] = hostgroup_childgroups[i['name']]
-        i['parent_hostgroups'] = hostgroup_parentgroups[i['name']]
-
-    # Extra statistics for our hostgroups
-    for hg in hostgroups:
-        ok = hg.get('num_services_ok')
-        warn = hg.get('num_services_warn')
-        crit = hg.get('num_services_crit')
-        pending = hg.get('num_services_pending')
-        unknown = hg.get('num_services_unknown')
-        total = ok + warn + crit + pending + unknown
-        hg['total'] = total
-        hg['problems'] = warn + crit + unknown
-        try:
-            total = float(total)
-            hg['health'] = float(ok) / total * 100.0
-            hg['health'] = float(ok) / total * 100.0
-            hg['percent_ok'] = old_div(ok, total) * 100
-            hg['percent_warn'] = old_div(warn, total) * 100
-            hg['percent_crit'] = old_div(crit, total) * 100
-            hg['percent_unknown'] = old_div(unknown, total) * 100
-            hg['percent_pending'] = old_div(pending, total) * 100
-        except ZeroDivisionError:
-            pass
+    adagios.status.hostgroups.add_statistics(hostgroups)
 
 
 @adagios_decorator
@@ -476,34 +464,28 @@ def status_servicegroups(request):
     return render_to_response('status_servicegroups.html', c, context_instance=RequestContext(request))
 
 
+# Columns status_hostgroups() needs to calculate health of every host
+_STATUS_HOSTGROUPS_HOST_COLUMNS = [
+    'name', 'num_services_ok', 'num_services_warn', 'num_services_crit',
+    'num_services_pending', 'num_services_unknown',
+]
+
+
 @adagios_decorator
 def status_hostgroups(request):
     c = {}
     c['messages'] = []
     c['errors'] = []
     hostgroup_name = None
-    livestatus = utils.livestatus(request)
-    hostgroups = livestatus.get_hostgroups()
     c['hostgroup_name'] = hostgroup_name
     c['request'] = request
 
-    # Lets establish a good list of all hostgroups and parentgroups
-    all_hostgroups = pynag.Model.Hostgroup.objects.all
-    all_subgroups = set()  # all hostgroups that belong in some other hostgroup
-    # "subgroup":['master1','master2']
-    hostgroup_parentgroups = defaultdict(set)
-    hostgroup_childgroups = pynag.Model.ObjectRelations.hostgroup_hostgroups
-
-    for hostgroup, subgroups in list(hostgroup_childgroups.items()):
-        list(map(lambda x: hostgroup_parentgroups[x].add(hostgroup), subgroups))
-
-    for i in hostgroups:
-        i['child_hostgroups'] = hostgroup_childgroups[i['name']]
-        i['parent_hostgroups'] = hostgroup_parentgroups[i['name']]
+    # Counts, subgroups and parentgroups of every hostgroup
+    hostgroups = adagios.status.hostgroups.get_hostgroups(request)
 
     if hostgroup_name is None:
         # If no hostgroup was specified. Lets only show "root hostgroups"
-        c['hosts'] = livestatus.get_hosts()
+        c['hosts'] = []
         my_hostgroups = []
         for i in hostgroups:
             if len(i['parent_hostgroups']) == 0:
@@ -512,10 +494,7 @@ def status_hostgroups(request):
         c['hostgroups'] = my_hostgroups
 
     else:
-        my_hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname(
-            hostgroup_name)
-        subgroups = my_hostgroup.hostgroup_members or ''
-        subgroups = subgroups.split(',')
+        subgroups = adagios.status.hostgroups.get_tree().get_children(hostgroup_name)
         # Strip out any group that is not a subgroup of hostgroup_name
         right_hostgroups = []
         for group in hostgroups:
@@ -524,48 +503,11 @@ def status_hostgroups(request):
         c['hostgroups'] = right_hostgroups
 
         # If a hostgroup was specified lets also get all the hosts for it
-        c['hosts'] = livestatus.query(
-            'GET hosts', 'Filter: host_groups >= %s' % hostgroup_name)
+        c['hosts'] = utils.get_hosts(request, 'Filter: host_groups >= %s' % hostgroup_name,
+                                     fields=_STATUS_HOSTGROUPS_HOST_COLUMNS, limit=0)
     for host in c['hosts']:
-        ok = host.get('num_services_ok')
-        warn = host.get('num_services_warn')
-        crit = host.get('num_services_crit')
-        pending = host.get('num_services_pending')
-        unknown = host.get('num_services_unknown')
-        total = ok + warn + crit + pending + unknown
-        host['total'] = total
-        host['problems'] = warn + crit + unknown
-        try:
-            total = float(total)
-            host['health'] = float(ok) / total * 100.0
-            host['percent_ok'] = old_div(ok, total) * 100
-            host['percent_warn'] = old_div(warn, total) * 100
-            host['percent_crit'] = old_div(crit, total) * 100
-            host['percent_unknown'] = old_div(unknown, total) * 100
-            host['percent_pending'] = old_div(pending, total) * 100
-        except ZeroDivisionError:
-            host['health'] = 'n/a'
-    # Extra statistics for our hostgroups
-    for hg in c['hostgroups']:
-        ok = hg.get('num_services_ok')
-        warn = hg.get('num_services_warn')
-        crit = hg.get('num_services_crit')
-        pending = hg.get('num_services_pending')
-        unknown = hg.get('num_services_unknown')
-        total = ok + warn + crit + pending + unknown
-        hg['total'] = total
-        hg['problems'] = warn + crit + unknown
-        try:
-            total = float(total)
-            hg['health'] = float(ok) / total * 100.0
-            hg['health'] = float(ok) / total * 100.0
-            hg['percent_ok'] = old_div(ok, total) * 100
-            hg['percent_warn'] = old_div(warn, total) * 100
-            hg['percent_crit'] = old_div(crit, total) * 100
-            hg['percent_unknown'] = old_div(unknown, total) * 100
-            hg['percent_pending'] = old_div(pending, total) * 100
-        except ZeroDivisionError:
-            pass
+        adagios.status.hostgroups.add_health(host)
+        host.setdefault('health', 'n/a')
     return render_to_response('status_hostgroups.html', c, context_instance=RequestContext(request))
 
 
@@ -694,23 +636,34 @@ def test_livestatus(request):
     return render_to_response('test_livestatus.html', c, context_instance=RequestContext(request))
 
 
+# Columns _status_combined() needs to find outages
+_STATUS_COMBINED_HOST_COLUMNS = ['name', 'state', 'acknowledged', 'downtimes', 'childs', 'parents']
+_STATUS_COMBINED_SERVICE_COLUMNS = ['host_name', 'description', 'state', 'acknowledged', 'downtimes', 'host_state']
+
+# Extra columns for displaying the problems, skipped in optimized mode
+_STATUS_COMBINED_EXTRA_HOST_COLUMNS = [
+    'plugin_output', 'last_check', 'last_state_change', 'address', 'scheduled_downtime_depth', 'comments_with_info',
+]
+_STATUS_COMBINED_EXTRA_SERVICE_COLUMNS = [
+    'plugin_output', 'last_check', 'last_state_change', 'scheduled_downtime_depth', 'host_downtimes',
+    'comments_with_info',
+]
+
+
 def _status_combined(request, optimized=False):
     """ Returns a combined status of network outages, host problems and service problems
 
     If optimized is True, fewer attributes are loaded it, makes it run faster but with less data
     """
     c = {}
-    livestatus = adagios.status.utils.livestatus(request)
     if optimized == True:
-        hosts = livestatus.get_hosts(
-            'Columns: name state acknowledged downtimes childs parents')
-        services = livestatus.get_services(
-            'Columns: host_name description state acknowledged downtimes host_state')
+        host_columns = _STATUS_COMBINED_HOST_COLUMNS
+        service_columns = _STATUS_COMBINED_SERVICE_COLUMNS
     else:
-        hosts = livestatus.get_hosts()
-        services = livestatus.get_services()
-    hosts_that_are_down = []
-    hostnames_that_are_down = []
+        host_columns = _STATUS_COMBINED_HOST_COLUMNS + _STATUS_COMBINED_EXTRA_HOST_COLUMNS
+        service_columns = _STATUS_COMBINED_SERVICE_COLUMNS + _STATUS_COMBINED_EXTRA_SERVICE_COLUMNS
+    hosts = utils.get_hosts(request, fields=host_columns, limit=0)
+    services = utils.get_services(request, fields=service_columns, limit=0)
     service_status = [0, 0, 0, 0]
     host_status = [0, 0, 0, 0]
     parents = []
@@ -718,24 +671,12 @@ def _status_combined(request, optimized=False):
         host_status[host["state"]] += 1
         if len(host['childs']) > 0:
             parents.append(host)
-        if host['state'] != 0 and host['acknowledged'] == 0 and host['downtimes'] == []:
-            hostnames_that_are_down.append(host['name'])
-            hosts_that_are_down.append(host)
 
-    network_problems = []
-    host_problems = []
+    # Hosts that are down because a parent is down are not problems of their own
+    topology = adagios.status.topology.get_topology(request, hosts=hosts)
+    network_problems, host_problems = topology.get_outages()
     service_problems = []
 
-    # Do nothing if host parent is also down.
-    for host in hosts_that_are_down:
-        for i in host['parents']:
-            if i in hostnames_that_are_down:
-                break
-        else:
-            if len(host['childs']) == 0:
-                host_problems.append(host)
-            else:
-                network_problems.append(host)
     for service in services:
         service_status[service["state"]] += 1
         if service['state'] != 0 and service['acknowledged'] == 0 and len(service['downtimes']) == 0 and service['host_state'] == 0:
@@ -804,17 +745,9 @@ def state_history(request):
         start_time = end_time - seconds_today
     start_time = int(start_time)
 
-    c['log'] = log = utils.get_state_history(request, start_time=start_time, end_time=end_time,strict=False)
     total_duration = end_time - start_time
     c['total_duration'] = total_duration
-    css_hint = {}
-    css_hint[0] = 'success'
-    css_hint[1] = 'warning'
-    css_hint[2] = 'danger'
-    css_hint[3] = 'info'
-    last_item = None
 
-    services = {}
     search_filter = request.GET.copy()
     search_filter.pop('start_time', None)
     search_filter.pop('end_time', None)
@@ -824,64 +757,21 @@ def state_history(request):
     search_filter.pop('end_hours', None)
     search_filter.pop('submit', None)
 
-    log = pynag.Utils.grep(log, **search_filter)
-    for i in log:
-        short_name = "%s/%s" % (i['host_name'], i['service_description'])
-        if short_name not in services:
-            s = {}
-            s['host_name'] = i['host_name']
-            s['service_description'] = i['service_description']
-            s['log'] = []
-            s['worst_logfile_state'] = 0
-            #s['log'] = [{'time':start_time,'state':3, 'plugin_output':'Unknown value here'}]
-            services[short_name] = s
-
-        services[short_name]['log'].append(i)
-        services[short_name]['worst_logfile_state'] = max(
-            services[short_name]['worst_logfile_state'], i['state'])
-    for service in list(services.values()):
-        last_item = None
-        service['sla'] = float(0)
-        service['num_problems'] = 0
-        service['duration'] = 0
-        for i in service['log']:
-            i['bootstrap_status'] = css_hint[i['state']]
-            if i['time'] < start_time:
-                i['time'] = start_time
-            if last_item is not None:
-                last_item['end_time'] = i['time']
-                #last_item['time'] = max(last_item['time'], start_time)
-                last_item['duration'] = duration = last_item[
-                    'end_time'] - last_item['time']
-                last_item['duration_percent'] = 100 * float(
-                    duration) / total_duration
-                service['duration'] += last_item['duration_percent']
-                if last_item['state'] == 0:
-                    service['sla'] += last_item['duration_percent']
-                else:
-                    service['num_problems'] += 1
-            last_item = i
-        if not last_item is None:
-            last_item['end_time'] = end_time
-            last_item['duration'] = duration = last_item[
-                'end_time'] - last_item['time']
-            last_item['duration_percent'] = old_div(100 * duration, total_duration)
-            service['duration'] += last_item['duration_percent']
-            if last_item['state'] == 0:
-                service['sla'] += last_item['duration_percent']
-            else:
-                service['num_problems'] += 1
+    # Whole days come from the daily rollups, only the days at either end are read from the logs
+    report = utils.get_sla_report(request, start_time=start_time, end_time=end_time)
+    report = pynag.Utils.grep(report, **search_filter)
+
     live_services = livestatus.get_services("Columns: host_name description")
 
     # Convert live services into "host_name/description" strings:
-    live_service_names = ["%s/%s" % (x['host_name'], x['description']) for x in live_services]
-
-    # Collect a list of service_names that are in our log, but not in livestatus:
-    dead_service_names = [x for x in services if x not in live_service_names]
+    live_service_names = set("%s/%s" % (x['host_name'], x['description']) for x in live_services)
 
-    # Remove all dead service names from state history:
-    for short_name in dead_service_names:
-        services.pop(short_name)
+    # Leave out services that are in our log, but not in livestatus:
+    services = {}
+    for service in report:
+        short_name = "%s/%s" % (service['host_name'], service['service_description'])
+        if short_name in live_service_names:
+            services[short_name] = service
 
     c['services'] = services
     c['start_time'] = start_time
@@ -1067,8 +957,8 @@ def contact_detail(request, contact_name):
 @adagios_decorator
 def map_view(request):
     c = {}
-    livestatus = adagios.status.utils.livestatus(request)
-    c['hosts'] = livestatus.get_hosts()
+    # The map itself is filled in by status.rest.get_map_data, we only list host names
+    c['hosts'] = utils.get_hosts(request, fields=['name'], limit=0)
     c['map_center'] = adagios.settings.map_center
     c['map_zoom'] = adagios.settings.map_zoom
 
@@ -1130,11 +1020,7 @@ def contactgroup_detail(request, contactgroup_name):
         'GET hosts', "Filter: contact_groups >= %s" % contactgroup_name.decode('utf-8'))
 
     # Members of this contactgroup
-    contacts = []
-    for contact_name in contactgroup['members']:
-        contact = l.get_contact(contact_name)
-        contacts.append(contact)
-    c['contacts'] = contacts
+    c['contacts'] = utils.get_by_names(request, 'contacts', contactgroup['members'])
 
     return render_to_response('status_contactgroup.html', c, context_instance=RequestContext(request))
 
@@ -1221,5 +1107,22 @@ def backends(request):
     livestatus = adagios.status.utils.livestatus(request)
     backends = livestatus.get_backends()
     for i, v in list(backends.items()):
-        v.test(raise_error=False)
+        v.health = adagios.status.health.monitor.get(v.livestatus_socket_path)
+        if v.health and v.health['consecutive_failures']:
+            v.error = v.health['last_error']
+        elif not v.health:
+            v.test(raise_error=False)
     return render_to_response('status_backends.html', locals(), context_instance=RequestContext(request))
+
+
+@adagios_decorator
+def counters(request):
+    """ Streams navbar counters to the browser as Server-Sent Events, see adagios.status.counters """
+    stream = adagios.status.counters.event_stream(request)
+    if stream is None:
+        # Browsers do not reconnect after 204, counters are then updated on page loads only
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.conf.urls import url, patterns, include
+import adagios
 from adagios import settings
 from django.views.static import serve
 
@@ -56,3 +57,5 @@ if settings.DEBUG:
 # from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 #urlpatterns += staticfiles_urlpatterns()
 
+# Plugins in settings.plugins. Their urls are only imported when visited.
+adagios.activate_plugins()
@@ -19,12 +19,36 @@
 
 from __future__ import absolute_import
 from builtins import object
+import copy
 import os
 import json
 import collections
+import tempfile
+import threading
 
 from . import settings
 
+# Preferences of every user this process has seen, so we only parse a
+# preference file again when it changes on disk.
+# conffile -> (stat of conffile, preferences)
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Folders we know exist, so we don't have to check every time
+_checked_folders = set()
+
+# With autosave, changes made within this many seconds are saved together
+_AUTOSAVE_DELAY = 1.0
+
+
+def _stat(filename):
+    """ Returns something that changes whenever filename is modified or replaced, None if it does not exist """
+    try:
+        st = os.stat(filename)
+        return st.st_ino, st.st_mtime, st.st_size
+    except OSError:
+        return None
+
 
 class User(object):
     """ Handles authentified users, provides preferences management. """
@@ -55,6 +79,8 @@ class User(object):
         """ Checks the userdata folder, try to create it if it doesn't
         exist."""
         folder = os.path.dirname(path)
+        if folder in _checked_folders:
+            return
         # does the folder exist?
         if not os.path.isdir(folder):
             try:
@@ -62,6 +88,7 @@ class User(object):
             except:
                 raise Exception("Folder %s can't be created. Be sure Adagios "
                                 "has write access on its parent." % folder)
+        _checked_folders.add(folder)
     
     def _get_prefs_location(self):
         """ Returns the location of the preferences file of the
@@ -81,7 +108,14 @@ class User(object):
         return d
     
     def _get_conf(self):
-        """ Returns the json preferences for the specified user. """
+        """ Returns the json preferences for the specified user.
+
+        The file is only parsed again if it has changed since last time.
+        """
+        stat = _stat(self._conffile)
+        cached = _cache.get(self._conffile)
+        if cached is not None and cached[0] == stat:
+            return copy.deepcopy(cached[1])
         try:
             with open(self._conffile) as f:
                 conf = json.loads(f.read())
@@ -89,6 +123,8 @@ class User(object):
             conf = self._get_default_conf()
         except ValueError:
             conf = self._get_default_conf()
+        with _cache_lock:
+            _cache[self._conffile] = (stat, copy.deepcopy(conf))
         return conf
     
     def __getattr__(self, name):
@@ -98,9 +134,26 @@ class User(object):
         return self.__dict__[name]
 
     def __setattr__(self, name, value):
-        """ Saves the preferences if autosave is set. """
+        """ Saves the preferences if autosave is set.
+
+        Changes made within _AUTOSAVE_DELAY seconds of each other are saved
+        with a single write. Call flush() to save pending changes right away.
+        """
         self.__dict__[name] = value
         if self._autosave and not name.startswith('_'):
+            self._save_later()
+
+    def _save_later(self):
+        if self.__dict__.get('_save_timer') is not None:
+            return
+        timer = threading.Timer(_AUTOSAVE_DELAY, self.flush)
+        timer.daemon = True
+        self.__dict__['_save_timer'] = timer
+        timer.start()
+
+    def flush(self):
+        """ Save now if autosave has changes waiting to be saved """
+        if self.__dict__.get('_save_timer') is not None:
             self.save()
 
     def set_pref(self, name, value):
@@ -114,15 +167,30 @@ class User(object):
         return d
     
     def save(self):
-        """ Saves  the preferences in JSON format. """
+        """ Saves  the preferences in JSON format.
+
+        The file is written to a temporary file first and then renamed, so
+        readers never see a half written file.
+        """
+        timer = self.__dict__.pop('_save_timer', None)
+        if timer is not None:
+            timer.cancel()
         d = self.to_dict()
         try:
-            with open(self._conffile, 'w') as f:
-                f.write(json.dumps(d))
-        except IOError:
+            fd, tempname = tempfile.mkstemp(dir=os.path.dirname(self._conffile), prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(json.dumps(d))
+                os.rename(tempname, self._conffile)
+            except Exception:
+                os.remove(tempname)
+                raise
+        except (IOError, OSError):
             raise Exception("Couldn't write settings into file %s. Be sure to "
                             "have write permissions on the parent folder."
                             % self._conffile)
+        with _cache_lock:
+            _cache[self._conffile] = (_stat(self._conffile), copy.deepcopy(d))
         self.trigger_hooks()
 
     def trigger_hooks(self):
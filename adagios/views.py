@@ -26,6 +26,7 @@ import time
 import logging
 import adagios.settings
 import adagios.utils
+import adagios.status.utils
 from adagios.exceptions import AccessDenied
 
 
@@ -45,6 +46,8 @@ def adagios_decorator(view_func):
             end_time = time.time()
             time_now = time.ctime()
             duration = end_time - start_time
+            adagios.status.utils.record_query_cache_statistics(request, view_func.__name__)
+            adagios.status.utils.report_unread_columns(request, view_func.__name__)
             return result
         except Exception as e:
             c = {}
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Work a fresh worker process does before it serves its first request.
+#
+# Without it, the first user to reach a new worker waits for the nagios
+# configuration to be parsed, templates to be compiled and livestatus sockets
+# to be opened. adagios.wsgi calls warm_up() when wsgi_warmup is enabled.
+
+from __future__ import unicode_literals
+import logging
+import time
+
+import adagios.settings
+
+logger = logging.getLogger(__name__)
+
+# Templates behind the pages users visit the most
+WARMUP_TEMPLATES = [
+    'status_index.html',
+    'status_dashboard.html',
+    'status_problems.html',
+    'status_services.html',
+    'status_host.html',
+    'status_detail.html',
+    'status_hostgroups.html',
+]
+
+# (step, seconds, error) for every step of the last warm_up() in this process
+timings = []
+
+
+def parse_nagios_config():
+    """ Parse nagios.cfg and every object definition it points to """
+    import pynag.Model
+    import adagios.maincfg
+    pynag.Model.cfg_file = adagios.settings.nagios_config
+    adagios.maincfg.get_facts()
+    pynag.Model.ObjectDefinition.objects.all
+
+
+def compile_templates():
+    """ Compile the most used templates, see WARMUP_TEMPLATES """
+    from django.template.loader import get_template
+    for template_name in WARMUP_TEMPLATES:
+        get_template(template_name)
+
+
+def open_livestatus_connections():
+    """ Open a pooled livestatus connection to every backend """
+    import adagios.status.utils
+    livestatus = adagios.status.utils.livestatus(None)
+    livestatus.query('GET status', 'Columns: program_start')
+
+
+def load_business_processes():
+    """ Read every business process definition """
+    import adagios.bi
+    adagios.bi.get_all_processes()
+
+
+STEPS = [
+    ('nagios_config', parse_nagios_config),
+    ('templates', compile_templates),
+    ('livestatus', open_livestatus_connections),
+    ('business_processes', load_business_processes),
+]
+
+
+def warm_up(steps=None):
+    """ Run every warm-up step, a step that fails does not stop the others
+
+    Returns:
+        List of (step, seconds, error) tuples. error is None if the step worked.
+    """
+    if steps is None:
+        steps = STEPS
+    result = []
+    for name, function in steps:
+        start_time = time.time()
+        error = None
+        try:
+            function()
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        seconds = time.time() - start_time
+        if error:
+            logger.warning("Warm-up step %s failed after %.3fs: %s", name, seconds, error)
+        else:
+            logger.info("Warm-up step %s took %.3fs", name, seconds)
+        result.append((name, seconds, error))
+    timings[:] = result
+    return result
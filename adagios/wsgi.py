@@ -6,6 +6,12 @@ from django.conf import settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adagios.settings')
 _application = get_wsgi_application()
 
+# Do the slow parts of the first request before this worker gets any traffic
+import adagios.settings
+if adagios.settings.wsgi_warmup:
+    import adagios.warmup
+    adagios.warmup.warm_up()
+
 # Here is the important part
 def application(environ, start_response):
     script_name = getattr(settings, 'FORCE_SCRIPT_NAME', None)
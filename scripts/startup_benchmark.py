@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Adagios is a web based Nagios configuration interface
+#
+# Copyright (C) 2014, Pall Sigurdsson <palli@opensource.is>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+startup_benchmark .. Measures how long a fresh worker takes to serve its first page
+
+Every run starts a new python process, the same way a web server starts a
+new worker after a restart, and times three steps in it:
+
+  import   -- import adagios
+  wsgi     -- import adagios.wsgi, which sets up django
+  first    -- the first request through adagios.wsgi.application
+"""
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+from optparse import OptionParser
+
+# Runs inside every fresh process, prints the timings as json
+_CHILD = '''
+import json, os, sys, time
+from wsgiref.util import setup_testing_defaults
+timings = {}
+start = time.time()
+import adagios
+timings['import'] = time.time() - start
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'adagios.settings')
+import adagios.wsgi
+timings['wsgi'] = time.time() - start
+environ = {'PATH_INFO': sys.argv[1], 'REMOTE_USER': sys.argv[2]}
+setup_testing_defaults(environ)
+status = []
+body = adagios.wsgi.application(environ, lambda s, headers, exc_info=None: status.append(s))
+for chunk in body:
+    pass
+timings['first'] = time.time() - start
+timings['status'] = status[0] if status else None
+print(json.dumps(timings))
+'''
+
+STEPS = ['import', 'wsgi', 'first']
+
+
+def run_once(path, user):
+    output = subprocess.check_output([sys.executable, '-c', _CHILD, path, user], env=os.environ.copy())
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--path', dest='path', default='/rest/adagios/json/get_notifications',
+                      help="Path of the first request (default: %default)")
+    parser.add_option('--user', dest='user', default='nagiosadmin',
+                      help="REMOTE_USER of the first request (default: %default)")
+    parser.add_option('--runs', dest='runs', type='int', default=5,
+                      help="Number of fresh processes to start (default: %default)")
+    (options, args) = parser.parse_args()
+
+    results = [run_once(options.path, options.user) for i in range(options.runs)]
+    statuses = set(x['status'] for x in results)
+    print("%s runs, first request to %s answered with %s" % (options.runs, options.path, ', '.join(map(str, statuses))))
+    print("%-8s %10s %10s %10s" % ('step', 'min', 'median', 'max'))
+    for step in STEPS:
+        values = sorted(x[step] for x in results)
+        print("%-8s %9.3fs %9.3fs %9.3fs" % (step, values[0], values[len(values) // 2], values[-1]))
+
+
+if __name__ == '__main__':
+    main()